@@ -86,72 +86,11 @@ class ToolsProcessor:
         """
         logger.info(f"Starting tool request processing: {content}")
 
-        # —— 新增：如果是 SEPSIS 指令，直接运行本地管道脚本 —— 
+        # —— 新增：如果是 SEPSIS 指令，交给常驻管道工作进程运行 —— 
         if content == "SEPSIS":
-            import subprocess
-            from pathlib import Path
-            import sys
-            import time
-            
-            root = Path(__file__).resolve().parent.parent.parent
-            cmds = [
-                "python -m sepsis.1_load",
-                "python -m sepsis.2_impute",
-                "python -m sepsis.3_feature",
-                "python -m sepsis.4_train",
-                "python -m sepsis.5_evaluate",
-                "python -m sepsis.6_explain",
-                "python -m sepsis.7_predict",
-            ]
-            logs = []
-            
-            # 添加进度显示
-            total_steps = len(cmds)
-            
-            for i, c in enumerate(cmds, 1):
-                step_name = c.split(".")[-1]
-                progress_msg = f"[{i}/{total_steps}] 运行: {c} ({step_name})..."
-                
-                # 在控制台显示进度
-                print(progress_msg, file=sys.stderr)
-                sys.stderr.flush()
-                
-                # 记录开始时间
-                start_time = time.time()
-                
-                # 运行命令并捕获输出
-                proc = subprocess.run(c.split(), cwd=str(root), capture_output=True, text=True)
-                
-                # 计算运行时间
-                elapsed_time = time.time() - start_time
-                
-                # 显示命令执行结果状态
-                status = "成功" if proc.returncode == 0 else "失败"
-                status_msg = f"[{i}/{total_steps}] {step_name} {status} (耗时: {elapsed_time:.2f}秒)"
-                print(status_msg, file=sys.stderr)
-                sys.stderr.flush()
-                
-                # 实时显示输出
-                if proc.stdout:
-                    print(f"--- 标准输出 ---\n{proc.stdout}", file=sys.stderr)
-                    sys.stderr.flush()
-                if proc.stderr:
-                    print(f"--- 错误输出 ---\n{proc.stderr}", file=sys.stderr)
-                    sys.stderr.flush()
-                
-                # 添加到日志
-                logs.append(f"$ {c}\n状态: {status} (耗时: {elapsed_time:.2f}秒)\n--- 输出 ---\n{proc.stdout}{proc.stderr}")
-                
-                # 如果命令执行失败，中止流程
-                if proc.returncode != 0:
-                    print(f"命令执行失败，停止流程: {c}", file=sys.stderr)
-                    sys.stderr.flush()
-                    break
-            
-            print("所有流程执行完毕", file=sys.stderr)
-            sys.stderr.flush()
-            
-            return "\n\n".join(logs)
+            # 在线程池中等待，避免阻塞事件循环
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, ToolsProcessor.run_sepsis_pipeline, True)
             # —— 新增部分结束 ——
                 
         try:
@@ -215,6 +154,42 @@ class ToolsProcessor:
             if progress_callback:
                 progress_callback("Resource cleanup and logging restoration complete")
     
+    @staticmethod
+    def run_sepsis_pipeline(verbose=False):
+        """
+        Run the sepsis pipeline (1_load ... 8_drift) in the long-lived pipeline worker
+
+        Stages run in-process as a DAG and hand DataFrames/models to each other
+        in memory, so only the first request pays the import cost.
+
+        Parameters:
+            verbose (bool): Echo progress and stage output to stderr
+
+        Returns:
+            str: Console logs of every executed stage
+        """
+        from sepsis.pipeline import get_worker
+
+        def report(msg):
+            if verbose:
+                print(msg, file=sys.stderr)
+                sys.stderr.flush()
+
+        results = get_worker(project_root).run(progress_callback=report)
+
+        logs = []
+        for r in results:
+            status = ("成功" if r.ok else "失败") + ("（缓存）" if r.cached else "")
+            if verbose and r.output:
+                print(f"--- {r.name} 输出 ---\n{r.output}", file=sys.stderr)
+                sys.stderr.flush()
+            logs.append(f"$ {r.module}\n状态: {status} (耗时: {r.elapsed:.2f}秒)\n--- 输出 ---\n{r.output}")
+            if not r.ok:
+                report(f"阶段执行失败，停止流程: {r.module}")
+
+        report("所有流程执行完毕")
+        return "\n\n".join(logs)
+
     @staticmethod
     def process_tools_request(content):
         """Synchronous wrapper function for processing tool requests with progress"""
@@ -328,24 +303,8 @@ class ToolsProcessor:
         #     # If TOOLS status is FALSE, just return cleaned message
         #     return cleaned_message
         if tools_content == "SEPSIS":
-            import subprocess
-            root = Path(__file__).resolve().parent.parent.parent
-            cmds = [
-                "python -m sepsis.1_load",
-                "python -m sepsis.2_impute",
-                "python -m sepsis.3_feature",
-                "python -m sepsis.4_train",
-                "python -m sepsis.5_evaluate",
-                "python -m sepsis.6_explain",
-                "python -m sepsis.7_predict",
-            ]
-            logs = []
-            for c in cmds:
-                proc = subprocess.run(c.split(), cwd=str(root), capture_output=True, text=True)
-                logs.append(f"$ {c}\n{proc.stdout}{proc.stderr}")
-                if proc.returncode != 0:
-                    break 
-            return cleaned_message + "\n\n[Sepsis Pipeline Logs]\n" + "\n".join(logs)
+            logs = ToolsProcessor.run_sepsis_pipeline()
+            return cleaned_message + "\n\n[Sepsis Pipeline Logs]\n" + logs
         
         if tools_status:
             tools_result = ToolsProcessor.process_tools_request(tools_content)
@@ -1,29 +1,119 @@
 # 文件：sepsis/1_load.py
 import os
+import sys
+import numpy as np
 import pandas as pd
 
-def main():
-    # 根目录
-    ROOT_DIR = os.getcwd()
-    # sepsis 模块目录
-    SEPSIS_DIR = os.path.join(ROOT_DIR, 'sepsis')
-    # 中间数据存放
-    DATA_DIR = os.path.join(SEPSIS_DIR, 'data')
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-    ####################################
-    ####################################
+from sepsis.artifacts import artifact_path, run_standalone
+from sepsis.store import write_partitions
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+INPUTS  = ()
+OUTPUTS = ('train_raw', 'test_raw')
+# 原始数据文件（相对 sepsis 目录），参与缓存指纹
+SOURCES = ('training_data.csv', 'test_data.csv')
+PARAMS  = {
+    # 每块读取的行数，也是每个输出分区的大小；决定了加载阶段的内存上限
+    'chunksize':   500_000,
+    # 显式列类型；未列出的数值列（生命体征、化验值）按 float_dtype 存储
+    'schema': {
+        'icustayid':     'int32',
+        'charttime':     'int64',
+        'mortality_90d': 'int8',
+    },
+    'float_dtype': 'float32',
+    # 推断列类型时读取的样本行数
+    'sample_rows': 10_000,
+}
+
+
+def infer_schema(csv_path):
+    """显式类型 + 从样本行推断其余列：数值列一律降为 float_dtype"""
+    sample = pd.read_csv(csv_path, nrows=PARAMS['sample_rows'])
+    schema = {}
+    for col, dtype in sample.dtypes.items():
+        if col in PARAMS['schema']:
+            schema[col] = PARAMS['schema'][col]
+        elif pd.api.types.is_numeric_dtype(dtype):
+            schema[col] = PARAMS['float_dtype']
+        else:
+            schema[col] = 'object'
+    return schema
+
+
+def apply_int_schema(chunk, schema):
+    """
+    整数列先按默认 int64 / float64 读入，检查后再压缩
+    （read_csv 直接读成 int32 时溢出不会报错，而是悄悄回绕）
+    """
+    for col, dtype in schema.items():
+        target = np.dtype(dtype)
+        if target.kind not in 'iu' or col not in chunk:
+            continue
+        s = chunk[col]
+        if s.isna().any():
+            raise ValueError(f"列 {col} 含缺失值，无法存为 {dtype}；请在 PARAMS['schema'] 中改为浮点类型")
+        info = np.iinfo(target)
+        if len(s) and (s.min() < info.min or s.max() > info.max):
+            raise ValueError(f"列 {col} 的取值超出 {dtype} 范围；请在 PARAMS['schema'] 中改用更宽的类型")
+        chunk[col] = s.astype(target)
+    return chunk
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float('nan')
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_chunks(csv_path, schema, label, stats):
+    """按块读取 CSV 并按 schema 压缩类型，内存中同时只保留一块"""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    schema = {col: dtype for col, dtype in schema.items() if col in header}
+    # 浮点列直接按目标类型解析，省掉 float64 中间结果
+    read_dtypes = {col: dtype for col, dtype in schema.items() if np.dtype(dtype).kind == 'f'}
+
+    for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=PARAMS['chunksize'], dtype=read_dtypes)):
+        chunk = apply_int_schema(chunk, schema)
+        stats['rows'] += len(chunk)
+        mem = chunk.memory_usage(index=False, deep=True).sum() / 1024 ** 2
+        wide = len(chunk) * chunk.shape[1] * 8 / 1024 ** 2
+        print(f"   [{label}] 分块 {i}: {len(chunk)} 行, 本块 {mem:.1f} MB "
+              f"(全部 64 位约 {wide:.1f} MB), 进程峰值内存 {peak_rss_mb():.1f} MB")
+        yield chunk
+
+
+def load_partitioned(csv_path, out_dir, schema, label):
+    """逐块写成分区，返回 (PartitionedFrame, 总行数)"""
+    stats = {'rows': 0}
+    parts = write_partitions(read_chunks(csv_path, schema, label, stats), out_dir)
+    return parts, stats['rows']
+
+
+def run(dirs):
     # 原始 CSV 路径
-    train_csv = os.path.join(SEPSIS_DIR, 'training_data.csv')
-    test_csv  = os.path.join(SEPSIS_DIR, 'test_data.csv')
+    train_csv = os.path.join(dirs.sepsis, SOURCES[0])
+    test_csv  = os.path.join(dirs.sepsis, SOURCES[1])
+
+    # 训练集推断出的列类型同样用于测试集，保证两边一致
+    schema = infer_schema(train_csv)
+    print(f"1. 列类型: {schema}")
+
+    print("2. 分块加载原始数据...")
+    train, n_train = load_partitioned(train_csv, artifact_path('train_raw', dirs), schema, 'train')
+    test,  n_test  = load_partitioned(test_csv,  artifact_path('test_raw',  dirs), schema, 'test')
 
-    train = pd.read_csv(train_csv)
-    test  = pd.read_csv(test_csv)
+    print(f'✅ 原始数据已加载：训练集 {n_train} 行 / {len(train)} 个分区，测试集 {n_test} 行 / {len(test)} 个分区')
+    return {'train_raw': train, 'test_raw': test}
 
-    # 保存为二进制中间文件
-    train.to_pickle(os.path.join(DATA_DIR, 'train_raw.pkl'))
-    test .to_pickle(os.path.join(DATA_DIR, 'test_raw.pkl'))
-    print(f'✅ 原始数据已加载并保存到 {DATA_DIR}')
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
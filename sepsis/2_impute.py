@@ -1,29 +1,73 @@
 # 文件：sepsis/2_impute.py
-import os
+import sys
+from functools import partial
+
 import numpy as np
-import pandas as pd
-from sklearn.impute import SimpleImputer
 
-def main():
-    ROOT_DIR   = os.getcwd()
-    SEPSIS_DIR = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR   = os.path.join(SEPSIS_DIR, 'data')
+from sepsis.artifacts import artifact_path, run_standalone
+from sepsis.imputation import (StreamingMedian, feature_columns, fit_medians, impute_frame,
+                               mask_zeros_, medians_for, to_block, to_record)
+from sepsis.store import map_partitions
+
+INPUTS  = ('train_raw', 'test_raw')
+OUTPUTS = ('train_imputed', 'test_imputed', 'impute_medians')
+PARAMS  = {
+    # exact：所有训练行拼进一块 float32 数组求精确中位数
+    # sketch：逐分区流式更新分位数草图，内存与数据量无关（适合超出内存的数据）
+    'mode':     'exact',
+    'sketch_k': 2048,
+    # 填补阶段按分区并行的进程数（None 为本阶段的 CPU 预算，见 sepsis/budget.py；只有一个分区时串行）
+    'n_jobs':   None,
+}
 
-    train = pd.read_pickle(os.path.join(DATA_DIR, 'train_raw.pkl'))
-    test  = pd.read_pickle(os.path.join(DATA_DIR, 'test_raw.pkl'))
 
+def fit_exact(parts, feat):
+    frames = list(parts.iter_parts())
+    n_rows = sum(len(df) for df in frames)
+    block = np.empty((n_rows, len(feat)), dtype=np.float32, order='F')
+    offset = 0
+    for df in frames:
+        to_block(df, feat, out=block, offset=offset)
+        offset += len(df)
+    del frames
     # 将 0 视作缺失
-    feat = [c for c in train.columns if c not in ('icustayid','charttime','mortality_90d','gender')]
-    train[feat] = train[feat].replace(0, np.nan)
-    test [feat] = test [feat].replace(0, np.nan)
+    mask_zeros_(block)
+    return fit_medians(block), n_rows
+
+
+def fit_sketch(parts, feat):
+    sketch = StreamingMedian(len(feat), k=PARAMS['sketch_k'])
+    n_rows = 0
+    for df in parts.iter_parts():
+        sketch.update(mask_zeros_(to_block(df, feat)))
+        n_rows += len(df)
+    return sketch.medians(), n_rows
+
 
-    imputer = SimpleImputer(strategy='median')
-    train[feat] = imputer.fit_transform(train[feat])
-    test [feat] = imputer.transform(test [feat])
+def run(dirs, train_raw, test_raw):
+    feat = feature_columns(next(train_raw.iter_parts()).columns)
 
-    train.to_pickle(os.path.join(DATA_DIR, 'train_imputed.pkl'))
-    test .to_pickle(os.path.join(DATA_DIR, 'test_imputed.pkl'))
-    print(f'✅ 缺失值已填补并保存到 {DATA_DIR}')
+    print(f"1. 拟合中位数（{PARAMS['mode']} 模式，{len(feat)} 个特征列）...")
+    if PARAMS['mode'] == 'sketch':
+        medians, n_rows = fit_sketch(train_raw, feat)
+    elif PARAMS['mode'] == 'exact':
+        medians, n_rows = fit_exact(train_raw, feat)
+    else:
+        raise ValueError(f"未知的填补模式: {PARAMS['mode']}")
+    record = to_record(feat, medians, PARAMS['mode'], n_rows)
+
+    # 训练集和测试集都只用保存下来的中位数逐分区填补
+    print("2. 逐分区填补训练集和测试集...")
+    fill = partial(impute_frame, feat=feat, medians=medians_for(record, feat))
+    train = map_partitions(fill, train_raw, artifact_path('train_imputed', dirs), PARAMS['n_jobs'])
+    test  = map_partitions(fill, test_raw,  artifact_path('test_imputed',  dirs), PARAMS['n_jobs'])
+
+    print(f'✅ 缺失值已填补（基于 {n_rows} 行训练数据）')
+    return {'train_imputed': train, 'test_imputed': test, 'impute_medians': record}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
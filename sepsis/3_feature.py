@@ -1,29 +1,87 @@
 # 文件：sepsis/3_feature.py
-import os
+import sys
+import numpy as np
 import pandas as pd
+from joblib import effective_n_jobs
+
+from sepsis.artifacts import run_standalone
+from sepsis.drift import Sketch
+from sepsis.groupagg import DEFAULT_FUNCS, agg_frame, agg_shared
+from sepsis.imputation import to_block
+from sepsis.shm import SharedArrays
+
+INPUTS  = ('train_imputed', 'test_imputed')
+# feature_sketch：训练集各特征的直方图草图，漂移检查（8_drift、打分服务）用它对照新数据
+OUTPUTS = ('X_train', 'y_train', 'X_test', 'feature_sketch')
+PARAMS  = {
+    # 每个住院的聚合方式；可选 first / last / mean / max / min / std / count
+    'agg_funcs': DEFAULT_FUNCS,
+    # 分区并行：住院按 icustayid 哈希分区，在进程池中聚合（None 为本阶段的 CPU 预算）
+    'n_jobs': None,
+    # 哈希分区数，None 时取进程数的 2 倍
+    'n_partitions': None,
+    # 行数少于该值时直接串行，省掉进程池启动开销
+    'parallel_min_rows': 1_000_000,
+    # 漂移草图每个特征的分位数箱数（见 sepsis/drift.py）
+    'sketch_bins': 100,
+}
+
 
 def extract_agg(df):
-    grp = df.groupby('icustayid')
-    agg = grp.agg(['last','mean','max','min'])
-    agg.columns = ['_'.join(col).strip() for col in agg.columns.values]
-    return agg
+    # 按 icustayid 排序一次，在连续数组上一遍算完所有聚合（见 sepsis/groupagg.py）
+    return agg_frame(df, key='icustayid', funcs=PARAMS['agg_funcs'])
+
+
+def extract_agg_parallel(frames, drop):
+    """
+    分区直接拷进共享内存（icustayid + float32 特征块），不先拼成完整 DataFrame；
+    工作进程挂载同一块内存，各自聚合一个哈希分区
+    """
+    cols = [c for c in frames[0].columns if c not in drop and c != 'icustayid']
+    n_rows = sum(len(df) for df in frames)
+    with SharedArrays() as shared:
+        keys = shared.empty('keys', (n_rows,), frames[0]['icustayid'].dtype)
+        values = shared.empty('values', (n_rows, len(cols)), np.float32, order='F')
+        offset = 0
+        for df in frames:
+            keys[offset:offset + len(df)] = df['icustayid'].to_numpy()
+            to_block(df, cols, out=values, offset=offset)
+            offset += len(df)
+        del frames, keys, values
+        return agg_shared(shared, cols, key='icustayid', funcs=PARAMS['agg_funcs'],
+                          n_jobs=PARAMS['n_jobs'], n_parts=PARAMS['n_partitions'])
 
-def main():
-    ROOT_DIR   = os.getcwd()
-    SEPSIS_DIR = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR   = os.path.join(SEPSIS_DIR, 'data')
 
-    train = pd.read_pickle(os.path.join(DATA_DIR, 'train_imputed.pkl'))
-    test  = pd.read_pickle(os.path.join(DATA_DIR, 'test_imputed.pkl'))
+def features(parts, drop):
+    frames = list(parts.iter_parts())
+    n_rows = sum(len(df) for df in frames)
+    n_jobs = effective_n_jobs(PARAMS['n_jobs'])
+    if n_jobs > 1 and n_rows >= PARAMS['parallel_min_rows']:
+        print(f"   {n_rows} 行，{n_jobs} 个进程分区并行聚合")
+        return extract_agg_parallel(frames, drop)
+    # 分区拼成完整表
+    df = pd.concat(frames, ignore_index=True)
+    del frames
+    return extract_agg(df.drop(columns=list(drop)))
 
-    X_train = extract_agg(train.drop(columns=['charttime','mortality_90d']))
-    y_train = train.groupby('icustayid')['mortality_90d'].first()
-    X_test  = extract_agg(test .drop(columns=['charttime']))
 
-    X_train.to_csv(os.path.join(DATA_DIR, 'X_train.csv'))
-    y_train.to_csv(os.path.join(DATA_DIR, 'y_train.csv'), header=True)
-    X_test .to_csv(os.path.join(DATA_DIR, 'X_test.csv'))
-    print(f'✅ 特征工程完成，文件保存到 {DATA_DIR}')
+def run(dirs, train_imputed, test_imputed):
+    X_train = features(train_imputed, drop=('charttime', 'mortality_90d'))
+    X_test  = features(test_imputed,  drop=('charttime',))
+
+    # 标签只有一列，逐分区取出后按住院取第一条
+    labels = pd.concat([df[['icustayid', 'mortality_90d']] for df in train_imputed.iter_parts()],
+                       ignore_index=True)
+    y_train = labels.groupby('icustayid')['mortality_90d'].first()
+
+    sketch = Sketch.build(X_train, bins=PARAMS['sketch_bins'])
+
+    print(f'✅ 特征工程完成：X_train {X_train.shape}，X_test {X_test.shape}')
+    return {'X_train': X_train, 'y_train': y_train, 'X_test': X_test, 'feature_sketch': sketch.to_dict()}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
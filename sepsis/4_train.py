@@ -1,49 +1,89 @@
 # 文件：sepsis/4_train.py
 import os
-import joblib
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, cross_val_score, ParameterGrid
+import sys
+import numpy as np
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import f1_score
-from tqdm.auto import tqdm
 
-def main():
-    ROOT_DIR    = os.getcwd()
-    SEPSIS_DIR  = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR    = os.path.join(SEPSIS_DIR, 'data')
-    MODELS_DIR  = os.path.join(SEPSIS_DIR, 'models')
-    os.makedirs(MODELS_DIR, exist_ok=True)
+from sepsis.artifacts import run_standalone
+from sepsis.compiled import compile_model
+from sepsis.cvstore import CVStore
+from sepsis.engines import get_engine
+from sepsis.search import FoldBlock, halving_search, search_cost, stratified_folds
+
+INPUTS  = ('X_train', 'y_train')
+# model 是 sklearn 对象（解释步骤和增量更新要用），model_compiled 是评估 / 预测用的紧凑格式
+OUTPUTS = ('model', 'model_compiled')
+PARAMS  = {
+    # 模型引擎：rf（随机森林）或 hgb（直方图梯度提升，适合大队列，原生支持缺失值），见 sepsis/engines.py
+    'engine': 'rf',
+    # 各引擎的搜索空间；n_estimators / max_iter 同时是逐级加大的资源
+    'param_grid': {
+        'rf': {
+            'n_estimators': [100, 200],
+            'max_depth':    [None, 10, 20],
+        },
+        'hgb': {
+            'max_iter':       [100, 200],
+            'learning_rate':  [0.05, 0.1],
+            'max_leaf_nodes': [15, 31],
+        },
+    },
+    'cv':           5,
+    'test_size':    0.2,
+    'random_state': 42,
+    # 逐级减半搜索：树数从 min_resource 起逐级翻倍（warm start 加树，不重训），
+    # 每级保留 1/factor 的候选；factor=1 时不淘汰，等价于完整网格搜索
+    'search': {
+        'factor':       2,
+        'min_resource': 25,
+        # None 为本阶段的 CPU 预算（见 sepsis/budget.py）
+        'n_jobs':       None,
+        # 交叉验证结果库（data 目录下的 SQLite 文件），中断或改网格后续跑；None 为不使用
+        'store':        'cv_results.sqlite',
+    },
+}
 
-    # 读取特征和标签
-    X = pd.read_csv(os.path.join(DATA_DIR, 'X_train.csv'), index_col=0)
-    y = pd.read_csv(os.path.join(DATA_DIR, 'y_train.csv'), index_col=0).values.ravel()
+
+def run(dirs, X_train, y_train):
+    # 特征和标签
+    X = X_train
+    y = np.asarray(y_train).ravel()
 
     X_tr, X_val, y_tr, y_val = train_test_split(
-        X, y, test_size=0.2, stratify=y, random_state=42
+        X, y, test_size=PARAMS['test_size'], stratify=y, random_state=PARAMS['random_state']
     )
 
-    # 手动网格搜索参数
-    param_grid = {
-        'n_estimators': [100, 200],
-        'max_depth':    [None, 10, 20]
-    }
-    best_score = -1.0
-    best_params = None
-
-    print("🔍 开始手动网格搜索（5 折交叉验证）…")
-    for params in tqdm(ParameterGrid(param_grid), desc="GridSearch"):
-        model = RandomForestClassifier(random_state=42, **params)
-        # 并行计算交叉验证分数
-        scores = cross_val_score(model, X_tr, y_tr, cv=5, scoring='f1', n_jobs=-1)
-        mean_score = scores.mean()
-        tqdm.write(f"  参数 {params} 的平均 F1 = {mean_score:.4f}")
-        if mean_score > best_score:
-            best_score, best_params = mean_score, params
-
+    engine = get_engine(PARAMS['engine'])
+    if not engine.allow_nan and X_tr.isna().to_numpy().any():
+        raise ValueError(f"{engine.label}不接受缺失值，请先填补或改用 hgb 引擎")
+    search = PARAMS['search']
+    # 单个模型自带多线程的引擎，外层不再并行，避免线程数相乘
+    n_jobs = 1 if engine.threaded else search['n_jobs']
+    # 按折重排成一整块，各折的训练 / 验证集都是它的视图（见 sepsis/search.py）
+    data = FoldBlock(X_tr, y_tr, stratified_folds(y_tr, PARAMS['cv']))
+    store = CVStore(os.path.join(dirs.data, search['store'])) if search['store'] else None
+    print(f"🔍 开始逐级减半搜索（{engine.label}，{PARAMS['cv']} 折交叉验证，每级保留 1/{search['factor']}）…")
+    try:
+        best_params, best_score, history = halving_search(
+            engine.make(random_state=PARAMS['random_state']),
+            PARAMS['param_grid'][engine.name], data, resource=engine.resource,
+            min_resource=search['min_resource'], factor=search['factor'], n_jobs=n_jobs,
+            store=store,
+        )
+        fit_seconds, n_trials = search_cost(history)
+        print(f"⏱️ 共 {n_trials} 次（候选 × 折 × 级）评估，累计训练 {fit_seconds:.1f} 秒")
+        if store is not None:
+            # 各配置的训练成本（warm start 的记录只含增量），完整报告：python -m sepsis.cvstore
+            report = store.cost_report(data.fingerprint)
+            print(report[['folds', 'mean_score', 'fit_seconds', 'fit_per_fold']].to_string())
+    finally:
+        if store is not None:
+            store.close()
     print(f"✅ 最佳参数：{best_params}，交叉验证平均 F1 = {best_score:.4f}")
 
     # 用最佳参数在训练子集上训练最终模型
-    best_model = RandomForestClassifier(random_state=42, **best_params)
+    best_model = engine.make(random_state=PARAMS['random_state'], **best_params)
     best_model.fit(X_tr, y_tr)
 
     # 在验证集上评估
@@ -51,9 +91,11 @@ def main():
     val_f1 = f1_score(y_val, preds)
     print(f"🔍 验证集 F1 = {val_f1:.4f}")
 
-    # 保存模型
-    joblib.dump(best_model, os.path.join(MODELS_DIR, 'rf_model.pkl'))
-    print(f"✅ 模型已保存到 {MODELS_DIR}")
+    return {'model': best_model, 'model_compiled': compile_model(best_model)}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
@@ -1,34 +1,91 @@
 # 文件：sepsis/5_evaluate.py
+import importlib
+import json
 import os
-import joblib
-import pandas as pd
-from sklearn.metrics import classification_report, roc_auc_score
+import sys
+import time
+import numpy as np
+from sklearn.model_selection import train_test_split
 
-def main():
-    ROOT_DIR      = os.getcwd()
-    SEPSIS_DIR    = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR      = os.path.join(SEPSIS_DIR, 'data')
-    WORKSPACE_DIR = os.path.join(ROOT_DIR, 'app', 'workspace')
-    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+from sepsis.artifacts import run_standalone
+from sepsis.compiled import predict_both
+from sepsis.engines import engine_for
+from sepsis.metrics import METRICS, MetricAccumulator
+
+INPUTS  = ('model_compiled', 'X_train', 'y_train')
+OUTPUTS = ()
+# 写入 app/workspace 的文件
+PRODUCTS = ('eval_report.txt', 'eval_metrics.json')
+PARAMS   = {
+    # True：在训练步骤留出的验证集上评估（与 4_train 相同的划分，模型没见过这些住院）；
+    # False：在全部训练数据上评估（含模型训练用过的数据，结果偏乐观）
+    'holdout':      True,
+    'batch_rows':   50_000,  # 逐批预测并累加直方图，内存不随评估集大小增长
+    'bins':         4096,    # 概率直方图的箱数（见 sepsis/metrics.py）
+    'threshold':    0.5,
+    'n_boot':       2000,    # bootstrap 重抽次数
+    'alpha':        0.05,    # 95% 置信区间
+    'random_state': 42,
+}
+
+# 留出集的划分参数取自训练步骤
+TRAIN = importlib.import_module('sepsis.4_train')
+
+
+def evaluation_rows(X, y):
+    """评估用的行：训练步骤留出的验证集，或全部训练数据"""
+    if not PARAMS['holdout']:
+        return X, y, "全部训练数据（含训练用过的住院，结果偏乐观）"
+    _, X_val, _, y_val = train_test_split(
+        X, y, test_size=TRAIN.PARAMS['test_size'], stratify=y, random_state=TRAIN.PARAMS['random_state'])
+    return X_val, y_val, "训练步骤留出的验证集（模型未见过）"
 
-    model = joblib.load(os.path.join(SEPSIS_DIR, 'models', 'rf_model.pkl'))
-    X     = pd.read_csv(os.path.join(DATA_DIR, 'X_train.csv'), index_col=0)
-    y     = pd.read_csv(os.path.join(DATA_DIR, 'y_train.csv'), index_col=0).values.ravel()
 
-    preds = model.predict(X)
-    probs = model.predict_proba(X)[:,1]
-    report = classification_report(y, preds)
-    auc    = roc_auc_score(y, probs)
+def run(dirs, model_compiled, X_train, y_train):
+    model = model_compiled
+    WORKSPACE_DIR = dirs.workspace
+    X, y, label = evaluation_rows(X_train, np.asarray(y_train).ravel())
+
+    # 逐批预测，只累加直方图
+    start = time.perf_counter()
+    acc = MetricAccumulator(bins=PARAMS['bins'], threshold=PARAMS['threshold'])
+    step = PARAMS['batch_rows']
+    for lo in range(0, len(X), step):
+        _, probs = predict_both(model, X.iloc[lo:lo + step])
+        acc.update(y[lo:lo + step], probs[:, 1])
+    point = acc.metrics()
+    ci = acc.bootstrap(PARAMS['n_boot'], PARAMS['alpha'], PARAMS['random_state'])
+    elapsed = time.perf_counter() - start
+    report = acc.classification_report()
+    level = f"{1 - PARAMS['alpha']:.0%}"
+
+    table = '\n'.join(f"{title}: {point[name]:.4f}（{level} 置信区间 {ci[name][0]:.4f} – {ci[name][1]:.4f}）"
+                      for name, title in METRICS.items())
 
     # 打印报告到控制台
     print("\n===== 模型评估报告 =====")
+    print(f"模型: {engine_for(model).label}（{model.n_trees} 棵树，{model.n_nodes} 个节点）")
+    print(f"评估数据: {label}，{acc.n} 条（死亡 {acc.n_pos} 条）")
     print(report)
-    print(f"AUC = {auc:.4f}")
+    print(f"AUC = {point['auc']:.4f}（{level} 置信区间 {ci['auc'][0]:.4f} – {ci['auc'][1]:.4f}）")
+    print(f"\n各指标与 bootstrap 置信区间（{PARAMS['n_boot']} 次重抽，阈值 {PARAMS['threshold']}）:")
+    print(table)
+    print(f"（直方图 AUC 与精确 AUC 之差不超过 {acc.tie_mass() / 2:.2e}；计算耗时 {elapsed:.2f} 秒）")
     print("======= 你可以根据这部分报告内容等会儿写进总结里 ======\n")
 
     with open(os.path.join(WORKSPACE_DIR, 'eval_report.txt'), 'w') as f:
-        f.write(report + f"\nAUC = {auc:.4f}\n")
+        f.write(f"评估数据: {label}，{acc.n} 条\n\n" + report + f"\nAUC = {point['auc']:.4f}\n\n" + table + '\n')
+    with open(os.path.join(WORKSPACE_DIR, 'eval_metrics.json'), 'w') as f:
+        json.dump({'data': label, 'n': acc.n, 'n_pos': acc.n_pos, 'threshold': PARAMS['threshold'],
+                   'confusion': acc.confusion().tolist(), 'n_boot': PARAMS['n_boot'], 'alpha': PARAMS['alpha'],
+                   'metrics': {name: {'value': point[name], 'ci': list(ci[name])} for name in METRICS}},
+                  f, ensure_ascii=False, indent=2)
     print(f'✅ 评估报告已保存到 {WORKSPACE_DIR}')
+    return {}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
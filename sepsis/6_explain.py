@@ -1,83 +1,98 @@
 # 文件：sepsis/6_explain.py
 import os
 import json
-import joblib
 import pandas as pd
-import shap
 import numpy as np
-import matplotlib.pyplot as plt
 import sys
-from contextlib import redirect_stdout, redirect_stderr
-
-
-def main():
-    ROOT_DIR      = os.getcwd()
-    SEPSIS_DIR    = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR      = os.path.join(SEPSIS_DIR, 'data')
-    WORKSPACE_DIR = os.path.join(ROOT_DIR, 'app', 'workspace')
-    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+import time
+
+from sepsis import plots
+from sepsis.artifacts import artifact_path, run_standalone
+from sepsis.engines import engine_for
+from sepsis.explain import adaptive_explain, explain
+from sepsis.shapstore import ShapStore
+
+# 另一种解释方法（置换重要性，只有全局重要性，快得多）是单独的阶段 6_permutation
+INPUTS  = ('model_compiled', 'X_train')
+# 整个 SHAP 矩阵按住院编号索引存盘，供逐条住院查询（sepsis/shapstore.py）
+OUTPUTS = ('shap_store',)
+# 写入 app/workspace 的文件
+PRODUCTS = ('shap_values.json', 'shap_feature_importance.png', 'shap_summary.png')
+PARAMS   = {
+    'max_samples':  1000,   # 随机采样，不超过1000条（并行 + 缓存后可以调大）
+    'chunk_size':   100,    # 每批处理100条
+    'random_state': 42,
+    # 抽样方式：'fixed' 固定抽 max_samples 条；'adaptive' 逐批增加，Top-k 排序稳定后停止
+    'sampling':     'fixed',
+    'adaptive_batch':       200,    # 自适应抽样每批至少这么多条（之后随已用条数增长）
+    'adaptive_max_samples': 20000,  # 自适应抽样的上限；None 表示可以用完全部数据
+    'top_k':        10,     # 自适应抽样要求排序稳定的前几名
+    'confidence':   0.95,   # Top-k 排序整体正确的置信度
+    'rank_tolerance': 0.02, # 平均 |SHAP| 相差不到较大者的 2% 视为并列，不要求分出先后
+    'n_jobs':       None,   # 进程数；None 取 CPU 预算分给本阶段的核数
+    'cache':        True,   # 模型和抽样数据不变时复用上次的 SHAP 矩阵
+    'explain_top':  3,      # 在输出里逐条解释模型输出最高的几条住院
+}
+
+def run(dirs, model_compiled, X_train):
+    model = model_compiled
+    WORKSPACE_DIR = dirs.workspace
 
     print("\n===== SHAP模型解释分析 =====")
     
-    # 加载模型和数据
-    print("1. 加载随机森林模型和训练数据...")
-    model = joblib.load(os.path.join(SEPSIS_DIR, 'models', 'rf_model.pkl'))
-    X     = pd.read_csv(os.path.join(DATA_DIR, 'X_train.csv'), index_col=0)
+    # 模型和数据
+    engine = engine_for(model)
+    print(f"1. 加载{engine.label}模型和训练数据...")
+    X     = X_train
     print(f"   数据集大小: {X.shape[0]}行, {X.shape[1]}列")
 
-    # 随机采样，不超过1000条
-    sample_size = min(1000, len(X))
-    sampled = X.sample(n=sample_size, random_state=42)
-    print(f"2. 随机抽样 {sample_size} 条记录用于SHAP分析")
-
-    # 初始化 SHAP 解释器
-    print("3. 初始化SHAP树解释器...")
-    explainer = shap.TreeExplainer(model)
-
-    # 分批计算 SHAP 值，使用简单的手动进度报告
-    print("4. 开始计算SHAP值...")
-    n = sampled.shape[0]
-    m = sampled.shape[1]
-    shap_matrix = np.zeros((n, m))
-    chunk_size = 100  # 每批处理100条
-    chunks = (n + chunk_size - 1) // chunk_size  # 计算总批次数
-    
-    # 创建空文件用于捕获输出
-    null_file = open(os.devnull, 'w')
-    
-    for i in range(chunks):
-        start = i * chunk_size
-        end = min(n, start + chunk_size)
-        progress = (i + 1) / chunks * 100
-        print(f"   处理批次 {i+1}/{chunks} ({progress:.1f}%)...")
-        
-        # 捕获所有输出
-        with redirect_stdout(null_file), redirect_stderr(null_file):
-            batch = sampled.iloc[start:end]
-            sv = explainer.shap_values(batch)
-            
-            # 处理不同版本 SHAP 输出格式
-            if isinstance(sv, list):
-                batch_vals = sv[1]
-            elif isinstance(sv, np.ndarray) and sv.ndim == 3:
-                batch_vals = sv[:, :, 1]
-            else:
-                batch_vals = sv
-                
-            shap_matrix[start:end] = batch_vals
-    
-    null_file.close()
-    print("   ✓ SHAP值计算完成")
+    path = artifact_path('model_compiled', dirs)
+    if engine.name == 'hgb':
+        # 梯度提升模型的 SHAP 值在 log-odds 尺度上，随机森林的在概率尺度上
+        print("   梯度提升模型：SHAP 值为 log-odds 尺度")
+    start = time.perf_counter()
+    if PARAMS['sampling'] == 'adaptive':
+        # 逐批加样本，Top-k 排序在给定置信度下稳定后停止（见 sepsis/explain.py）
+        print(f"2. 自适应抽样：每批至少 {PARAMS['adaptive_batch']} 条，"
+              f"直到Top-{PARAMS['top_k']}排序的置信度达到 {PARAMS['confidence']:.0%}")
+        print("3. 计算SHAP值（树解释器）...")
+        sampled, shap_matrix, expected, report, hit = adaptive_explain(
+            path, X, dirs, batch=PARAMS['adaptive_batch'], max_samples=PARAMS['adaptive_max_samples'],
+            top_k=PARAMS['top_k'], confidence=PARAMS['confidence'], tolerance=PARAMS['rank_tolerance'],
+            chunk_size=PARAMS['chunk_size'], n_jobs=PARAMS['n_jobs'], random_state=PARAMS['random_state'],
+            cache=PARAMS['cache'])
+        status = "已收敛" if report['converged'] else "未收敛（已用完样本上限）"
+        print(f"   {status}：用了 {report['n_samples']}/{report['n_total']} 条，"
+              f"Top-{report['top_k']}排序出错概率上界 {report['error_bound']:.4f}"
+              f"（最多检查 {report['n_looks']} 次，每次的水平 {report['alpha_per_look']:.4f}），"
+              f"平均 |SHAP| 的 {report['confidence']:.0%} 置信区间半宽不超过 {report['max_halfwidth']:.6f}")
+    else:
+        # 随机采样，不超过 max_samples 条
+        sample_size = min(PARAMS['max_samples'], len(X))
+        sampled = X.sample(n=sample_size, random_state=PARAMS['random_state'])[model.feature_names]
+        print(f"2. 随机抽样 {sample_size} 条记录用于SHAP分析")
+        # 编译后的模型文件由各工作进程按内存映射共享；结果按模型 + 数据指纹缓存（见 sepsis/explain.py）
+        print("3. 计算SHAP值（树解释器）...")
+        shap_matrix, expected, hit = explain(path, sampled, dirs, chunk_size=PARAMS['chunk_size'],
+                                             n_jobs=PARAMS['n_jobs'], cache=PARAMS['cache'])
+    elapsed = time.perf_counter() - start
+    if hit:
+        print(f"   ✓ 模型和抽样数据未变，直接读取缓存的SHAP值（{elapsed:.2f} 秒）")
+    else:
+        print(f"   ✓ SHAP值计算完成（{elapsed:.2f} 秒，基线输出 {expected:.4f}）")
 
     # 保存前10条样本的 SHAP 值到 JSON
-    print("5. 保存10条样本的SHAP值...")
+    print("4. 保存10条样本的SHAP值...")
     out = {str(idx): shap_matrix[i].tolist() for i, idx in enumerate(sampled.index[:10])}
     with open(os.path.join(WORKSPACE_DIR, 'shap_values.json'), 'w') as f:
         json.dump(out, f)
-    print("   ✓ SHAP值已保存")
+    store = ShapStore.build(shap_matrix, sampled.to_numpy(dtype=np.float32), sampled.index,
+                            sampled.columns, expected,
+                            scale='probability' if model.kind == 'forest' else 'log_odds')
+    print(f"   ✓ SHAP值已保存（完整的 {len(store)} 条住院另存为按住院编号索引的SHAP值库）")
 
     # 全局聚合：平均绝对 SHAP
-    print("6. 计算全局特征重要性...")
+    print("5. 计算全局特征重要性...")
     mean_abs = np.abs(shap_matrix).mean(axis=0)
     mean_shap = pd.Series(mean_abs, index=sampled.columns).sort_values(ascending=False)
     top20 = mean_shap.head(20)
@@ -89,21 +104,13 @@ def main():
     print("=============================")
 
     # 可视化：Top20 特征重要性
-    print("\n7. 生成Top20特征重要性条形图...")
+    print("\n6. 生成Top20特征重要性条形图...")
     
-    # 捕获matplotlib输出
-    null_file = open(os.devnull, 'w')
-    with redirect_stdout(null_file), redirect_stderr(null_file):
-        plt.figure(figsize=(12, 6))
-        top20.plot.bar()
-        plt.title("Top 20 Feature Importance by Mean |SHAP|")
-        plt.ylabel("Mean |SHAP value|")
-        plt.tight_layout()
-        feature_importance_path = os.path.join(WORKSPACE_DIR, "shap_feature_importance.png")
-        plt.savefig(feature_importance_path)
-        plt.close()
-    null_file.close()
-    print(f"   图表已保存到: {feature_importance_path}")
+    feature_importance_path = plots.submit(
+        'bar', os.path.join(WORKSPACE_DIR, "shap_feature_importance.png"),
+        values=top20.to_numpy(), labels=list(top20.index),
+        title="Top 20 Feature Importance by Mean |SHAP|", ylabel="Mean |SHAP value|", figsize=(12, 6))
+    print(f"   图表已提交后台绘制: {feature_importance_path}")
     
     # 解释特征重要性图
     print("\n特征重要性分析结果解释:")
@@ -114,17 +121,13 @@ def main():
     print(f"5. 特征重要性呈现长尾分布，表明大多数特征对模型贡献较小")
 
     # 可视化：SHAP Summary 图
-    print("\n8. 生成SHAP Summary蜂群图...")
+    print("\n7. 生成SHAP Summary蜂群图...")
     
-    # 捕获shap库输出
-    null_file = open(os.devnull, 'w')
-    with redirect_stdout(null_file), redirect_stderr(null_file):
-        shap.summary_plot(shap_matrix, sampled, show=False)
-        summary_path = os.path.join(WORKSPACE_DIR, "shap_summary.png")
-        plt.savefig(summary_path, bbox_inches='tight')
-        plt.close()
-    null_file.close()
-    print(f"   图表已保存到: {summary_path}")
+    # 蜂群图只能走 pyplot：后台线程持有绘图锁绘制
+    summary_path = plots.submit(
+        'shap_summary', os.path.join(WORKSPACE_DIR, "shap_summary.png"),
+        shap_values=shap_matrix, features=sampled.to_numpy(), feature_names=list(sampled.columns))
+    print(f"   图表已提交后台绘制: {summary_path}")
     
     # 解释SHAP Summary图
     print("\nSHAP Summary图解释:")
@@ -134,8 +137,20 @@ def main():
     print("4. 可以观察到，某些生理指标的高值与较高的死亡风险相关")
     print("5. 而另一些指标的低值则与较高的死亡风险相关")
     
+    # 逐条住院的解释：从SHAP值库里查表，总结里可以直接引用
+    if PARAMS['explain_top']:
+        print(f"\n==== 模型输出最高的{PARAMS['explain_top']}条住院 ====")
+        for stay_id, _ in store.highest(PARAMS['explain_top']):
+            print(store.why(stay_id, k=5))
+        print("（其他住院：python -m sepsis.shapstore why <住院编号>）")
+
     print(f'\n✅ SHAP分析完成，结果已保存到 {WORKSPACE_DIR}')
     print("=================================\n")
+    return {'shap_store': store}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 
 if __name__ == '__main__':
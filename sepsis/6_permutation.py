@@ -0,0 +1,95 @@
+# 文件：sepsis/6_permutation.py
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from sepsis import plots
+from sepsis.artifacts import artifact_path, run_standalone
+from sepsis.engines import engine_for
+from sepsis.permutation import explain_permutation
+
+# 置换重要性：6_explain（TreeSHAP）之外的另一种解释方法，只有全局重要性，快得多；
+# 要用标签算 AUC，不产生 SHAP 值库。默认不在管道里运行，点名运行：
+#   python -m sepsis.6_permutation  或  python -m sepsis.pipeline permutation
+INPUTS  = ('model_compiled', 'X_train', 'y_train')
+OUTPUTS = ()
+# 写入 app/workspace 的文件
+PRODUCTS = ('permutation_importance.json', 'permutation_importance.png')
+PARAMS   = {
+    'max_samples':  5000,   # 用于打分的抽样行数
+    'n_repeats':    5,      # 每个特征置换几次
+    'batch':        8,      # 每次打分调用拼在一起的置换数（见 sepsis/permutation.py）
+    'n_jobs':       None,   # 进程数；None 取 CPU 预算分给本阶段的核数
+    'cache':        True,   # 模型和抽样数据不变时复用上次的结果
+    'random_state': 42,
+}
+
+
+def run(dirs, model_compiled, X_train, y_train):
+    model = model_compiled
+    X = X_train
+    WORKSPACE_DIR = dirs.workspace
+
+    print("\n===== 置换重要性分析 =====")
+    engine = engine_for(model)
+    print(f"1. 加载{engine.label}模型和训练数据...")
+    print(f"   数据集大小: {X.shape[0]}行, {X.shape[1]}列")
+
+    sample_size = min(PARAMS['max_samples'], len(X))
+    sampled = X.sample(n=sample_size, random_state=PARAMS['random_state'])[model.feature_names]
+    y = np.asarray(y_train).ravel()[X.index.get_indexer(sampled.index)]
+    print(f"2. 随机抽样 {sample_size} 条记录，每个特征置换 {PARAMS['n_repeats']} 次")
+
+    print("3. 计算各特征置换后的AUC下降...")
+    start = time.perf_counter()
+    base, drops, hit = explain_permutation(
+        artifact_path('model_compiled', dirs), sampled, y, dirs, n_repeats=PARAMS['n_repeats'],
+        batch=PARAMS['batch'], n_jobs=PARAMS['n_jobs'], random_state=PARAMS['random_state'],
+        cache=PARAMS['cache'])
+    elapsed = time.perf_counter() - start
+    if hit:
+        print(f"   ✓ 模型和抽样数据未变，直接读取缓存的结果（{elapsed:.2f} 秒）")
+    else:
+        print(f"   ✓ 计算完成（{elapsed:.2f} 秒，基线 AUC {base:.4f}）")
+
+    importance = pd.DataFrame({'mean': drops.mean(axis=1), 'std': drops.std(axis=1)},
+                              index=sampled.columns).sort_values('mean', ascending=False)
+    top20 = importance.head(20)
+    print("\n==== 模型最重要的20个特征（置换后 AUC 下降）====")
+    for i, (feature, row) in enumerate(top20.iterrows(), 1):
+        print(f"{i}. {feature}: {row['mean']:.6f} ± {row['std']:.6f}")
+    print("=============================")
+
+    with open(os.path.join(WORKSPACE_DIR, 'permutation_importance.json'), 'w') as f:
+        json.dump({'baseline_auc': base, 'n_samples': sample_size, 'n_repeats': PARAMS['n_repeats'],
+                   'importance': importance.to_dict('index')}, f)
+
+    print("\n4. 生成Top20特征重要性条形图...")
+    # 只提交图规格，由后台线程绘制（见 sepsis/plots.py），数值结果不必等图
+    importance_path = plots.submit(
+        'bar', os.path.join(WORKSPACE_DIR, "permutation_importance.png"),
+        values=top20['mean'].to_numpy(), yerr=top20['std'].to_numpy(), labels=list(top20.index),
+        title="Top 20 Feature Importance by Permutation (AUC drop)", ylabel="Mean AUC decrease", figsize=(12, 6))
+    print(f"   图表已提交后台绘制: {importance_path}")
+
+    print("\n特征重要性分析结果解释:")
+    print(f"1. 最重要的特征是 '{top20.index[0]}'，打乱后 AUC 平均下降 {top20['mean'].iloc[0]:.6f}")
+    print(f"2. 第二重要的特征是 '{top20.index[1]}'，打乱后 AUC 平均下降 {top20['mean'].iloc[1]:.6f}")
+    print(f"3. 第三重要的特征是 '{top20.index[2]}'，打乱后 AUC 平均下降 {top20['mean'].iloc[2]:.6f}")
+    print("4. 下降量接近 0（或为负）的特征，打乱后模型表现基本不变，说明模型几乎不依赖它们")
+    print("5. 误差线为多次置换之间的标准差；高度相关的特征会互相替代，置换重要性可能低估它们")
+
+    print(f'\n✅ 置换重要性分析完成，结果已保存到 {WORKSPACE_DIR}')
+    print("=================================\n")
+    return {}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
+
+if __name__ == '__main__':
+    main()
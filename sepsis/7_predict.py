@@ -1,31 +1,36 @@
 # 文件：sepsis/7_predict.py
 import os
+import sys
 import pandas as pd
-import joblib
-import matplotlib.pyplot as plt
 import numpy as np
 
+from sepsis import plots
+from sepsis.artifacts import run_standalone
+from sepsis.compiled import predict_both
+from sepsis.engines import engine_for
 
-def main():
-    # 根目录和路径配置
-    ROOT_DIR      = os.getcwd()
-    SEPSIS_DIR    = os.path.join(ROOT_DIR, 'sepsis')
-    DATA_DIR      = os.path.join(SEPSIS_DIR, 'data')
-    WORKSPACE_DIR = os.path.join(ROOT_DIR, 'app', 'workspace')
-    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+INPUTS  = ('model_compiled', 'X_test')
+OUTPUTS = ()
+# 写入 app/workspace 的文件
+PRODUCTS = ('predict_test_predictions.csv', 'predict_distribution.png', 'predict_probability_distribution.png')
+
+
+def run(dirs, model_compiled, X_test):
+    model = model_compiled
+    # 路径配置
+    WORKSPACE_DIR = dirs.workspace
 
     print("\n===== 测试集预测分析 =====")
     
-    # 加载训练好的模型和测试集特征
-    print("1. 加载随机森林模型和测试数据...")
-    model  = joblib.load(os.path.join(SEPSIS_DIR, 'models', 'rf_model.pkl'))
-    X_test = pd.read_csv(os.path.join(DATA_DIR, 'X_test.csv'), index_col=0)
+    # 训练好的模型和测试集特征
+    print(f"1. 加载{engine_for(model).label}模型和测试数据...")
     print(f"   测试集大小: {X_test.shape[0]}行, {X_test.shape[1]}列")
 
     # 预测并保存结果
     print("2. 对测试集进行预测...")
-    preds = model.predict(X_test)
-    probs = model.predict_proba(X_test)[:, 1]  # 获取正类（死亡）的概率
+    # 一次遍历同时得到类别和概率；取正类（死亡）的概率
+    preds, probs = predict_both(model, X_test)
+    probs = probs[:, 1]
     
     # 转换预测为整数类型，确保兼容性
     preds_int = preds.astype(int)
@@ -72,16 +77,12 @@ def main():
     # 可视化：预测分布柱状图
     print("4. 生成预测分布柱状图...")
     vc = pd.Series(preds_int).value_counts().sort_index()
-    plt.figure()
-    vc.plot.bar(rot=0)
-    plt.xlabel('Predicted Class (0=Survive, 1=Death)')
-    plt.ylabel('Count')
-    plt.title('Predicted Mortality Distribution')
-    plt.tight_layout()
-    dist_png = os.path.join(WORKSPACE_DIR, 'predict_distribution.png')
-    plt.savefig(dist_png)
-    plt.close()
-    print(f'   图表已保存到: {dist_png}')
+    # 只提交图规格，由后台线程绘制（见 sepsis/plots.py），统计结果不必等图
+    dist_png = plots.submit('bar', os.path.join(WORKSPACE_DIR, 'predict_distribution.png'),
+                            values=vc.to_numpy(), labels=list(vc.index), rot=0,
+                            title='Predicted Mortality Distribution', ylabel='Count',
+                            xlabel='Predicted Class (0=Survive, 1=Death)')
+    print(f'   图表已提交后台绘制: {dist_png}')
     
     # 文字解释分布图
     print("\n预测分布图解释:")
@@ -99,18 +100,11 @@ def main():
     # 如果计算了概率，增加概率分布的解释
     if len(probs) > 0:
         # 生成概率直方图
-        plt.figure(figsize=(10, 6))
-        plt.hist(probs, bins=20, alpha=0.7, color='skyblue', edgecolor='black')
-        plt.axvline(x=0.5, color='r', linestyle='--', label='Decision Threshold (0.5)')
-        plt.xlabel('Mortality Probability')
-        plt.ylabel('Count')
-        plt.title('Distribution of Predicted Mortality Probabilities')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        prob_png = os.path.join(WORKSPACE_DIR, 'predict_probability_distribution.png')
-        plt.savefig(prob_png)
-        plt.close()
-        print(f'   概率分布图已保存到: {prob_png}')
+        prob_png = plots.submit('hist', os.path.join(WORKSPACE_DIR, 'predict_probability_distribution.png'),
+                                values=probs, bins=20, threshold=0.5, threshold_label='Decision Threshold (0.5)',
+                                title='Distribution of Predicted Mortality Probabilities',
+                                xlabel='Mortality Probability', ylabel='Count')
+        print(f'   概率分布图已提交后台绘制: {prob_png}')
         
         # 概率分布解释
         print("\n概率分布解释:")
@@ -134,6 +128,11 @@ def main():
     
     print("\n✅ 测试集预测分析完成")
     print("===========================\n")
+    return {}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,73 @@
+# 文件：sepsis/8_drift.py
+import json
+import os
+import sys
+import time
+
+from sepsis.artifacts import run_standalone
+from sepsis.drift import PSI_ALERT, PSI_WARN, DriftMonitor, Sketch
+
+# 只读训练集草图和测试集特征，不再读训练数据
+INPUTS  = ('feature_sketch', 'X_test')
+OUTPUTS = ()
+# 写入 app/workspace 的文件
+PRODUCTS = ('drift_report.json',)
+PARAMS   = {
+    'groups': 10,   # PSI 用的分组数（分位数箱按序号合并）
+    'top':    10,   # 输出里列出漂移最大的几个特征
+}
+
+
+def run(dirs, feature_sketch, X_test):
+    WORKSPACE_DIR = dirs.workspace
+    sketch = Sketch.from_dict(feature_sketch)
+
+    print("\n===== 特征漂移检查（测试集 vs 训练集）=====")
+    print(f"1. 训练集草图：{len(sketch.features)} 个特征，{feature_sketch['n']} 条，每个特征 {sketch.bins} 个分位数箱")
+    print(f"   测试集大小: {X_test.shape[0]}行, {X_test.shape[1]}列")
+
+    print("2. 测试集按草图的边界一次分箱，计算 PSI / KS...")
+    start = time.perf_counter()
+    monitor = DriftMonitor(sketch, list(X_test.columns), groups=PARAMS['groups'])
+    monitor.update(X_test.to_numpy())
+    report = monitor.report()
+    elapsed = time.perf_counter() - start
+    print(f"   ✓ 完成（{elapsed:.3f} 秒）")
+
+    counts = report['status'].value_counts()
+    print("\n==== 漂移概况 ====")
+    print(f"稳定 (PSI < {PSI_WARN}): {counts.get('稳定', 0)} 个特征")
+    print(f"轻微漂移 ({PSI_WARN} ≤ PSI < {PSI_ALERT}): {counts.get('轻微漂移', 0)} 个特征")
+    print(f"明显漂移 (PSI ≥ {PSI_ALERT}): {counts.get('明显漂移', 0)} 个特征")
+
+    top = report.head(PARAMS['top'])
+    print(f"\n==== 漂移最大的{len(top)}个特征 ====")
+    for i, (feature, row) in enumerate(top.iterrows(), 1):
+        print(f"{i}. {feature}: PSI {row['psi']:.4f}，KS {row['ks']:.4f}，"
+              f"缺失率 {row['missing_train']:.2%} → {row['missing_new']:.2%}（{row['status']}）")
+    print("=============================")
+
+    print("\n漂移检查结果解释:")
+    print("1. PSI 衡量测试集在训练集各分位数区间里的占比变化；超出训练集取值范围的值单独计入")
+    print("2. KS 为两个分布函数的最大差距（在草图的箱边界上计算）")
+    # 样本很少时 PSI 本身就有抽样波动：(组数 - 1) × (1/测试集条数 + 1/训练集条数) 左右
+    noise = (PARAMS['groups'] - 1) * (1 / max(len(X_test), 1) + 1 / max(feature_sketch['n'], 1))
+    print(f"3. 以当前样本量，两份同分布的数据 PSI 也会在 {noise:.3f} 左右，小于这个量级的差异不必在意")
+    if counts.get('明显漂移', 0):
+        print("4. 有特征明显漂移：这些特征上的预测结果需要谨慎解读，必要时用新数据重新训练")
+    else:
+        print("4. 没有特征明显漂移，测试集与训练集的特征分布大体一致")
+
+    with open(os.path.join(WORKSPACE_DIR, 'drift_report.json'), 'w') as f:
+        json.dump({'n_train': feature_sketch['n'], 'n_test': monitor.n, 'groups': PARAMS['groups'],
+                   'features': report.to_dict('index')}, f, ensure_ascii=False, indent=2)
+    print(f'\n✅ 漂移检查完成，结果已保存到 {WORKSPACE_DIR}')
+    print("=================================\n")
+    return {}
+
+
+def main():
+    run_standalone(sys.modules[__name__])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# 文件：sepsis/artifacts.py
+# 管道各步骤之间传递的中间产物：目录约定 + 统一读写
+import json
+import os
+from collections import namedtuple
+
+import joblib
+import pandas as pd
+
+from sepsis.store import PartitionedFrame, get_store
+
+Dirs = namedtuple('Dirs', ['root', 'sepsis', 'data', 'models', 'workspace'])
+
+# 产物名 -> (所在目录, 文件名主干, 类型)
+# 表格类产物的扩展名由存储格式决定（见 sepsis/store.py）；
+# partitioned 类型是一个目录，由 1_load 按块直接写出
+ARTIFACTS = {
+    'train_raw':     ('data',   'train_raw',     'partitioned'),
+    'test_raw':      ('data',   'test_raw',      'partitioned'),
+    'train_imputed': ('data',   'train_imputed', 'partitioned'),
+    'test_imputed':  ('data',   'test_imputed',  'partitioned'),
+    'impute_medians': ('models', 'impute_medians', 'json'),
+    'X_train':       ('data',   'X_train',       'frame'),
+    'y_train':       ('data',   'y_train',       'series'),
+    'X_test':        ('data',   'X_test',        'frame'),
+    # 训练集各特征的直方图草图（sepsis/drift.py），漂移检查不必再读训练数据
+    'feature_sketch': ('data',  'feature_sketch', 'json'),
+    'model':         ('models', 'rf_model',      'model'),
+    # 编译后的树模型（sepsis/compiled.py 的 .sepm 格式），评估 / 预测步骤按内存映射加载
+    'model_compiled': ('models', 'model',        'compiled'),
+    # 解释步骤的整个 SHAP 矩阵，按住院编号索引（sepsis/shapstore.py）
+    'shap_store':    ('data',   'shap_store',    'shapstore'),
+}
+
+
+def get_dirs(root=None):
+    """按项目约定返回各目录（默认以当前工作目录为根），并确保目录存在"""
+    ROOT_DIR      = root or os.getcwd()
+    SEPSIS_DIR    = os.path.join(ROOT_DIR, 'sepsis')
+    DATA_DIR      = os.path.join(SEPSIS_DIR, 'data')
+    MODELS_DIR    = os.path.join(SEPSIS_DIR, 'models')
+    WORKSPACE_DIR = os.path.join(ROOT_DIR, 'app', 'workspace')
+    for d in (DATA_DIR, MODELS_DIR, WORKSPACE_DIR):
+        os.makedirs(d, exist_ok=True)
+    return Dirs(ROOT_DIR, SEPSIS_DIR, DATA_DIR, MODELS_DIR, WORKSPACE_DIR)
+
+
+def artifact_path(name, dirs):
+    where, stem, kind = ARTIFACTS[name]
+    if kind == 'model':
+        ext = '.pkl'
+    elif kind == 'compiled':
+        ext = '.sepm'
+    elif kind == 'shapstore':
+        ext = '.shap.d'
+    elif kind == 'json':
+        ext = '.json'
+    elif kind == 'partitioned':
+        ext = '.parts'
+    else:
+        ext = get_store().ext
+    return os.path.join(getattr(dirs, where), stem + ext)
+
+
+def load_artifact(name, dirs):
+    path = artifact_path(name, dirs)
+    kind = ARTIFACTS[name][2]
+    if kind == 'model':
+        return joblib.load(path)
+    if kind == 'compiled':
+        from sepsis.compiled import load_compiled
+        return load_compiled(path)
+    if kind == 'shapstore':
+        from sepsis.shapstore import ShapStore
+        return ShapStore.open(path)
+    if kind == 'partitioned':
+        return PartitionedFrame(path)
+    if kind == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    df = get_store().load(path)
+    # 标签只有一列，读成 Series
+    if kind == 'series':
+        return df.iloc[:, 0]
+    return df
+
+
+def save_artifact(name, obj, dirs):
+    path = artifact_path(name, dirs)
+    kind = ARTIFACTS[name][2]
+    if kind == 'model':
+        joblib.dump(obj, path)
+    elif kind == 'compiled':
+        from sepsis.compiled import save_compiled
+        # SEPSIS_MODEL_COMPRESS=1：文件更小，但加载时要解压，不能内存映射共享
+        save_compiled(obj, path, compress=os.environ.get('SEPSIS_MODEL_COMPRESS') == '1')
+    elif kind == 'shapstore':
+        obj.save(path)
+    elif kind == 'json':
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+    elif kind == 'partitioned':
+        # 分区在生成时已经直接写到目标目录，这里只做校验
+        if os.path.abspath(obj.path) != os.path.abspath(path):
+            raise ValueError(f"分区产物 {name} 应写在 {path}，实际为 {obj.path}")
+    elif isinstance(obj, pd.Series):
+        get_store().save(obj.to_frame(), path)
+    else:
+        get_store().save(obj, path)
+    return path
+
+
+def run_standalone(stage_module, dirs=None):
+    """单独运行某一步（python -m sepsis.N_xxx）：从磁盘读输入，运行，写回输出"""
+    from sepsis import budget, cache
+
+    dirs = dirs or get_dirs()
+    # 单独运行不计算指纹：作废该步的缓存记录，下次管道运行时重新校验
+    cache.invalidate(stage_module, dirs)
+    inputs = {name: load_artifact(name, dirs) for name in stage_module.INPUTS}
+    with budget.allocate(budget.stage_name(stage_module), dirs.root) as cores:
+        print(f'🖥️ CPU 预算: {cores} 核')
+        outputs = stage_module.run(dirs, **inputs)
+    for name, obj in outputs.items():
+        path = save_artifact(name, obj, dirs)
+        print(f'💾 {name} → {path}')
+    return outputs
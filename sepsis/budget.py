@@ -0,0 +1,188 @@
+# 文件：sepsis/budget.py
+# CPU 预算：每个阶段运行前向节点级账本申请若干核，运行期间
+#   - joblib / sklearn 默认的 n_jobs（n_jobs=None）取这个核数；
+#   - 本进程的 BLAS / OpenMP 线程数限制在这个核数（threadpoolctl）；
+#   - joblib 进程池的每个子进程、以及其他子进程只用 1 个线程（环境变量），避免“核数 × 线程数”的超额订阅。
+# 账本是一个 JSON 文件（默认在系统临时目录，所有管道运行共用），记录谁占用了多少核，
+# 同一节点上并发的多次运行据此分配；python -m sepsis.budget 查看当前分配。
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from joblib import parallel_config
+from threadpoolctl import threadpool_limits
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，账本不加锁
+    fcntl = None
+
+# 每个阶段最多占节点的比例（至少 1 核）；IO 为主或计算量小的阶段占得少
+STAGE_SHARES = {
+    'load':     0.0,
+    'impute':   1.0,
+    'feature':  1.0,
+    'train':    1.0,
+    'evaluate': 0.25,
+    'explain':  1.0,
+    'permutation': 1.0,
+    'predict':  0.25,
+    'drift':    0.0,
+    # 常驻打分服务（sepsis/serve.py）
+    'serve':    0.25,
+}
+
+# 子进程读取的线程数环境变量
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def node_cores():
+    """本节点可用的核数；环境变量 SEPSIS_CPUS 可以覆盖（例如与其他服务共用节点时）"""
+    if os.environ.get('SEPSIS_CPUS'):
+        return max(1, int(os.environ['SEPSIS_CPUS']))
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def ledger_path():
+    return os.environ.get('SEPSIS_BUDGET_FILE') or os.path.join(tempfile.gettempdir(), 'sepsis_cpu_budget.json')
+
+
+def stage_name(module):
+    """'sepsis.4_train' / '.../4_train.py' -> 'train'"""
+    stem = os.path.splitext(os.path.basename(getattr(module, '__file__', '') or module.__name__))[0]
+    return stem.split('_', 1)[1] if stem[:1].isdigit() and '_' in stem else stem
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _locked_ledger():
+    """读出账本（清理已退出进程的分配），yield 给调用方修改，退出时写回"""
+    path = ledger_path()
+    with open(path + '.lock', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    ledger = json.load(f)
+            except (OSError, ValueError):
+                ledger = {}
+            ledger['total'] = node_cores()
+            ledger['allocations'] = [a for a in ledger.get('allocations', []) if _alive(a['pid'])]
+            yield ledger
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(ledger, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def request(stage, root=None):
+    """
+    登记一次分配并返回核数：min(阶段份额, 节点剩余核数)，至少 1 核
+
+    节点已被占满时仍给 1 核，保证每个阶段都能推进，超额最多是每个并发阶段 1 核。
+    """
+    share = STAGE_SHARES.get(stage, 1.0)
+    with _locked_ledger() as ledger:
+        total = ledger['total']
+        used = sum(a['cores'] for a in ledger['allocations'])
+        cores = max(1, min(int(total * share), total - used))
+        entry = {'id': os.urandom(6).hex(), 'pid': os.getpid(), 'stage': stage, 'cores': cores, 'root': root,
+                 'since': time.strftime('%Y-%m-%d %H:%M:%S')}
+        ledger['allocations'].append(entry)
+    return entry
+
+
+def release(entry):
+    with _locked_ledger() as ledger:
+        ledger['allocations'] = [a for a in ledger['allocations'] if a.get('id') != entry['id']]
+
+
+# 线程数环境变量和 BLAS / OpenMP 线程池是进程级的：管道并发运行几个阶段时，
+# 第一个进入的阶段设置、最后一个退出的阶段恢复；BLAS 线程数取各阶段核数的平均，
+# 每个阶段的线程同时调用 BLAS 时总线程数不超过它们分到的核数之和
+_process_lock = threading.Lock()
+_active = {}
+_process_state = {'env': None, 'limiter': None}
+
+
+def _apply_process_limits():
+    if _process_state['limiter'] is not None:
+        _process_state['limiter'].restore_original_limits()
+        _process_state['limiter'] = None
+    if _active:
+        _process_state['limiter'] = threadpool_limits(limits=max(1, sum(_active.values()) // len(_active)))
+
+
+def _enter_process(entry):
+    with _process_lock:
+        if not _active:
+            _process_state['env'] = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+            for name in THREAD_ENV_VARS:
+                os.environ[name] = '1'
+        _active[entry['id']] = entry['cores']
+        _apply_process_limits()
+
+
+def _exit_process(entry):
+    with _process_lock:
+        _active.pop(entry['id'], None)
+        _apply_process_limits()
+        if not _active and _process_state['env'] is not None:
+            for name, value in _process_state['env'].items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            _process_state['env'] = None
+
+
+@contextmanager
+def allocate(stage, root=None):
+    """
+    在 with 块内按预算运行一个阶段，yield 分到的核数
+
+    n_jobs=None 的 joblib.Parallel 和 sklearn 估计器都会用这个核数（按线程生效，并发的阶段互不影响）；
+    显式写死 n_jobs=-1 的代码会绕过预算，阶段里应改为 None。
+    """
+    entry = request(stage, root)
+    cores = entry['cores']
+    try:
+        # joblib 的 loky 进程池在环境变量已设置时沿用它，不再按 cpu_count // n_jobs 给子进程分线程
+        _enter_process(entry)
+        with parallel_config(n_jobs=cores):
+            yield cores
+    finally:
+        _exit_process(entry)
+        release(entry)
+
+
+def main():
+    with _locked_ledger() as ledger:
+        pass
+    used = sum(a['cores'] for a in ledger['allocations'])
+    print(f"🖥️ 节点 {ledger['total']} 核，已分配 {used} 核（账本: {ledger_path()}）")
+    for a in ledger['allocations']:
+        print(f"   pid {a['pid']:>7}  {a['stage']:<10} {a['cores']:>3} 核  自 {a['since']}  {a.get('root') or ''}")
+
+
+if __name__ == '__main__':
+    main()
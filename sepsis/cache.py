@@ -0,0 +1,208 @@
+# 文件：sepsis/cache.py
+# 内容哈希产物缓存：每一步在输出旁边记录 输入 + 参数 + 代码版本 的指纹，
+# 指纹一致且输出文件齐全时，管道直接跳过该步。
+import hashlib
+import inspect
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from sepsis.artifacts import artifact_path
+
+# 代码版本之外，结果还依赖这些库的版本
+LIB_VERSIONS = {'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__}
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _files(path):
+    """产物可能是单个文件，也可能是目录（npy 格式、分区输出）"""
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for folder, _, names in os.walk(path):
+        found.extend(os.path.join(folder, n) for n in names)
+    return sorted(found)
+
+
+def stat_signature(path):
+    """(总大小, 最新修改时间)，用于快速判断产物是否被改动"""
+    stats = [os.stat(p) for p in _files(path)]
+    return sum(st.st_size for st in stats), max((st.st_mtime_ns for st in stats), default=0)
+
+
+def file_digest(path, known=None):
+    """
+    文件（或目录下全部文件）内容的 sha256
+
+    known 为上次记录的 {'size', 'mtime_ns', 'digest'}；大小和修改时间都没变时直接复用，
+    避免每次都重新读取多 GB 的原始 CSV。返回同样结构的字典。
+    """
+    size, mtime_ns = stat_signature(path)
+    if known and known.get('size') == size and known.get('mtime_ns') == mtime_ns:
+        return known
+    h = hashlib.sha256()
+    for p in _files(path):
+        h.update(os.path.relpath(p, path).encode('utf-8'))
+        with open(p, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return {'size': size, 'mtime_ns': mtime_ns, 'digest': h.hexdigest()}
+
+
+# 所有步骤共用的产物读写代码，改动后需要全部重跑
+SHARED_CODE = ('artifacts.py', 'store.py')
+
+
+def helper_files(module):
+    """步骤直接或间接引用的 sepsis 辅助模块（如 groupagg、search、engines）的源文件"""
+    seen, files, stack = set(), [], [module]
+    while stack:
+        current = stack.pop()
+        for value in list(vars(current).values()):
+            dep = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+            if dep is None or dep is current or not dep.__name__.startswith('sepsis.') or dep.__name__ in seen:
+                continue
+            seen.add(dep.__name__)
+            if getattr(dep, '__file__', None):
+                files.append(dep.__file__)
+            stack.append(dep)
+    return files
+
+
+def code_digest(module):
+    """步骤模块源码 + 产物读写代码 + 它用到的辅助模块 的哈希；辅助模块改动后相关步骤也会重跑"""
+    h = hashlib.sha256()
+    here = os.path.dirname(__file__)
+    paths = [module.__file__] + [os.path.join(here, name) for name in SHARED_CODE]
+    paths += sorted(set(helper_files(module)) - {os.path.abspath(p) for p in paths} - set(paths))
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def step_key(module):
+    """指纹记录按步骤文件名命名（python -m 运行时模块名是 __main__）"""
+    return os.path.splitext(os.path.basename(module.__file__))[0]
+
+
+def record_path(module, dirs):
+    # 记录放在该步第一个输出旁边；没有磁盘产物的步骤放在 data 目录
+    if module.OUTPUTS:
+        folder = os.path.dirname(artifact_path(module.OUTPUTS[0], dirs))
+    else:
+        folder = dirs.data
+    return os.path.join(folder, f'{step_key(module)}.fingerprint.json')
+
+
+def read_record(module, dirs):
+    path = record_path(module, dirs)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def invalidate(module, dirs):
+    path = record_path(module, dirs)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def source_paths(module, dirs):
+    return [os.path.join(dirs.sepsis, name) for name in getattr(module, 'SOURCES', ())]
+
+
+def product_paths(module, dirs):
+    return [os.path.join(dirs.workspace, name) for name in getattr(module, 'PRODUCTS', ())]
+
+
+def fingerprint(module, input_fps, dirs, previous=None):
+    """
+    计算某一步的指纹
+
+    input_fps: {输入产物名: 产物内容哈希}
+    previous:  上次的记录，用于复用原始文件的哈希
+    返回 (指纹, 原始文件哈希信息)
+    """
+    known = (previous or {}).get('sources', {})
+    sources = {}
+    for path in source_paths(module, dirs):
+        sources[os.path.basename(path)] = file_digest(path, known.get(os.path.basename(path)))
+    payload = {
+        'step':    step_key(module),
+        'code':    code_digest(module),
+        'libs':    LIB_VERSIONS,
+        'params':  getattr(module, 'PARAMS', {}),
+        'inputs':  {name: input_fps[name] for name in module.INPUTS},
+        'sources': {name: info['digest'] for name, info in sources.items()},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return _sha256(blob), sources
+
+
+def input_fingerprint(name, dirs, producer_module=None):
+    """
+    输入产物的内容哈希；文件与上游记录一致（大小、修改时间）时直接取记录里的值
+    """
+    path = artifact_path(name, dirs)
+    if not os.path.exists(path):
+        return None
+    known = None
+    if producer_module is not None:
+        record = read_record(producer_module, dirs)
+        known = (record or {}).get('artifacts', {}).get(name)
+    return file_digest(path, known)['digest']
+
+
+def is_fresh(module, fp, dirs):
+    """指纹一致、输出文件都还在且没有被改动过"""
+    record = read_record(module, dirs)
+    if not record or record.get('fingerprint') != fp:
+        return False
+    if not all(os.path.exists(p) for p in product_paths(module, dirs)):
+        return False
+    for name in module.OUTPUTS:
+        path = artifact_path(name, dirs)
+        known = record.get('artifacts', {}).get(name)
+        if not os.path.exists(path) or not known:
+            return False
+        if stat_signature(path) != (known['size'], known['mtime_ns']):
+            return False
+    return True
+
+
+def write_json_atomic(path, obj):
+    """先写临时文件再替换：并发读取方（或写到一半被中断）只会看到旧文件或完整的新文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def write_record(module, fp, sources, dirs, log=''):
+    # 产物指纹取文件内容哈希：上游重跑但输出字节不变时，下游仍可命中缓存
+    record = {
+        'step':        step_key(module),
+        'fingerprint': fp,
+        'artifacts':   {name: file_digest(artifact_path(name, dirs)) for name in module.OUTPUTS},
+        'sources':     sources,
+        'products':    list(getattr(module, 'PRODUCTS', ())),
+        'created':     time.strftime('%Y-%m-%d %H:%M:%S'),
+        # 命中缓存时回放上次的输出，总结阶段仍能拿到完整日志
+        'log':         log,
+    }
+    write_json_atomic(record_path(module, dirs), record)
+    return record
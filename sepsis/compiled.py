@@ -0,0 +1,479 @@
+# 文件：sepsis/compiled.py
+# 把训练好的树集成（随机森林 / 直方图梯度提升）编译成几段连续数组：
+#   nodes (n_nodes, 4) int32：每行 left、right（全局节点编号，叶子为 -1）、feature、threshold（float32 的位，向下取整），
+#       一个节点 16 字节放在一起，遍历时每个节点只碰一条缓存行；
+#   missing_left (uint8)、value (float32，叶子输出)、cover (float32，节点样本权重，供 SHAP 用)、roots (int32，每棵树的根)。
+# 批量打分一次遍历同时得到类别和概率，不再经过 sklearn 的对象图（predict + predict_proba 各走一遍）。
+# 有 numba 时用 JIT 编译的逐行遍历（单条住院微秒级，内核缓存在磁盘上），否则用按树深逐层推进的 numpy 向量化实现；
+# 内核还没编译好时，小批量先走 numpy 遍历，不为几百行付一两秒的编译。
+#
+# 编译结果另存为带版本号的二进制模型文件（.sepm，见 save_compiled / load_compiled）：
+#   定长文件头（魔数、格式版本、标志位、JSON 元数据长度）+ JSON 元数据 + 按 64 字节对齐的各数组。
+#   不压缩时用内存映射加载：只读取文件头，数组直接是文件页的视图，毫秒级完成；
+#   同一台机器上多个进程映射同一个文件，共享页缓存里的同一份物理内存。
+#   压缩（zlib，逐数组）时文件更小，但加载要解压到各自进程的内存里。
+# 用法：python -m sepsis.compiled   与 sklearn 对比结果并测延迟 / 吞吐 / 加载耗时
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from joblib import effective_n_jobs
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+
+try:
+    import numba
+    HAS_NUMBA = True
+    # 并行遍历会从多个线程发起（并发的管道阶段、打分服务的批处理线程）：优先用 OpenMP 线程层；
+    # TBB 层在非主线程首次启动后进程退出时会卡死，workqueue 层不支持多个线程同时启动
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:
+    HAS_NUMBA = False
+
+LEAF = -1
+
+MAGIC = b'SEPSMDL\0'
+FORMAT_VERSION = 1
+FLAG_ZLIB = 1
+# 魔数、格式版本、标志位、JSON 元数据字节数
+HEADER = struct.Struct('<8sHHI')
+ALIGN = 64
+
+
+def round_down_float32(t):
+    """
+    float64 阈值转成不大于它的最大 float32
+
+    输入特征是 float32 时，x <= t 与 x <= round_down(t) 的判定完全相同，结果与 sklearn 一致。
+    """
+    t = np.asarray(t, dtype=np.float64)
+    t32 = t.astype(np.float32)
+    over = t32.astype(np.float64) > t
+    t32[over] = np.nextafter(t32[over], np.float32(-np.inf))
+    return t32
+
+
+class CompiledEnsemble:
+    """
+    kind:     'forest'（各树叶子概率取平均）或 'boosting'（叶子值求和 + 基线，经 sigmoid 得概率）
+    classes:  原模型的 classes_
+    """
+
+    ARRAYS = ('nodes', 'missing_left', 'value', 'cover', 'roots')
+
+    def __init__(self, kind, engine, classes, feature_names, baseline=0.0, **arrays):
+        self.kind = kind
+        self.engine = engine
+        self.classes = np.asarray(classes)
+        self.feature_names = list(feature_names)
+        self._columns = pd.Index(self.feature_names)
+        self.baseline = float(baseline)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def left(self):
+        return self.nodes[:, 0]
+
+    @property
+    def right(self):
+        return self.nodes[:, 1]
+
+    @property
+    def feature(self):
+        return self.nodes[:, 2]
+
+    @property
+    def threshold(self):
+        return self.nodes.view(np.float32)[:, 3]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def fingerprint(self):
+        """模型内容的 sha256（结构、阈值、叶子值），用作解释结果等派生数据的缓存键"""
+        h = hashlib.sha256()
+        h.update(json.dumps([self.kind, self.engine, self.classes.tolist(), self.feature_names, self.baseline],
+                            default=str).encode('utf-8'))
+        for name in self.ARRAYS:
+            a = np.ascontiguousarray(getattr(self, name))
+            h.update(f'{name}|{a.shape}|{a.dtype.str}|'.encode('utf-8'))
+            h.update(a.tobytes())
+        return h.hexdigest()
+
+    def _as_matrix(self, X):
+        if isinstance(X, pd.DataFrame):
+            # 列顺序已经一致时跳过按列名重排（单条打分时它比遍历本身还慢）
+            if not X.columns.equals(self._columns):
+                X = X[self.feature_names]
+            X = X.to_numpy(dtype=np.float32)
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+    def _accumulate(self, X):
+        """每行在所有树上的叶子输出之和，(n, value 的列数)"""
+        out = np.zeros((X.shape[0], self.value.shape[1]), dtype=np.float64)
+        if X.shape[0] == 0:
+            return out
+        kernel = self._kernel(X.shape[0])
+        if kernel is None:
+            _traverse_numpy(X, self, out)
+        else:
+            kernel(X, self.nodes, self.nodes.view(np.float32), self.missing_left, self.roots, self.value, out)
+        return out
+
+    def _kernel(self, n_rows, force=False):
+        """选择遍历内核；返回 None 时用 numpy 遍历"""
+        if not HAS_NUMBA:
+            return None
+        # 线程数跟随 CPU 预算（budget.allocate 设置的 joblib n_jobs）；只有 1 核时不用并行内核
+        threads = max(1, min(effective_n_jobs(), numba.config.NUMBA_NUM_THREADS))
+        kernel = _traverse_serial
+        if n_rows >= PARALLEL_MIN_ROWS and threads > 1:
+            numba.set_num_threads(threads)
+            kernel = _traverse_parallel
+        if not force and not _kernel_ready(kernel) and n_rows * self.n_trees < JIT_MIN_WORK:
+            return None
+        return kernel
+
+    def warm(self):
+        """编译（或从磁盘缓存载入）会用到的内核，常驻服务 / 回放启动时调用，第一批请求不必等"""
+        for n in (1, PARALLEL_MIN_ROWS):
+            kernel = self._kernel(n, force=True)
+            if kernel is not None and not _kernel_ready(kernel):
+                X = np.zeros((n, len(self.feature_names)), dtype=np.float32)
+                out = np.zeros((n, self.value.shape[1]), dtype=np.float64)
+                kernel(X, self.nodes, self.nodes.view(np.float32), self.missing_left, self.roots, self.value, out)
+
+    def predict_both(self, X):
+        """一次遍历返回 (预测类别, 各类别概率)，与 model.predict / model.predict_proba 相同"""
+        out = self._accumulate(self._as_matrix(X))
+        if self.kind == 'forest':
+            proba = out / self.n_trees
+        else:
+            p1 = 1.0 / (1.0 + np.exp(-(out[:, 0] + self.baseline)))
+            proba = np.column_stack([1.0 - p1, p1])
+        return self.classes[np.argmax(proba, axis=1)], proba
+
+    def predict_proba(self, X):
+        return self.predict_both(X)[1]
+
+    def predict(self, X):
+        return self.predict_both(X)[0]
+
+
+# ---------------------------------------------------------------------
+# 编译
+# ---------------------------------------------------------------------
+
+def pack_nodes(left, right, feature, threshold):
+    nodes = np.empty((len(left), 4), dtype=np.int32)
+    nodes[:, 0] = left
+    nodes[:, 1] = right
+    nodes[:, 2] = feature
+    nodes.view(np.float32)[:, 3] = threshold
+    return nodes
+
+
+def _compile_forest(model):
+    trees = [est.tree_ for est in model.estimators_]
+    sizes = np.array([t.node_count for t in trees])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+
+    def glue(get, dtype):
+        return np.concatenate([np.asarray(get(t)) for t in trees]).astype(dtype)
+
+    left = glue(lambda t: t.children_left, np.int64)
+    right = glue(lambda t: t.children_right, np.int64)
+    shift = np.repeat(offsets, sizes)
+    is_leaf = left == LEAF
+    left = np.where(is_leaf, LEAF, left + shift).astype(np.int32)
+    right = np.where(is_leaf, LEAF, right + shift).astype(np.int32)
+
+    # value: (节点, 1, 类别数)，归一化成叶子上的类别比例（即单棵树的 predict_proba）
+    value = np.concatenate([t.value[:, 0, :] for t in trees]).astype(np.float64)
+    value = value / np.maximum(value.sum(axis=1, keepdims=True), np.finfo(np.float64).tiny)
+
+    cover = glue(lambda t: t.weighted_n_node_samples, np.float32)
+    missing = (glue(lambda t: t.missing_go_to_left, np.uint8) if hasattr(trees[0], 'missing_go_to_left')
+               else np.zeros(len(left), dtype=np.uint8))
+    return CompiledEnsemble(
+        'forest', 'rf', model.classes_, model.feature_names_in_,
+        nodes=pack_nodes(left, right, np.where(is_leaf, 0, glue(lambda t: t.feature, np.int64)),
+                         np.where(is_leaf, np.float32(np.inf), round_down_float32(glue(lambda t: t.threshold, np.float64)))),
+        missing_left=missing,
+        value=value.astype(np.float32), cover=cover, roots=offsets,
+    )
+
+
+def _compile_boosting(model):
+    if len(model.classes_) != 2:
+        raise ValueError("只支持二分类的梯度提升模型")
+    if getattr(model, 'is_categorical_', None) is not None and np.any(model.is_categorical_):
+        raise ValueError("不支持类别型特征的梯度提升模型")
+    nodes = [predictors[0].nodes for predictors in model._predictors]
+    sizes = np.array([len(n) for n in nodes])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+    allnodes = np.concatenate(nodes)
+    shift = np.repeat(offsets, sizes)
+    is_leaf = allnodes['is_leaf'].astype(bool)
+    return CompiledEnsemble(
+        'boosting', 'hgb', model.classes_, model.feature_names_in_,
+        baseline=float(np.ravel(model._baseline_prediction)[0]),
+        nodes=pack_nodes(np.where(is_leaf, LEAF, allnodes['left'].astype(np.int64) + shift),
+                         np.where(is_leaf, LEAF, allnodes['right'].astype(np.int64) + shift),
+                         np.where(is_leaf, 0, allnodes['feature_idx']),
+                         np.where(is_leaf, np.float32(np.inf), round_down_float32(allnodes['num_threshold']))),
+        missing_left=allnodes['missing_go_to_left'].astype(np.uint8),
+        value=np.where(is_leaf, allnodes['value'], 0.0).astype(np.float32)[:, None],
+        cover=allnodes['count'].astype(np.float32),
+        roots=offsets,
+    )
+
+
+def compile_model(model):
+    if isinstance(model, CompiledEnsemble):
+        return model
+    if isinstance(model, RandomForestClassifier):
+        return _compile_forest(model)
+    if isinstance(model, HistGradientBoostingClassifier):
+        return _compile_boosting(model)
+    raise TypeError(f"无法编译的模型类型: {type(model).__name__}")
+
+
+# ---------------------------------------------------------------------
+# 二进制模型文件
+# ---------------------------------------------------------------------
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_compiled(ens, path, compress=False):
+    """写成 .sepm 文件（先写临时文件再替换，读者不会看到写了一半的文件）"""
+    blobs, layout, offset = [], {}, 0
+    for name in ens.ARRAYS:
+        a = np.ascontiguousarray(getattr(ens, name))
+        raw = a.tobytes()
+        blob = zlib.compress(raw, 6) if compress else raw
+        layout[name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset,
+                        'size': len(blob), 'crc32': zlib.crc32(raw)}
+        blobs.append((offset, blob))
+        offset = _aligned(offset + len(blob))
+    meta = json.dumps({
+        'kind': ens.kind,
+        'engine': ens.engine,
+        'classes': ens.classes.tolist(),
+        'classes_dtype': ens.classes.dtype.str,
+        'feature_names': ens.feature_names,
+        'baseline': ens.baseline,
+        'arrays': layout,
+    }, ensure_ascii=False).encode('utf-8')
+    data_start = _aligned(HEADER.size + len(meta))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, FLAG_ZLIB if compress else 0, len(meta)))
+        f.write(meta)
+        for off, blob in blobs:
+            f.seek(data_start + off)
+            f.write(blob)
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(path):
+    """(格式版本, 标志位, 元数据, 数据区起点)"""
+    with open(path, 'rb') as f:
+        magic, version, flags, meta_len = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"不是模型文件: {path}")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"模型文件格式版本 {version} 比当前代码支持的 {FORMAT_VERSION} 新，请升级代码")
+        meta = json.loads(f.read(meta_len).decode('utf-8'))
+    return version, flags, meta, _aligned(HEADER.size + meta_len)
+
+
+def load_compiled(path, mmap=True, verify=False):
+    """
+    读取 .sepm 文件
+
+    mmap:    未压缩的文件按内存映射加载，数组是只读的文件视图
+    verify:  逐数组校验 CRC32（要读遍整个文件，默认只在压缩文件解压时顺带校验）
+    """
+    version, flags, meta, data_start = read_header(path)
+    compressed = bool(flags & FLAG_ZLIB)
+    if mmap and not compressed:
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        with open(path, 'rb') as f:
+            buf = f.read()
+    arrays = {}
+    for name, spec in meta['arrays'].items():
+        start = data_start + spec['offset']
+        if compressed:
+            raw = zlib.decompress(buf[start:start + spec['size']])
+            a = np.frombuffer(raw, dtype=spec['dtype']).reshape(spec['shape'])
+        else:
+            a = np.ndarray(spec['shape'], dtype=spec['dtype'], buffer=buf, offset=start)
+        if (verify or compressed) and zlib.crc32(a) != spec['crc32']:
+            raise ValueError(f"模型文件损坏（{name} 校验失败）: {path}")
+        arrays[name] = a
+    classes = np.asarray(meta['classes'], dtype=meta['classes_dtype'])
+    return CompiledEnsemble(meta['kind'], meta['engine'], classes, meta['feature_names'],
+                            meta['baseline'], **arrays)
+
+
+def predict_both(model, X):
+    """
+    一次遍历得到 (预测类别, 各类别概率)，评估 / 预测步骤用
+
+    有 numba 时走编译后的数组遍历；否则只调一次 predict_proba，类别取概率最大者（与 model.predict 相同）。
+    """
+    if HAS_NUMBA or isinstance(model, CompiledEnsemble):
+        return compile_model(model).predict_both(X)
+    proba = model.predict_proba(X)
+    return model.classes_[np.argmax(proba, axis=1)], proba
+
+
+# ---------------------------------------------------------------------
+# 遍历
+# ---------------------------------------------------------------------
+
+# 少于这么多行时不开线程：单条 / 小批量打分时线程调度的开销比遍历本身还大
+PARALLEL_MIN_ROWS = 256
+
+# 行按块处理、块内先树后行：同一棵树连续服务一整块行，节点数组留在缓存里
+BLOCK_ROWS = 128
+
+# numba 内核还没编译（或还没从磁盘缓存载入）时，（行数 × 树数）少于这么多的批次先走 numpy 遍历：
+# 首次编译要一两秒，比 numpy 遍历几百行还慢；内核就绪后一律走内核
+JIT_MIN_WORK = 1_000_000
+
+if HAS_NUMBA:
+    @numba.njit(nogil=True, cache=True)
+    def _traverse_block(X, nodes, thresholds, missing_left, roots, value, out, lo, hi):
+        for t in range(roots.shape[0]):
+            for i in range(lo, hi):
+                node = roots[t]
+                while nodes[node, 0] != -1:
+                    x = X[i, nodes[node, 2]]
+                    if x <= thresholds[node, 3] or (x != x and missing_left[node]):
+                        node = nodes[node, 0]
+                    else:
+                        node = nodes[node, 1]
+                for k in range(value.shape[1]):
+                    out[i, k] += value[node, k]
+
+    # 串行、并行各一个源函数（只差 range / prange），numba 的磁盘缓存按函数区分，两份都能缓存，
+    # 每个进程只在第一次从缓存载入，不再重新编译
+    @numba.njit(nogil=True, cache=True)
+    def _traverse_serial(X, nodes, thresholds, missing_left, roots, value, out):
+        n = X.shape[0]
+        for b in range((n + BLOCK_ROWS - 1) // BLOCK_ROWS):
+            lo = b * BLOCK_ROWS
+            _traverse_block(X, nodes, thresholds, missing_left, roots, value, out, lo, min(lo + BLOCK_ROWS, n))
+
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def _traverse_parallel(X, nodes, thresholds, missing_left, roots, value, out):
+        n = X.shape[0]
+        for b in numba.prange((n + BLOCK_ROWS - 1) // BLOCK_ROWS):
+            lo = b * BLOCK_ROWS
+            _traverse_block(X, nodes, thresholds, missing_left, roots, value, out, lo, min(lo + BLOCK_ROWS, n))
+
+
+def _kernel_ready(kernel):
+    """内核在本进程里已经编译或从缓存载入过"""
+    return bool(kernel.signatures)
+
+
+def _traverse_numpy(X, ens, out, batch=4096):
+    """
+    没有 numba 时：把（行, 树）对当作一组游标，按深度逐层同时推进，
+    每一层只有几次整块的 gather / 比较；叶子的左右孩子指向自己，到达叶子后原地不动
+    """
+    n_nodes = ens.n_nodes
+    self_loop = np.arange(n_nodes, dtype=np.int32)
+    left = np.where(ens.left == LEAF, self_loop, ens.left)
+    right = np.where(ens.right == LEAF, self_loop, ens.right)
+    is_leaf = ens.left == LEAF
+    missing_left = ens.missing_left.astype(bool)
+    for lo in range(0, X.shape[0], batch):
+        Xb = X[lo:lo + batch]
+        rows = np.arange(len(Xb))[:, None]
+        node = np.broadcast_to(ens.roots, (len(Xb), ens.n_trees)).copy()
+        while True:
+            active = ~is_leaf[node]
+            if not active.any():
+                break
+            x = Xb[rows, ens.feature[node]]
+            go_left = (x <= ens.threshold[node]) | (np.isnan(x) & missing_left[node])
+            node = np.where(go_left, left[node], right[node])
+        out[lo:lo + batch] = ens.value[node].sum(axis=1)
+
+
+def main():
+    """与 sklearn 的结果对比，测单条与批量打分的耗时，以及 pickle 与 .sepm 的体积和加载耗时"""
+    import tempfile
+
+    import joblib
+
+    from sepsis.artifacts import artifact_path, get_dirs, load_artifact
+
+    dirs = get_dirs()
+    model = load_artifact('model', dirs)
+    X = load_artifact('X_test', dirs)
+    start = time.perf_counter()
+    ens = compile_model(model)
+    print(f"编译: {ens.kind}，{ens.n_trees} 棵树，{ens.n_nodes} 个节点，"
+          f"{ens.nbytes / 1024 ** 2:.2f} MB，耗时 {1000 * (time.perf_counter() - start):.1f} ms"
+          f"（{'numba' if HAS_NUMBA else 'numpy'} 遍历）")
+
+    preds, proba = ens.predict_both(X)     # 首次调用包含 JIT 编译
+    same = np.array_equal(preds, model.predict(X)) and np.allclose(proba, model.predict_proba(X), atol=1e-6)
+    print(f"与 sklearn 一致: {'✓' if same else '✗'}")
+
+    def best(fn, repeat):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return min(times)
+
+    one = X.iloc[:1]
+    row = ens._as_matrix(one)
+    t_sk = best(lambda: (model.predict(one), model.predict_proba(one)), 5)
+    t_c = best(lambda: ens.predict_both(one), 50)
+    t_row = best(lambda: ens.predict_both(row), 200)
+    print(f"单条住院: sklearn {t_sk * 1e6:,.0f} µs，编译后 {t_c * 1e6:,.1f} µs（DataFrame）/ {t_row * 1e6:,.1f} µs（float32 数组）")
+    t_sk = best(lambda: (model.predict(X), model.predict_proba(X)), 3)
+    t_c = best(lambda: ens.predict_both(X), 3)
+    print(f"批量 {len(X)} 条: sklearn {len(X) / t_sk:,.0f} 条/秒，编译后 {len(X) / t_c:,.0f} 条/秒")
+
+    pkl = artifact_path('model', dirs)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = save_compiled(ens, os.path.join(tmp, 'plain.sepm'))
+        packed = save_compiled(ens, os.path.join(tmp, 'packed.sepm'), compress=True)
+        assert np.array_equal(load_compiled(packed).predict_both(row)[1], ens.predict_both(row)[1])
+        for label, path, load in [('pickle', pkl, joblib.load),
+                                  ('.sepm 内存映射', plain, load_compiled),
+                                  ('.sepm 压缩', packed, load_compiled)]:
+            t = best(lambda: load(path), 3)
+            print(f"{label:<12} {os.path.getsize(path) / 1024 ** 2:7.2f} MB，加载 {t * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
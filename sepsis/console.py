@@ -0,0 +1,91 @@
+# 文件：sepsis/console.py
+# 按线程分流的标准输出：管道并发运行多个阶段时，每个阶段的 print 进各自的缓冲区，
+# 不能再用 contextlib.redirect_stdout（它替换的是整个进程的 sys.stdout，并发时会串台）。
+# install() 把 sys.stdout / sys.stderr 换成分流器（只换一次）；capture() 在 with 块内
+# 把当前线程的输出收进缓冲区；silence() 丢弃当前线程的输出（例如绘图库的杂项提示）。
+# 阶段内部另起的线程（joblib 线程池等）没有自己的去向：只有一个阶段在捕获时归入它，否则输出到原来的流。
+import contextlib
+import io
+import os
+import sys
+import threading
+
+
+class ThreadRouter(io.TextIOBase):
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._active = []
+
+    def _target(self):
+        target = getattr(self._local, 'target', None)
+        if target is not None:
+            return target
+        with self._lock:
+            return self._active[0] if len(self._active) == 1 else self.default
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        return False
+
+    @property
+    def encoding(self):
+        return getattr(self.default, 'encoding', 'utf-8')
+
+    @contextlib.contextmanager
+    def route(self, target, shared=True):
+        """with 块内当前线程写到 target；shared=True 时同时登记为无主线程的去向候选"""
+        previous = getattr(self._local, 'target', None)
+        self._local.target = target
+        if shared:
+            with self._lock:
+                self._active.append(target)
+        try:
+            yield target
+        finally:
+            self._local.target = previous
+            if shared:
+                with self._lock:
+                    self._active.remove(target)
+
+
+_install_lock = threading.Lock()
+
+
+def install():
+    """把 sys.stdout / sys.stderr 换成分流器（幂等），返回 (stdout 分流器, stderr 分流器)"""
+    with _install_lock:
+        if not isinstance(sys.stdout, ThreadRouter):
+            sys.stdout = ThreadRouter(sys.stdout)
+        if not isinstance(sys.stderr, ThreadRouter):
+            sys.stderr = ThreadRouter(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+@contextlib.contextmanager
+def capture(buf=None):
+    """当前线程的 stdout 和 stderr 都写进 buf（默认新建 StringIO），yield buf"""
+    buf = buf if buf is not None else io.StringIO()
+    out, err = install()
+    with out.route(buf), err.route(buf):
+        yield buf
+
+
+@contextlib.contextmanager
+def silence():
+    """丢弃当前线程在 with 块内的 stdout 和 stderr"""
+    if not isinstance(sys.stdout, ThreadRouter):
+        # 没有安装分流器（单独运行某一步）：整个进程只有这一个阶段，直接重定向即可
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+            yield
+        return
+    null = io.StringIO()
+    with sys.stdout.route(null, shared=False), sys.stderr.route(null, shared=False):
+        yield
@@ -0,0 +1,133 @@
+# 文件：sepsis/cvstore.py
+# 交叉验证结果库（SQLite）：按 数据集指纹 + 折划分 + 模型 + 参数 + 折号 记录每折的分数和训练耗时。
+# 搜索中断后重跑、或网格里只加了一个新点时，已经算过的（配置, 折）直接从库里取，不再重训；
+# 同一张表也用来统计每个配置的训练成本，供容量规划参考。
+# 用法：python -m sepsis.cvstore [库路径]   打印成本报告
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# 不影响结果的参数，不参与模型指纹
+IGNORED_PARAMS = ('n_jobs', 'verbose', 'warm_start')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    dataset   TEXT    NOT NULL,  -- 训练数据（X, y）的内容哈希
+    folds     TEXT    NOT NULL,  -- 折划分的哈希
+    estimator TEXT    NOT NULL,  -- 模型类 + 固定参数
+    params    TEXT    NOT NULL,  -- 搜索的参数（JSON，键排序）
+    fold      INTEGER NOT NULL,
+    score     REAL    NOT NULL,
+    fit_time  REAL    NOT NULL,  -- 本次训练耗时（秒）；warm start 时只含新增的树
+    grown_from INTEGER NOT NULL DEFAULT 0,  -- 训练前已有的树数 / 迭代数，0 表示从头训练
+    created   TEXT    NOT NULL,
+    PRIMARY KEY (dataset, folds, estimator, params, fold)
+)
+"""
+
+
+def array_fingerprint(*arrays):
+    """若干数组（形状、类型、内容）的 sha256"""
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f'{a.shape}|{a.dtype.str}|'.encode('utf-8'))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def folds_fingerprint(folds):
+    return array_fingerprint(*(np.asarray(te, dtype=np.int64) for _, te in folds))
+
+
+def estimator_key(estimator, searched=()):
+    """模型类名 + 除搜索参数以外的全部参数（如 random_state、criterion）"""
+    cls = type(estimator)
+    fixed = {k: v for k, v in estimator.get_params().items()
+             if k not in searched and k not in IGNORED_PARAMS}
+    return f'{cls.__module__}.{cls.__name__}' + json.dumps(fixed, sort_keys=True, default=str)
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class CVStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def get(self, dataset, folds, estimator, params):
+        """已记录的 {折号: (分数, 训练耗时)}"""
+        rows = self.conn.execute(
+            "SELECT fold, score, fit_time FROM trials "
+            "WHERE dataset=? AND folds=? AND estimator=? AND params=?",
+            (dataset, folds, estimator, params_key(params)))
+        return {fold: (score, fit_time) for fold, score, fit_time in rows}
+
+    def put(self, dataset, folds, estimator, params, fold, score, fit_time, grown_from=0):
+        # 每条结果单独提交：搜索中途被打断，已完成的折也不会丢
+        self.conn.execute(
+            "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (dataset, folds, estimator, params_key(params), int(fold), float(score), float(fit_time),
+             int(grown_from), time.strftime('%Y-%m-%d %H:%M:%S')))
+        self.conn.commit()
+
+    def cost_report(self, dataset=None):
+        """
+        每个（数据集, 模型, 参数）一行：折数、平均 / 标准差分数、训练耗时合计与每折平均
+
+        warm start 得到的记录只包含增量耗时，grown_from 列可以区分。
+        """
+        query = "SELECT dataset, estimator, params, fold, score, fit_time, grown_from FROM trials"
+        args = ()
+        if dataset:
+            query += " WHERE dataset=?"
+            args = (dataset,)
+        df = pd.read_sql_query(query, self.conn, params=args)
+        if df.empty:
+            return df
+        df['dataset'] = df['dataset'].str[:12]
+        df['estimator'] = df['estimator'].str.split('{').str[0].str.rsplit('.').str[-1]
+        report = df.groupby(['dataset', 'estimator', 'params']).agg(
+            folds=('fold', 'count'),
+            mean_score=('score', 'mean'),
+            std_score=('score', 'std'),
+            fit_seconds=('fit_time', 'sum'),
+            fit_per_fold=('fit_time', 'mean'),
+            warm_started=('grown_from', lambda s: int((s > 0).sum())),
+        )
+        return report.sort_values('mean_score', ascending=False)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join('sepsis', 'data', 'cv_results.sqlite')
+    if not os.path.exists(path):
+        print(f"❌ 没有找到交叉验证结果库: {path}")
+        sys.exit(1)
+    with CVStore(path) as store:
+        report = store.cost_report()
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.max_colwidth', 60):
+        print(report if not report.empty else "（结果库为空）")
+
+
+if __name__ == '__main__':
+    main()
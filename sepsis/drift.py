@@ -0,0 +1,165 @@
+# 文件：sepsis/drift.py
+# 特征漂移：特征工程步骤为训练集的每个特征保存一份直方图草图（按训练集分位数切箱的边界 + 各箱条数），
+# 之后任何一批新数据（测试集、打分服务的每个微批）只需按同样的边界分箱计数，就能算 PSI 和 KS，
+# 不必再读训练数据。
+#   - 分箱一次完成所有特征：每列按训练集的范围缩放后加上列号偏移，所有列的边界拼成一个有序数组，
+#     整批数据只做一次 searchsorted + 一次 bincount；
+#   - 条数可以逐批累加（DriftMonitor），PSI / KS 随时可算；
+#   - 低于训练集最小值、高于最大值的值各自单独一箱（超出训练范围本身就是强烈的漂移信号）；
+#   - PSI 在并成 groups 组的分位数箱上计算（超范围、缺失值各自单独一组）；KS 只在箱边界上比较两个
+#     经验分布函数，是精确 KS 的下界，误差不超过训练集一个箱的占比（默认 1%）。
+import numpy as np
+import pandas as pd
+
+# PSI 的常用分级
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+# 空箱的占比下限，避免 log(0)
+EPS = 1e-4
+
+
+def _quantile_edges(values, bins):
+    """每列 bins+1 个边界（训练集的 0、1/bins、…、1 分位数，即最小值 … 最大值），形状 (列数, bins+1)；全缺失的列取 0"""
+    qs = np.linspace(0, 1, bins + 1)
+    edges = np.empty((values.shape[1], bins + 1))
+    for j in range(values.shape[1]):
+        col = values[:, j]
+        col = col[~np.isnan(col)]
+        edges[j] = np.quantile(col, qs) if len(col) else 0.0
+    return edges
+
+
+class Sketch:
+    """
+    训练集各特征的直方图草图
+
+    edges (列数, bins+1)：边界，第一个是训练集最小值、最后一个是最大值；
+    x 落在第 #{边界 ≤ x} 个箱，但等于最大值的仍算在最后一个分位数箱里
+    counts (列数, bins+3)：训练集各箱的条数，依次为 低于最小值、bins 个分位数箱、高于最大值、缺失值
+    """
+
+    def __init__(self, features, edges, counts, lo, hi):
+        self.features = list(features)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.lo = np.asarray(lo, dtype=np.float64)
+        self.hi = np.asarray(hi, dtype=np.float64)
+        self.bins = self.edges.shape[1] - 1
+        span = self.hi - self.lo
+        self._span = np.where(span > 0, span, 1.0)
+        # 所有列的边界变换到各自的区间 [4j+1, 4j+2] 后拼成一个有序数组；
+        # 最大值的边界在变换后往上挪一个浮点间隔，等于最大值的仍落在最后一个分位数箱
+        scaled = self._scale(self.edges.T).T
+        scaled[:, -1] = np.nextafter(scaled[:, -1], np.inf)
+        self._flat = scaled.ravel()
+
+    @classmethod
+    def build(cls, X, bins=100):
+        values = X.to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        # 全缺失的列取 [0, 1]
+        lo = np.where(missing.all(axis=0), 0.0, np.where(missing, np.inf, values).min(axis=0))
+        hi = np.where(missing.all(axis=0), 1.0, np.where(missing, -np.inf, values).max(axis=0))
+        sketch = cls(X.columns, _quantile_edges(values, bins), np.zeros((X.shape[1], bins + 3)), lo, hi)
+        sketch.counts = sketch.bin_counts(values)
+        return sketch
+
+    def _scale(self, values):
+        """第 j 列的值 -> 4j + 1 + 按训练集范围缩放后截到 [-1, 2] 的值；单调，与边界相等的值变换后仍相等"""
+        z = (values - self.lo) / self._span
+        return 4.0 * np.arange(values.shape[-1]) + 1.0 + np.clip(z, -1.0, 2.0)
+
+    def bin_counts(self, values):
+        """values (行数, 列数)，列顺序与 features 相同；返回各列各箱的条数 (列数, bins+3)"""
+        values = np.asarray(values, dtype=np.float64)
+        n, m = values.shape
+        if m != len(self.features):
+            raise ValueError(f"数据有 {m} 列，草图有 {len(self.features)} 个特征")
+        col = np.arange(m)
+        missing = np.isnan(values)
+        z = self._scale(np.where(missing, 0.0, values))
+        # 在所有列拼起来的边界里找位置，再减去前面各列的边界数，就是列内的箱号
+        width = self.bins + 3
+        b = np.searchsorted(self._flat, z.ravel(), side='right').reshape(n, m) - col * (self.bins + 1)
+        b[missing] = width - 1
+        cell = col * width + b
+        return np.bincount(cell.ravel(), minlength=m * width).reshape(m, width)
+
+    def to_dict(self):
+        return {'features': self.features, 'bins': self.bins, 'n': int(self.counts[0].sum()),
+                'edges': self.edges.tolist(), 'counts': self.counts.tolist(),
+                'lo': self.lo.tolist(), 'hi': self.hi.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['features'], d['edges'], d['counts'], d['lo'], d['hi'])
+
+
+def psi(expected, actual, groups=10):
+    """
+    各列的 PSI：expected / actual 为 (列数, bins+3) 的条数；
+    bins 个分位数箱按序号并成 groups 组，低于最小值、高于最大值、缺失值各自一组
+    """
+    bins = expected.shape[1] - 3
+    group = np.concatenate([[0], 1 + np.arange(bins) * groups // bins, [groups + 1, groups + 2]])
+    onehot = np.zeros((bins + 3, groups + 3))
+    onehot[np.arange(bins + 3), group] = 1.0
+    p = expected @ onehot
+    q = actual @ onehot
+    p = np.maximum(p / p.sum(axis=1, keepdims=True), EPS)
+    q = np.maximum(q / np.maximum(q.sum(axis=1, keepdims=True), 1), EPS)
+    return ((q - p) * np.log(q / p)).sum(axis=1)
+
+
+def ks(expected, actual):
+    """各列非缺失值在箱边界上的经验分布函数之差的最大值"""
+    e = np.cumsum(expected[:, :-1], axis=1) / np.maximum(expected[:, :-1].sum(axis=1, keepdims=True), 1)
+    a = np.cumsum(actual[:, :-1], axis=1) / np.maximum(actual[:, :-1].sum(axis=1, keepdims=True), 1)
+    return np.abs(e - a).max(axis=1)
+
+
+def status(value):
+    if value >= PSI_ALERT:
+        return '明显漂移'
+    if value >= PSI_WARN:
+        return '轻微漂移'
+    return '稳定'
+
+
+class DriftMonitor:
+    """对照训练集草图累加新数据的分箱条数；update() 可逐批调用（如打分服务的每个微批）"""
+
+    def __init__(self, sketch, feature_names=None, groups=10):
+        self.sketch = sketch
+        self.groups = groups
+        # 新数据的列顺序（如模型的特征顺序）与草图不同时，先换成草图的顺序
+        names = list(feature_names) if feature_names is not None else sketch.features
+        missing = [c for c in sketch.features if c not in names]
+        if missing:
+            raise ValueError(f"数据缺少草图中的特征: {missing[:5]}{' …' if len(missing) > 5 else ''}")
+        self._order = np.array([names.index(c) for c in sketch.features])
+        self.counts = np.zeros_like(sketch.counts)
+
+    def update(self, values):
+        values = np.asarray(values)
+        if len(values):
+            # 整体换成新数组而不是就地累加：其他线程随时 report() 读到的都是某一批之后的完整计数
+            self.counts = self.counts + self.sketch.bin_counts(values[:, self._order])
+        return self
+
+    @property
+    def n(self):
+        return int(self.counts[0].sum())
+
+    def report(self):
+        """每个特征一行：PSI、KS、训练 / 新数据的缺失率、分级；按 PSI 从高到低"""
+        expected = self.sketch.counts
+        n_train = max(int(expected[0].sum()), 1)
+        df = pd.DataFrame({
+            'psi':          psi(expected, self.counts, self.groups),
+            'ks':           ks(expected, self.counts),
+            'missing_train': expected[:, -1] / n_train,
+            'missing_new':  self.counts[:, -1] / max(self.n, 1),
+        }, index=pd.Index(self.sketch.features, name='feature'))
+        df['status'] = df['psi'].map(status)
+        return df.sort_values('psi', ascending=False)
@@ -0,0 +1,57 @@
+# 文件：sepsis/engines.py
+# 可插拔的模型引擎：训练步骤按名字选引擎，评估 / 解释 / 预测步骤按模型类型识别引擎。
+# 每个引擎声明逐级减半搜索用的资源参数（树数 / 迭代数），两者都支持 warm start 逐级加大。
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+
+
+class RandomForestEngine:
+    """原来的随机森林（精确分裂）；特征中不能有缺失值"""
+    name = 'rf'
+    label = '随机森林'
+    estimator_cls = RandomForestClassifier
+    resource = 'n_estimators'
+    allow_nan = False
+    # 单个模型用 n_jobs=1 训练，由搜索的外层线程池并行
+    threaded = False
+
+    def make(self, random_state=None, **params):
+        return RandomForestClassifier(random_state=random_state, **params)
+
+
+class HistGradientBoostingEngine:
+    """
+    直方图梯度提升：特征先分箱（每列至多 255 个箱），按箱统计梯度找分裂点，
+    训练时间随样本数近似线性增长，模型只保存分箱边界和树，体积远小于深森林。
+    缺失值原生支持：NaN 单独成箱，每次分裂时学习缺失值走左边还是右边。
+    """
+    name = 'hgb'
+    label = '直方图梯度提升'
+    estimator_cls = HistGradientBoostingClassifier
+    resource = 'max_iter'
+    allow_nan = True
+    # 单个模型内部已用 OpenMP 多线程，搜索时外层不再并行
+    threaded = True
+
+    def make(self, random_state=None, **params):
+        # 关闭早停：warm start 逐级加迭代时，结果才与一次训练到同样迭代数相同
+        return HistGradientBoostingClassifier(random_state=random_state, early_stopping=False, **params)
+
+
+ENGINES = {
+    'rf':  RandomForestEngine,
+    'hgb': HistGradientBoostingEngine,
+}
+
+
+def get_engine(name):
+    if name not in ENGINES:
+        raise ValueError(f"未知的模型引擎: {name}（可选: {', '.join(ENGINES)}）")
+    return ENGINES[name]()
+
+
+def engine_for(model):
+    """按已训练模型的类型（或编译后模型记录的引擎名）找到对应引擎（评估 / 解释 / 预测步骤用）"""
+    for cls in ENGINES.values():
+        if isinstance(model, cls.estimator_cls) or getattr(model, 'engine', None) == cls.name:
+            return cls()
+    raise TypeError(f"不支持的模型类型: {type(model).__name__}")
@@ -0,0 +1,299 @@
+# 文件：sepsis/explain.py
+# 并行 + 缓存的 TreeSHAP（6_explain 用）：
+#   - 解释器直接由编译后的模型（.sepm，见 sepsis/compiled.py）构造：把全局节点数组切回逐棵树，
+#     交给 shap 的通用树格式，不再依赖 sklearn 对象，也不用把模型 pickle 给每个工作进程；
+#   - 进程池的每个工作进程按路径内存映射同一个模型文件（共享页缓存），解释器每个进程只建一次；
+#     抽样数据放进共享内存（sepsis/shm.py），任务只传 (行起点, 行终点)；
+#   - 结果矩阵按 模型指纹 + 数据指纹 + shap 版本 缓存在 data/explain_cache/ 下，
+#     模型和数据没变时重跑解释步骤直接读缓存；
+#   - 自适应抽样（adaptive_explain）：逐批加样本，平均 |SHAP| 的 Top-k 排序在给定置信度下稳定后提前停止。
+import hashlib
+import json
+import os
+
+import numpy as np
+import shap
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.special import ndtr, ndtri
+
+from sepsis.compiled import LEAF, load_compiled
+from sepsis.cvstore import array_fingerprint
+from sepsis.shm import SharedArrays, attach
+
+CACHE_DIR = 'explain_cache'
+# 缓存最多保留几份（按修改时间淘汰最旧的）
+CACHE_KEEP = 8
+
+# 少于这么多行时不开进程池：工作进程启动并导入 shap 要几秒，比小样本的计算本身还慢
+PARALLEL_MIN_ROWS = 2000
+
+# 每个工作进程里已建好的解释器：(模型路径, 大小, 修改时间) -> shap.TreeExplainer
+_EXPLAINERS = {}
+
+
+def _node_depths(left, right, roots):
+    """每个节点的深度（从各树的根逐层向下）"""
+    depth = np.zeros(len(left), dtype=np.int32)
+    frontier, d = np.asarray(roots), 0
+    while len(frontier):
+        frontier = frontier[left[frontier] != LEAF]
+        frontier = np.concatenate([left[frontier], right[frontier]])
+        d += 1
+        depth[frontier] = d
+    return depth
+
+
+def _fill_internal(value, left, right, cover, roots):
+    """
+    梯度提升的编译模型只保存叶子值；内部节点补成两个子节点按样本数加权的平均，
+    根节点的值即这棵树的期望输出（shap 的 expected_value 由各树根节点值求和得到）
+    """
+    value = value.astype(np.float64)
+    cover = cover.astype(np.float64)
+    depth = _node_depths(left, right, roots)
+    for d in range(depth.max() - 1, -1, -1):
+        idx = np.flatnonzero((depth == d) & (left != LEAF))
+        l, r = left[idx], right[idx]
+        w = np.maximum(cover[l] + cover[r], np.finfo(np.float64).tiny)
+        value[idx] = (cover[l] * value[l] + cover[r] * value[r]) / w
+    return value
+
+
+def tree_model(ens):
+    """
+    CompiledEnsemble -> shap 的通用树模型字典（只解释正类）
+
+    随机森林：叶子值为正类比例 / 树数，解释的是概率；梯度提升：叶子值为 log-odds，加上基线。
+    """
+    left, right, feature = ens.left, ens.right, ens.feature
+    if ens.kind == 'forest':
+        value = ens.value[:, 1].astype(np.float64) / ens.n_trees
+        output = {'tree_output': 'probability', 'base_offset': 0.0}
+    else:
+        value = _fill_internal(ens.value[:, 0], left, right, ens.cover, ens.roots)
+        output = {'tree_output': 'log_odds', 'base_offset': ens.baseline}
+
+    bounds = np.append(ens.roots, ens.n_nodes)
+    is_leaf = left == LEAF
+    children_default = np.where(ens.missing_left.astype(bool), left, right)
+    trees = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        leaf = is_leaf[lo:hi]
+        local = lambda a: np.where(leaf, -1, a[lo:hi] - lo).astype(np.int32)
+        trees.append({
+            'children_left': local(left),
+            'children_right': local(right),
+            'children_default': local(children_default),
+            'features': np.where(leaf, -2, feature[lo:hi]).astype(np.int32),
+            'thresholds': ens.threshold[lo:hi].astype(np.float64),
+            'values': value[lo:hi, None],
+            'node_sample_weight': ens.cover[lo:hi].astype(np.float64),
+        })
+    # 编译模型的阈值已向下取整到 float32，输入按 float32 比较，与 sklearn 的预测一致
+    return {'trees': trees, 'input_dtype': np.float32, 'internal_dtype': np.float64, **output}
+
+
+def explainer_for(path):
+    """本进程内按模型文件缓存的解释器（文件被替换后重建）"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _EXPLAINERS:
+        _EXPLAINERS.clear()
+        _EXPLAINERS[key] = shap.TreeExplainer(tree_model(load_compiled(path)))
+    return _EXPLAINERS[key]
+
+
+def _shap_slice(path, spec, lo, hi):
+    """进程池任务：挂载共享的抽样数据，计算 X[lo:hi] 的 SHAP 值"""
+    explainer = explainer_for(path)
+    with attach(spec) as arr:
+        return lo, np.asarray(explainer.shap_values(arr['X'][lo:hi]), dtype=np.float64)
+
+
+def shap_values(path, X, chunk_size=100, n_jobs=None):
+    """
+    X (float32, 列顺序与模型一致) 的 SHAP 矩阵，按 chunk_size 行一批分给进程池；
+    返回 (SHAP 矩阵, 期望输出)
+    """
+    n = len(X)
+    tasks = [(lo, min(n, lo + chunk_size)) for lo in range(0, n, chunk_size)]
+    n_jobs = min(effective_n_jobs(n_jobs), max(len(tasks), 1)) if n >= PARALLEL_MIN_ROWS else 1
+    out = np.zeros(X.shape, dtype=np.float64)
+    if n_jobs == 1:
+        explainer = explainer_for(path)
+        for i, (lo, hi) in enumerate(tasks, 1):
+            out[lo:hi] = explainer.shap_values(X[lo:hi])
+            print(f"   处理批次 {i}/{len(tasks)} ({i / len(tasks) * 100:.1f}%)...")
+        return out, float(np.ravel(explainer.expected_value)[0])
+
+    print(f"   {len(tasks)} 个批次，{n_jobs} 个进程并行")
+    with SharedArrays({'X': X}) as shared:
+        done = 0
+        results = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+            delayed(_shap_slice)(path, shared.spec, lo, hi) for lo, hi in tasks)
+        for lo, vals in results:
+            out[lo:lo + len(vals)] = vals
+            done += 1
+            print(f"   完成批次 {done}/{len(tasks)} ({done / len(tasks) * 100:.1f}%)...")
+    # 期望输出只依赖模型，主进程里直接由树模型算出，不必为此再建一次解释器
+    model = tree_model(load_compiled(path))
+    expected = sum(t['values'][0, 0] for t in model['trees']) + model['base_offset']
+    return out, float(expected)
+
+
+# ---------------------------------------------------------------------
+# 结果缓存
+# ---------------------------------------------------------------------
+
+def cache_key(ens, X, index):
+    """模型内容 + 抽样数据（值、行号、列名）+ shap 版本"""
+    h = hashlib.sha256()
+    h.update(ens.fingerprint().encode('utf-8'))
+    h.update(array_fingerprint(X, np.asarray(index).astype(str)).encode('utf-8'))
+    h.update(f'shap={shap.__version__}|tree_path_dependent'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def cache_path(dirs, key):
+    return os.path.join(dirs.data, CACHE_DIR, key[:32] + '.npz')
+
+
+def load_cached(dirs, key):
+    """命中时返回存入的字典（至少有 values、expected），否则 None"""
+    path = cache_path(dirs, key)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if str(f['key']) != key:
+            return None
+        entry = {name: f[name] for name in f.files if name != 'key'}
+    os.utime(path)
+    return entry
+
+
+def save_cached(dirs, key, values, expected, **extra):
+    path = cache_path(dirs, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, key=key, values=values, expected=expected, **extra)
+    os.replace(tmp, path)
+    # 只保留最近用过的几份
+    folder = os.path.dirname(path)
+    entries = sorted((os.path.join(folder, n) for n in os.listdir(folder) if n.endswith('.npz')),
+                     key=os.path.getmtime, reverse=True)
+    for old in entries[CACHE_KEEP:]:
+        os.remove(old)
+    return path
+
+
+def explain(path, sampled, dirs, chunk_size=100, n_jobs=None, cache=True):
+    """
+    抽样数据 sampled（DataFrame）的 SHAP 矩阵，先查缓存
+
+    返回 (SHAP 矩阵, 期望输出, 是否命中缓存)
+    """
+    ens = load_compiled(path)
+    X = np.ascontiguousarray(sampled[ens.feature_names].to_numpy(dtype=np.float32))
+    key = cache_key(ens, X, sampled.index)
+    if cache:
+        hit = load_cached(dirs, key)
+        if hit is not None:
+            return hit['values'], float(hit['expected']), True
+    values, expected = shap_values(path, X, chunk_size=chunk_size, n_jobs=n_jobs)
+    if cache:
+        save_cached(dirs, key, values, expected)
+    return values, expected, False
+
+
+# ---------------------------------------------------------------------
+# 自适应抽样：排序稳定后提前停止
+# ---------------------------------------------------------------------
+
+def ranking_error(abs_values, n_total, top_k, tolerance):
+    """
+    按已算的行估计平均 |SHAP| 的 Top-k 排序出错的概率上界
+
+    相邻名次（含第 k 名与第 k+1 名）两两比较：同一批行上的配对差值给出均值差的标准误
+    （无放回抽样，乘有限总体校正）；差距小于 tolerance × 较大者的算作并列，不计为排错。
+    各对的正态尾概率相加（Bonferroni）即整个排序出错的概率上界。
+    返回 (上界, 特征按平均 |SHAP| 降序, 各特征平均 |SHAP| 的标准误)
+    """
+    n = len(abs_values)
+    mean = abs_values.mean(axis=0)
+    order = np.argsort(-mean, kind='stable')
+    fpc = np.sqrt(max(n_total - n, 0) / max(n_total - 1, 1))
+    se = abs_values.std(axis=0, ddof=1) / np.sqrt(n) * fpc if n > 1 else np.full(len(mean), np.inf)
+    k = min(top_k, len(order) - 1)
+    if k <= 0:
+        return 0.0, order, se
+    hi, lo = order[:k], order[1:k + 1]
+    diff = abs_values[:, hi] - abs_values[:, lo]
+    gap = diff.mean(axis=0) + tolerance * mean[hi]
+    gap_se = diff.std(axis=0, ddof=1) / np.sqrt(n) * fpc if n > 1 else np.full(k, np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(gap_se > 0, gap / gap_se, np.inf)
+    return float(min(1.0, ndtr(-z).sum())), order, se
+
+
+def look_schedule(limit, batch):
+    """自适应抽样每次检查时累计的行数：每批至少 batch 行、且随已算行数增长，直到 limit"""
+    looks, n = [], 0
+    while n < limit:
+        n += min(limit - n, max(batch, n // 2))
+        looks.append(n)
+    return looks
+
+
+def adaptive_explain(path, X, dirs, batch=200, max_samples=None, top_k=10, confidence=0.95,
+                     tolerance=0.02, chunk_size=100, n_jobs=None, random_state=42, cache=True):
+    """
+    逐批（打乱后的 X 依次取行）增加 SHAP 样本，直到平均 |SHAP| 的 Top-k 排序出错的概率上界
+    不超过每次检查分到的显著性水平，或用完 max_samples / 全部行
+
+    检查次数由批次安排事先确定，总的 1 - confidence 平均分给各次检查（Bonferroni），
+    反复检查、一达标就停也不会抬高整体出错的概率。
+    返回 (抽到的行 DataFrame, SHAP 矩阵, 期望输出, 报告字典, 是否命中缓存)；
+    报告含所用行数、检查次数与每次的显著性水平、排序出错概率上界、平均 |SHAP| 置信区间的最大半宽。
+    """
+    ens = load_compiled(path)
+    shuffled = X.sample(frac=1.0, random_state=random_state)[ens.feature_names]
+    limit = min(len(shuffled), max_samples or len(shuffled))
+    Xf = np.ascontiguousarray(shuffled.iloc[:limit].to_numpy(dtype=np.float32))
+    key = cache_key(ens, Xf, shuffled.index[:limit])
+    settings = f'adaptive|bonferroni|{batch}|{top_k}|{confidence}|{tolerance}|{len(shuffled)}'
+    key = hashlib.sha256((key + settings).encode('utf-8')).hexdigest()
+    if cache:
+        hit = load_cached(dirs, key)
+        if hit is not None:
+            report = json.loads(str(hit['report']))
+            return shuffled.iloc[:report['n_samples']], hit['values'], float(hit['expected']), report, True
+
+    z = float(ndtri(0.5 + confidence / 2))
+    # 批次随已算行数增长，检查次数是对数级的（大批次也能用上进程池），每次分到的水平不至于太小
+    looks = look_schedule(limit, batch)
+    alpha = (1.0 - confidence) / len(looks)
+    parts, n, expected = [], 0, 0.0
+    for end in looks:
+        vals, expected = shap_values(path, Xf[n:end], chunk_size=chunk_size, n_jobs=n_jobs)
+        parts.append(vals)
+        n = end
+        abs_values = np.abs(np.concatenate(parts))
+        bound, order, se = ranking_error(abs_values, len(shuffled), top_k, tolerance)
+        print(f"   已用 {n} 条：Top-{top_k} 排序出错概率上界 {bound:.4f}（目标 ≤ {alpha:.4f}）")
+        if bound <= alpha:
+            break
+    values = np.concatenate(parts)
+    report = {
+        'n_samples': n,
+        'n_total': len(shuffled),
+        'converged': bound <= alpha,
+        'error_bound': bound,
+        'confidence': confidence,
+        'n_looks': len(looks),
+        'alpha_per_look': alpha,
+        'top_k': top_k,
+        'max_halfwidth': float(z * np.max(se[order[:top_k]])),
+    }
+    if cache:
+        save_cached(dirs, key, values, expected, report=json.dumps(report))
+    return shuffled.iloc[:n], values, expected, report, False
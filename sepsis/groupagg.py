@@ -0,0 +1,195 @@
+# 文件：sepsis/groupagg.py
+# 按住院（icustayid）分段聚合的专用内核：
+# 只按 id 排序一次（数据已按 id 连续时直接跳过），然后逐列在连续数组上用 ufunc.reduceat
+# 算出 last / mean / max / min（以及 std / count / first），代替 pandas 的通用 groupby 路径。
+# 数据量大时按住院哈希分区，在进程池里并行聚合（输入放在共享内存中）。
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+
+from sepsis.shm import attach
+
+# 与原来 groupby(...).agg(['last','mean','max','min']) 相同的默认特征
+DEFAULT_FUNCS = ('last', 'mean', 'max', 'min')
+SUPPORTED_FUNCS = ('first', 'last', 'mean', 'max', 'min', 'std', 'count')
+
+
+def segment_bounds(keys):
+    """
+    返回 (排序下标或 None, 各段起点, 各段的 key)
+
+    数据已按 key 连续排列时不排序；否则用稳定排序，保证段内行顺序（charttime 顺序）不变，
+    这样 first / last 与 pandas 的语义一致。
+    """
+    keys = np.asarray(keys)
+    order = None
+    if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+    if len(keys) == 0:
+        return order, np.empty(0, dtype=np.intp), keys
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return order, starts, keys[starts]
+
+
+def _agg_column(a, starts, lens, funcs):
+    """单列的分段聚合；a 已按 key 连续排列"""
+    n = len(a)
+    ends = starts + lens
+    float_out = a.dtype if a.dtype.kind == 'f' else np.dtype(np.float64)
+    # 填补之后的列通常没有缺失值：走快速路径，first/last 直接按段首尾取值
+    has_nan = a.dtype.kind == 'f' and bool(np.isnan(a).any())
+    valid = ~np.isnan(a) if has_nan else None
+    out = {}
+
+    if valid is None:
+        count = lens.astype(np.int64)
+    else:
+        # 非缺失计数：前缀和在段边界处相减
+        csum = np.r_[0, np.cumsum(valid, dtype=np.int64)]
+        count = csum[ends] - csum[starts]
+    if 'mean' in funcs or 'std' in funcs:
+        # 累加用 float64，长住院记录也不会丢精度
+        src = a if valid is None else np.where(valid, a, 0)
+        total = np.add.reduceat(src, starts, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+        if 'mean' in funcs:
+            out['mean'] = mean.astype(float_out)
+    if 'std' in funcs:
+        # 两遍法：先减去段均值再求平方和，数值上比 E[x²]-E[x]² 稳定；ddof=1 与 pandas 一致
+        dev = a - np.repeat(mean, lens)
+        if valid is not None:
+            dev[~valid] = 0
+        sq = np.add.reduceat(dev * dev, starts, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(sq / (count - 1))
+        std[count < 2] = np.nan
+        out['std'] = std.astype(float_out)
+    if 'max' in funcs:
+        # fmax / fmin 会跳过 NaN，只有整段都是 NaN 时结果才是 NaN
+        out['max'] = np.fmax.reduceat(a, starts).astype(float_out, copy=False)
+    if 'min' in funcs:
+        out['min'] = np.fmin.reduceat(a, starts).astype(float_out, copy=False)
+    if 'first' in funcs or 'last' in funcs:
+        if valid is None:
+            first_pos, last_pos = starts, ends - 1
+        else:
+            # 在非缺失行号上二分查找每段第一个 / 最后一个非缺失值，整段缺失时落在段外
+            rows = np.flatnonzero(valid)
+            rows = np.r_[-1, rows, n]
+            first_pos = rows[np.searchsorted(rows, starts)]
+            last_pos = rows[np.searchsorted(rows, ends) - 1]
+        if 'first' in funcs:
+            first = a[np.minimum(first_pos, n - 1)].astype(float_out)
+            first[first_pos >= ends] = np.nan
+            out['first'] = first
+        if 'last' in funcs:
+            last = a[np.maximum(last_pos, 0)].astype(float_out)
+            last[last_pos < starts] = np.nan
+            out['last'] = last
+    if 'count' in funcs:
+        out['count'] = count
+    return out
+
+
+def segment_agg(keys, columns, funcs=DEFAULT_FUNCS):
+    """
+    keys:    长度为 n 的分组 id
+    columns: 若干长度为 n 的一维数值数组（或 (n, m) 矩阵，按列处理），NaN 视为缺失并跳过
+    返回 (各组 key, [每列一个 {函数名: 长度 n_groups 的数组}])
+
+    每列都是一维连续数组上的 ufunc.reduceat，不构造 (n, m) 的中间矩阵。
+    """
+    unknown = set(funcs) - set(SUPPORTED_FUNCS)
+    if unknown:
+        raise ValueError(f"不支持的聚合函数: {sorted(unknown)}")
+    if isinstance(columns, np.ndarray) and columns.ndim == 2:
+        columns = [columns[:, j] for j in range(columns.shape[1])]
+
+    order, starts, group_keys = segment_bounds(keys)
+    if len(starts) == 0:
+        empty = {f: np.empty(0, dtype=np.float64) for f in funcs}
+        return group_keys, [dict(empty) for _ in columns]
+    lens = np.diff(np.r_[starts, len(keys)])
+
+    results = []
+    for a in columns:
+        a = np.asarray(a)
+        a = a[order] if order is not None else np.ascontiguousarray(a)
+        results.append(_agg_column(a, starts, lens, funcs))
+    return group_keys, results
+
+
+def _to_frame(group_keys, cols, res, funcs, key):
+    data = {}
+    for c, r in zip(cols, res):
+        for f in funcs:
+            data[f'{c}_{f}'] = r[f]
+    return pd.DataFrame(data, index=pd.Index(group_keys, name=key))
+
+
+def agg_frame(df, key='icustayid', funcs=DEFAULT_FUNCS):
+    """
+    DataFrame 版本：对除 key 以外的所有列做聚合
+
+    列名与 pandas 的 groupby(key).agg(funcs) + '_'.join 一致（<列>_<函数>，按列再按函数排列）。
+    """
+    cols = [c for c in df.columns if c != key]
+    group_keys, res = segment_agg(df[key].to_numpy(), [df[c].to_numpy() for c in cols], funcs)
+    return _to_frame(group_keys, cols, res, funcs, key)
+
+
+def hash_partition(keys, n_parts):
+    """
+    按 key 的乘法哈希（Fibonacci hashing）分到 n_parts 个分区
+
+    同一住院的所有行总在同一分区，分区结果只取决于 key 本身，与行顺序和分区文件无关。
+    """
+    h = np.asarray(keys).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((h >> np.uint64(32)) % np.uint64(n_parts)).astype(np.int32)
+
+
+def _agg_slice(spec, lo, hi, funcs):
+    """进程池任务：挂载共享内存，聚合 rows[lo:hi] 这些行（同属一个哈希分区）"""
+    with attach(spec) as arr:
+        rows = arr['rows'][lo:hi]
+        keys = arr['keys'][rows]
+        values = arr['values']
+        columns = [values[:, j][rows] for j in range(values.shape[1])]
+        del rows, values
+    return segment_agg(keys, columns, funcs)
+
+
+def agg_shared(shared, cols, key='icustayid', funcs=DEFAULT_FUNCS, n_jobs=None, n_parts=None):
+    """
+    并行版 agg_frame
+
+    shared 是 sepsis.shm.SharedArrays，已放入 'keys'（长度 n）和 'values'（(n, len(cols))，
+    建议 Fortran 序）。住院按哈希分成 n_parts 个分区，各分区在进程池中独立聚合，
+    最后按 key 排序拼接，结果与分区数、进程数无关，并与串行的 agg_frame 相同。
+    """
+    unknown = set(funcs) - set(SUPPORTED_FUNCS)
+    if unknown:
+        raise ValueError(f"不支持的聚合函数: {sorted(unknown)}")
+    n_jobs = effective_n_jobs(n_jobs)
+    n_parts = n_parts or 2 * n_jobs
+
+    part = hash_partition(shared.arrays['keys'], n_parts)
+    rows = np.argsort(part, kind='stable')
+    bounds = np.searchsorted(part[rows], np.arange(n_parts + 1))
+    shared.add('rows', rows)
+    del part, rows
+
+    tasks = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    pieces = Parallel(n_jobs=min(n_jobs, max(len(tasks), 1)))(
+        delayed(_agg_slice)(shared.spec, lo, hi, funcs) for lo, hi in tasks)
+
+    if not pieces:
+        return _to_frame(np.empty(0), cols, [{f: np.empty(0) for f in funcs} for _ in cols], funcs, key)
+    # 各分区内部已按 key 有序，拼接后整体再排一次序，输出顺序确定
+    group_keys = np.concatenate([p[0] for p in pieces])
+    order = np.argsort(group_keys, kind='stable')
+    res = [{f: np.concatenate([p[1][j][f] for p in pieces])[order] for f in funcs}
+           for j in range(len(cols))]
+    return _to_frame(group_keys[order], cols, res, funcs, key)
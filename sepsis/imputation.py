@@ -0,0 +1,128 @@
+# 文件：sepsis/imputation.py
+# 中位数填补引擎：在连续的 float32 数组上原地完成 “0 视作缺失 + 中位数填充”，
+# 不再经过 replace / SimpleImputer 的多次整表拷贝；超出内存的数据可用流式近似中位数。
+import numpy as np
+
+# 不参与填补的列
+NON_FEATURES = ('icustayid', 'charttime', 'mortality_90d', 'gender')
+
+
+def feature_columns(columns):
+    return [c for c in columns if c not in NON_FEATURES]
+
+
+def to_block(df, feat, out=None, offset=0):
+    """
+    把特征列拷进 float32、按列连续（Fortran 序）的二维数组
+
+    out 给定时写入 out[offset:offset+len(df)]，用于把多个分区拼进同一块预分配内存。
+    """
+    if out is None:
+        out = np.empty((len(df), len(feat)), dtype=np.float32, order='F')
+        offset = 0
+    for j, col in enumerate(feat):
+        out[offset:offset + len(df), j] = df[col].to_numpy()
+    return out
+
+
+def mask_zeros_(block):
+    """原地把 0 改成 NaN（逐列处理，临时掩码只有一列大小）"""
+    for j in range(block.shape[1]):
+        col = block[:, j]
+        col[col == 0] = np.nan
+    return block
+
+
+def fit_medians(block):
+    """精确中位数：逐列去掉 NaN 后取中位数，全为缺失的列退回 0（即保留原值）"""
+    medians = np.empty(block.shape[1], dtype=np.float64)
+    for j in range(block.shape[1]):
+        col = block[:, j]
+        col = col[~np.isnan(col)]
+        medians[j] = np.median(col) if len(col) else 0.0
+    return medians
+
+
+def fill_(block, medians):
+    """原地用中位数填充 NaN"""
+    for j in range(block.shape[1]):
+        col = block[:, j]
+        col[np.isnan(col)] = medians[j]
+    return block
+
+
+class StreamingMedian:
+    """
+    流式近似中位数（简化的 KLL 分位数草图，每列一个）
+
+    每一层最多保存 k 个样本，第 h 层的样本权重为 2^h；某层满了就排序后隔一个取一个
+    （随机起点）压进上一层。内存为 O(k·log(n/k))，秩误差约为 O(1/k)。
+    """
+
+    def __init__(self, n_cols, k=2048, seed=42):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [[np.empty(0, dtype=np.float32)] for _ in range(n_cols)]
+        self.n = np.zeros(n_cols, dtype=np.int64)
+
+    def update(self, block):
+        """block 中的 NaN 视为缺失，不计入"""
+        for j in range(block.shape[1]):
+            col = block[:, j]
+            col = col[~np.isnan(col)]
+            self.n[j] += len(col)
+            levels = self.levels[j]
+            levels[0] = np.concatenate([levels[0], col])
+            h = 0
+            while h < len(levels) and len(levels[h]) > self.k:
+                items = np.sort(levels[h])
+                promoted = items[self.rng.integers(2)::2]
+                levels[h] = np.empty(0, dtype=np.float32)
+                if h + 1 == len(levels):
+                    levels.append(promoted)
+                else:
+                    levels[h + 1] = np.concatenate([levels[h + 1], promoted])
+                h += 1
+
+    def quantile(self, j, q):
+        levels = self.levels[j]
+        items = np.concatenate(levels)
+        if len(items) == 0:
+            return np.nan
+        weights = np.concatenate([np.full(len(lv), 2 ** h, dtype=np.float64) for h, lv in enumerate(levels)])
+        order = np.argsort(items, kind='stable')
+        cum = np.cumsum(weights[order])
+        return float(items[order][np.searchsorted(cum, q * cum[-1])])
+
+    def medians(self):
+        out = np.array([self.quantile(j, 0.5) for j in range(len(self.levels))])
+        # 全为缺失的列退回 0
+        return np.where(np.isnan(out), 0.0, out)
+
+
+def impute_frame(df, feat, medians):
+    """按已拟合的中位数填补一张表（分区、测试集、在线打分请求都走这里），返回新表"""
+    block = fill_(mask_zeros_(to_block(df, feat)), medians)
+    out = df.copy(deep=False)
+    for j, col in enumerate(feat):
+        out[col] = block[:, j]
+    return out
+
+
+def to_record(feat, medians, method, n_rows):
+    """拟合结果，作为 impute_medians 产物保存，测试集与在线打分直接复用、不再重新拟合"""
+    return {
+        'columns': list(feat),
+        'medians': [float(m) for m in medians],
+        'method':  method,
+        'n_rows':  int(n_rows),
+    }
+
+
+def medians_for(record, feat):
+    """按 feat 的列顺序取出已保存的中位数"""
+    lookup = dict(zip(record['columns'], record['medians']))
+    missing = [c for c in feat if c not in lookup]
+    if missing:
+        raise KeyError(f"填补参数中缺少这些列的中位数: {missing}")
+    return np.array([lookup[c] for c in feat], dtype=np.float64)
@@ -0,0 +1,181 @@
+# 文件：sepsis/metrics.py
+# 评估引擎：AUC、F1、校准都只依赖“分数直方图”这一份充分统计量，可以逐批累加，不必同时持有全部预测。
+#   - 概率按右闭区间分进 bins 个等宽箱（默认 4096），每个（标签, 箱）记录条数、概率之和、概率平方和；
+#   - AUC 由各箱的正负样本数按名次公式求得；同一箱内的正负样本对算半对，
+#     与精确 AUC 的差不超过 tie_mass / 2（报告里给出）；
+#   - 阈值取在箱的边界上（0.5 是边界），分类结果与按概率 > 阈值分类完全一致；
+#   - bootstrap：有放回重抽 n 行后各（标签, 箱）格子的条数服从多项分布，直接从格子抽样，
+#     几千次重抽是一次 (重抽次数, 格子数) 的数组运算，不再逐行重抽、逐次重算指标。
+import numpy as np
+
+# 报告里的指标：名字 -> 说明
+METRICS = {
+    'auc':       'AUC',
+    'f1':        'F1（死亡类）',
+    'precision': '精确率（死亡类）',
+    'recall':    '召回率（死亡类）',
+    'accuracy':  '准确率',
+    'brier':     'Brier 分数',
+    'ece':       '期望校准误差 ECE',
+}
+
+
+def cell_metrics(counts, mean_p, mean_p2, above, group, calibration_bins=10):
+    """
+    counts (R, 2, K)：R 组（标签, 箱）格子条数，K 个箱按概率从低到高排列（可以只含非空箱）；
+    mean_p / mean_p2 (2, K)：各格子概率的均值与平方均值；
+    above (K,)：箱是否在阈值以上（预测为死亡）；group (K,)：箱属于哪个校准分组
+    返回 {指标名: (R,) 数组}
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    neg, pos = counts[:, 0], counts[:, 1]
+    n_neg, n_pos = neg.sum(axis=1), pos.sum(axis=1)
+    n = n_neg + n_pos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 每个正样本：比它低的箱里的负样本全算赢，同箱的算半个
+        below = np.cumsum(neg, axis=1) - neg
+        auc = (pos * (below + 0.5 * neg)).sum(axis=1) / (n_pos * n_neg)
+
+        tp = pos[:, above].sum(axis=1)
+        fp = neg[:, above].sum(axis=1)
+        fn = n_pos - tp
+        tn = n_neg - fp
+        precision = tp / (tp + fp)
+        recall = tp / n_pos
+        f1 = 2 * tp / (2 * tp + fp + fn)
+        accuracy = (tp + tn) / n
+
+        # Brier：Σ (p - y)^2 = Σ p^2 - 2 Σ_{y=1} p + 正样本数
+        sum_p2 = (counts * mean_p2).sum(axis=(1, 2))
+        brier = (sum_p2 - 2 * pos @ mean_p[1] + n_pos) / n
+
+        # ECE：细箱并成 calibration_bins 组，组内 |概率之和 - 实际死亡数| 相加再除以条数
+        onehot = np.zeros((len(group), calibration_bins))
+        onehot[np.arange(len(group)), group] = 1.0
+        expected = (counts * mean_p).sum(axis=1) @ onehot
+        observed = pos @ onehot
+        ece = np.abs(expected - observed).sum(axis=1) / n
+    return {'auc': auc, 'f1': f1, 'precision': precision, 'recall': recall,
+            'accuracy': accuracy, 'brier': brier, 'ece': ece}
+
+
+class MetricAccumulator:
+    """
+    二分类评估的流式累加器：update() 逐批加入 (标签, 正类概率)，metrics() / bootstrap() 随时可算
+
+    两个累加器可以 merge()（例如各进程各算一段后合并）。
+    """
+
+    def __init__(self, bins=4096, threshold=0.5, calibration_bins=10):
+        if not 0 < threshold < 1 or not float(threshold * bins).is_integer():
+            raise ValueError(f"阈值 {threshold} 必须落在 {bins} 个箱的边界上")
+        self.bins = bins
+        self.threshold = threshold
+        self.threshold_bin = int(threshold * bins)
+        self.calibration_bins = calibration_bins
+        self.count = np.zeros((2, bins), dtype=np.int64)
+        self.sum_p = np.zeros((2, bins))
+        self.sum_p2 = np.zeros((2, bins))
+
+    def bin_of(self, probs):
+        """右闭区间 ((b-1)/B, b/B] 对应箱 b-1；概率 0 归入第一个箱"""
+        b = np.ceil(np.asarray(probs, dtype=np.float64) * self.bins).astype(np.int64) - 1
+        return np.clip(b, 0, self.bins - 1)
+
+    def update(self, y, probs):
+        y = np.asarray(y).astype(np.int64).ravel()
+        probs = np.asarray(probs, dtype=np.float64).ravel()
+        if len(y) != len(probs):
+            raise ValueError(f"标签 {len(y)} 条，概率 {len(probs)} 条")
+        # 允许浮点累加带来的微小越界
+        if np.isnan(probs).any() or probs.min(initial=0) < -1e-6 or probs.max(initial=1) > 1 + 1e-6:
+            raise ValueError("概率必须在 [0, 1] 内且不能有缺失")
+        probs = np.clip(probs, 0.0, 1.0)
+        cell = y * self.bins + self.bin_of(probs)
+        size = 2 * self.bins
+        self.count += np.bincount(cell, minlength=size).reshape(2, -1)
+        self.sum_p += np.bincount(cell, weights=probs, minlength=size).reshape(2, -1)
+        self.sum_p2 += np.bincount(cell, weights=probs * probs, minlength=size).reshape(2, -1)
+        return self
+
+    def merge(self, other):
+        if (other.bins, other.threshold) != (self.bins, self.threshold):
+            raise ValueError("箱数或阈值不同的累加器不能合并")
+        self.count += other.count
+        self.sum_p += other.sum_p
+        self.sum_p2 += other.sum_p2
+        return self
+
+    @property
+    def n(self):
+        return int(self.count.sum())
+
+    @property
+    def n_pos(self):
+        return int(self.count[1].sum())
+
+    def _cells(self):
+        """只保留非空的箱：(条数 (2, K), 概率均值, 概率平方均值, 是否在阈值以上, 校准分组)"""
+        keep = np.flatnonzero(self.count.sum(axis=0))
+        count = self.count[:, keep]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_p = np.where(count > 0, self.sum_p[:, keep] / count, 0.0)
+            mean_p2 = np.where(count > 0, self.sum_p2[:, keep] / count, 0.0)
+        return count, mean_p, mean_p2, keep >= self.threshold_bin, keep * self.calibration_bins // self.bins
+
+    def tie_mass(self):
+        """同一箱内的（正, 负）样本对占全部对的比例；直方图 AUC 与精确 AUC 之差不超过它的一半"""
+        return float((self.count[0] * self.count[1]).sum() / max(self.n_pos * (self.n - self.n_pos), 1))
+
+    def confusion(self):
+        """阈值处的混淆矩阵 [[tn, fp], [fn, tp]]"""
+        t = self.threshold_bin
+        neg, pos = self.count
+        return np.array([[neg[:t].sum(), neg[t:].sum()], [pos[:t].sum(), pos[t:].sum()]])
+
+    def metrics(self):
+        """各指标的点估计"""
+        if self.n_pos == 0 or self.n_pos == self.n:
+            raise ValueError("标签只有一类，无法计算 AUC")
+        count, *rest = self._cells()
+        values = cell_metrics(count[None], *rest, self.calibration_bins)
+        return {name: float(v[0]) for name, v in values.items()}
+
+    def bootstrap(self, n_boot=2000, alpha=0.05, random_state=42):
+        """
+        各指标的 bootstrap 百分位置信区间：{指标名: (下限, 上限)}
+
+        只在非空格子上按多项分布抽样（格子数不超过 min(行数, 2 × 箱数)）。
+        """
+        count, *rest = self._cells()
+        flat = count.ravel()
+        nonzero = np.flatnonzero(flat)
+        rng = np.random.default_rng(random_state)
+        draws = rng.multinomial(self.n, flat[nonzero] / self.n, size=n_boot)
+        counts = np.zeros((n_boot, flat.size))
+        counts[:, nonzero] = draws
+        values = cell_metrics(counts.reshape((n_boot,) + count.shape), *rest, self.calibration_bins)
+        q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+        # 某次重抽只抽到一类时该次的 AUC 等为 NaN，不计入
+        return {name: tuple(float(x) for x in np.nanpercentile(v, q)) for name, v in values.items()}
+
+    def classification_report(self, digits=4):
+        """与 sklearn classification_report 相同排版的文字报告（由混淆矩阵得到）"""
+        (tn, fp), (fn, tp) = self.confusion()
+        rows = []
+        for label, right, wrong_pred, wrong_true in ((0, tn, fn, fp), (1, tp, fp, fn)):
+            precision = right / (right + wrong_pred) if right + wrong_pred else 0.0
+            recall = right / (right + wrong_true) if right + wrong_true else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            rows.append((str(label), precision, recall, f1, int(right + wrong_true)))
+        n = tn + fp + fn + tp
+        macro = [np.mean([r[i] for r in rows]) for i in (1, 2, 3)]
+        weighted = [sum(r[i] * r[4] for r in rows) / n for i in (1, 2, 3)]
+        width = len('weighted avg')
+        head = f"{'':>{width}} " + ''.join(f" {h:>9}" for h in ('precision', 'recall', 'f1-score', 'support'))
+        line = lambda name, *vals: (f"{name:>{width}} " + ''.join(f" {v:>9.{digits}f}" for v in vals[:3])
+                                    + f" {vals[3]:>9}\n")
+        body = ''.join(line(*r) for r in rows) + '\n'
+        body += f"{'accuracy':>{width}} " + f" {'':>9}" * 2 + f" {(tn + tp) / n:>9.{digits}f} {n:>9}\n"
+        body += line('macro avg', *macro, n) + line('weighted avg', *weighted, n)
+        return head + '\n\n' + body
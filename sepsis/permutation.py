@@ -0,0 +1,145 @@
+# 文件：sepsis/permutation.py
+# 置换重要性（6_permutation 阶段，SHAP 之外的另一种解释方法，比 TreeSHAP 快得多，只给全局重要性）：
+#   每个 (特征, 重复) 把该列按固定种子打乱，看 AUC 下降多少。
+#   - 打分走编译后的模型（sepsis/compiled.py）；工作进程按路径内存映射同一个模型文件，
+#     数据放在共享内存（sepsis/shm.py）里；
+#   - 每个工作进程预先分配一块 (batch, 行数, 列数) 的缓冲区，初始化成原始数据一次，
+#     之后每个置换只改写被打乱的那一列、打完分再还原，一批置换拼成一次打分调用；
+#   - 一批里各块的 AUC 由同一次排名运算得到（按行 rankdata）；
+#   - 结果按 模型指纹 + 数据指纹 + 参数 缓存（与 SHAP 共用 sepsis/explain.py 的缓存目录）。
+import hashlib
+import json
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.stats import rankdata
+
+from sepsis.compiled import load_compiled
+from sepsis.cvstore import array_fingerprint
+from sepsis.explain import load_cached, save_cached
+from sepsis.shm import SharedArrays, attach
+
+# 每个工作进程里已加载的模型和缓冲区
+_MODELS = {}
+_BUFFERS = {}
+
+
+def auc_rows(scores, y):
+    """scores (B, n) 每行一组打分，返回每行的 AUC（并列取平均名次，与 roc_auc_score 相同）"""
+    pos = np.asarray(y).astype(bool)
+    n_pos = int(pos.sum())
+    n_neg = len(pos) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        raise ValueError("标签只有一类，无法计算 AUC")
+    ranks = rankdata(scores, axis=1)
+    return (ranks[:, pos].sum(axis=1) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def permutation(n, feature, repeat, random_state):
+    """(特征, 重复) 对应的行置换；只由种子决定，与进程数、分批方式无关"""
+    return np.random.default_rng([random_state, feature, repeat]).permutation(n)
+
+
+def score_pairs(ens, X, y, pairs, buf, random_state):
+    """
+    在缓冲区 buf (B, n, m)（每块都是 X 的副本）里逐块打乱一列，一次打完分再还原；
+    返回各 (特征, 重复) 置换后的 AUC
+    """
+    n, m = X.shape
+    out = np.empty(len(pairs))
+    for lo in range(0, len(pairs), len(buf)):
+        batch = pairs[lo:lo + len(buf)]
+        for b, (j, r) in enumerate(batch):
+            buf[b, :, j] = X[permutation(n, j, r, random_state), j]
+        flat = buf[:len(batch)].reshape(-1, m)
+        _, proba = ens.predict_both(flat)
+        out[lo:lo + len(batch)] = auc_rows(proba[:, 1].reshape(len(batch), n), y)
+        for b, (j, _) in enumerate(batch):
+            buf[b, :, j] = X[:, j]
+    return out
+
+
+def _buffer(key, batch, X):
+    """本进程复用的缓冲区：同一份数据只初始化一次"""
+    if _BUFFERS.get('key') != key:
+        _BUFFERS.clear()
+        buf = np.empty((batch,) + X.shape, dtype=np.float32)
+        buf[:] = X
+        _BUFFERS.update(key=key, buf=buf)
+    return _BUFFERS['buf']
+
+
+def _model(path):
+    if _MODELS.get('path') != path:
+        _MODELS.clear()
+        _MODELS.update(path=path, ens=load_compiled(path))
+    return _MODELS['ens']
+
+
+def _score_task(path, spec, pairs, batch, random_state):
+    """进程池任务：挂载共享数据，给一组 (特征, 重复) 打分"""
+    with attach(spec) as arr:
+        X, y = arr['X'], arr['y']
+        buf = _buffer((spec['X'][0], batch), batch, X)
+        return pairs, score_pairs(_model(path), X, y, pairs, buf, random_state)
+
+
+def permutation_importance(path, X, y, n_repeats=5, batch=8, n_jobs=None, random_state=42):
+    """
+    X (float32, 列顺序与模型一致)、y (0/1) 上的置换重要性
+
+    返回 (基线 AUC, drops)：drops[j, r] 为第 j 个特征第 r 次置换后 AUC 的下降量
+    """
+    ens = load_compiled(path)
+    n, m = X.shape
+    y = np.asarray(y).astype(np.int8)
+    _, proba = ens.predict_both(X)
+    base = float(auc_rows(proba[None, :, 1], y)[0])
+
+    pairs = [(j, r) for j in range(m) for r in range(n_repeats)]
+    n_jobs = min(effective_n_jobs(n_jobs), max(len(pairs) // batch, 1))
+    scores = np.empty((m, n_repeats))
+    if n_jobs == 1:
+        buf = np.empty((batch, n, m), dtype=np.float32)
+        buf[:] = X
+        done = score_pairs(ens, X, y, pairs, buf, random_state)
+        for (j, r), s in zip(pairs, done):
+            scores[j, r] = s
+        return base, base - scores
+
+    print(f"   {len(pairs)} 个置换，{n_jobs} 个进程并行")
+    # 每个进程分到连续的一段，缓冲区只初始化一次
+    per_task = max(batch, -(-len(pairs) // (4 * n_jobs)))
+    with SharedArrays({'X': X, 'y': y}) as shared:
+        results = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+            delayed(_score_task)(path, shared.spec, pairs[lo:lo + per_task], batch, random_state)
+            for lo in range(0, len(pairs), per_task))
+        for task_pairs, done in results:
+            for (j, r), s in zip(task_pairs, done):
+                scores[j, r] = s
+    return base, base - scores
+
+
+def explain_permutation(path, X, y, dirs, n_repeats=5, batch=8, n_jobs=None, random_state=42, cache=True):
+    """
+    抽样数据 X（DataFrame）的置换重要性，先查缓存
+
+    返回 (基线 AUC, drops, 是否命中缓存)
+    """
+    ens = load_compiled(path)
+    Xf = np.ascontiguousarray(X[ens.feature_names].to_numpy(dtype=np.float32))
+    yv = np.asarray(y).astype(np.int8)
+    h = hashlib.sha256()
+    h.update(ens.fingerprint().encode('utf-8'))
+    h.update(array_fingerprint(Xf, yv).encode('utf-8'))
+    h.update(json.dumps(['permutation', 'roc_auc', n_repeats, random_state]).encode('utf-8'))
+    key = h.hexdigest()
+    if cache:
+        hit = load_cached(dirs, key)
+        if hit is not None:
+            return float(hit['expected']), hit['values'], True
+    base, drops = permutation_importance(path, Xf, yv, n_repeats=n_repeats, batch=batch,
+                                         n_jobs=n_jobs, random_state=random_state)
+    if cache:
+        save_cached(dirs, key, drops, base)
+    return base, drops, False
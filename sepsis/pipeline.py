@@ -0,0 +1,306 @@
+# 文件：sepsis/pipeline.py
+# 进程内的管道引擎：把 1_load … 8_drift 的 run() 作为 DAG 的各个阶段，
+# 在同一个常驻工作进程里执行（互不依赖的阶段并发），阶段之间直接在内存中传递 DataFrame / 模型。
+import argparse
+import atexit
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from sepsis import budget, cache, console, plots
+from sepsis.artifacts import get_dirs, load_artifact, save_artifact
+
+# optional 的阶段不在默认的全量运行里，只在 targets 点名时运行
+Stage = namedtuple('Stage', ['name', 'module', 'optional'], defaults=(False,))
+StageResult = namedtuple('StageResult', ['name', 'module', 'ok', 'elapsed', 'output', 'cached'],
+                         defaults=(False,))
+
+# 声明式 DAG：依赖关系由各模块的 INPUTS / OUTPUTS 推导
+STAGES = (
+    Stage('load',     'sepsis.1_load'),
+    Stage('impute',   'sepsis.2_impute'),
+    Stage('feature',  'sepsis.3_feature'),
+    Stage('train',    'sepsis.4_train'),
+    Stage('evaluate', 'sepsis.5_evaluate'),
+    Stage('explain',  'sepsis.6_explain'),
+    Stage('permutation', 'sepsis.6_permutation', optional=True),
+    Stage('predict',  'sepsis.7_predict'),
+    Stage('drift',    'sepsis.8_drift'),
+)
+
+
+def load_stage(stage):
+    return importlib.import_module(stage.module)
+
+
+def build_graph(stages=STAGES):
+    """返回 {阶段名: 依赖的阶段名集合}"""
+    producer = {}
+    for stage in stages:
+        for name in load_stage(stage).OUTPUTS:
+            producer[name] = stage.name
+    graph = {}
+    for stage in stages:
+        graph[stage.name] = {producer[name] for name in load_stage(stage).INPUTS if name in producer}
+    return graph
+
+
+def plan(targets=None, stages=STAGES):
+    """按拓扑顺序返回需要运行的阶段；targets 为空时运行全部非 optional 的阶段"""
+    graph = build_graph(stages)
+    by_name = {s.name: s for s in stages}
+    wanted = set(targets or (s.name for s in stages if not s.optional))
+    unknown = wanted - set(by_name)
+    if unknown:
+        raise ValueError(f"未知的管道阶段: {sorted(unknown)}")
+
+    order, done = [], set()
+    def visit(name, path=()):
+        if name in done:
+            return
+        if name in path:
+            raise ValueError(f"管道存在循环依赖: {' -> '.join(path + (name,))}")
+        for dep in sorted(graph[name]):
+            if dep in wanted:
+                visit(dep, path + (name,))
+        done.add(name)
+        order.append(by_name[name])
+    # 保持声明顺序，保证输出稳定
+    for stage in stages:
+        if stage.name in wanted:
+            visit(stage.name)
+    return order
+
+
+def _run_stage(stage, label, dirs, shared, producers, force, progress_callback):
+    """运行一个阶段（可能在线程里与其他阶段并发），输出捕获到该阶段自己的缓冲区"""
+    module = load_stage(stage)
+    ctx, fps, lock = shared
+    start_time = time.time()
+    ok, cached = True, False
+    with console.capture() as buf:
+        try:
+            for name in module.INPUTS:
+                with lock:
+                    known = name in fps
+                if not known:
+                    digest = cache.input_fingerprint(name, dirs, producers.get(name))
+                    with lock:
+                        fps.setdefault(name, digest)
+            previous = cache.read_record(module, dirs)
+            with lock:
+                input_fps = dict(fps)
+            fp, sources = cache.fingerprint(module, input_fps, dirs, previous)
+
+            if not force and cache.is_fresh(module, fp, dirs):
+                cached = True
+                with lock:
+                    fps.update({name: info['digest'] for name, info in previous['artifacts'].items()})
+                print(f"♻️ 输入、参数与代码均未变化，沿用 {previous['created']} 的结果")
+                print(previous.get('log', ''), end='')
+            else:
+                inputs = {}
+                for name in module.INPUTS:
+                    with lock:
+                        loaded = name in ctx
+                    if not loaded:
+                        obj = load_artifact(name, dirs)
+                        with lock:
+                            ctx.setdefault(name, obj)
+                    with lock:
+                        inputs[name] = ctx[name]
+                # 按 CPU 预算运行：n_jobs、BLAS 线程数都限制在分到的核数内
+                with budget.allocate(stage.name, dirs.root) as cores:
+                    if progress_callback:
+                        progress_callback(f"{label} 运行: {stage.module} ({stage.name}, {cores} 核)...")
+                    outputs = module.run(dirs, **inputs)
+                for name, obj in outputs.items():
+                    path = save_artifact(name, obj, dirs)
+                    with lock:
+                        ctx[name] = obj
+                    print(f'💾 {name} → {path}')
+                record = cache.write_record(module, fp, sources, dirs, log=buf.getvalue())
+                with lock:
+                    fps.update({name: info['digest'] for name, info in record['artifacts'].items()})
+        except Exception:
+            ok = False
+            traceback.print_exc()
+    elapsed = time.time() - start_time
+    return StageResult(stage.name, stage.module, ok, elapsed, buf.getvalue(), cached)
+
+
+def run_pipeline(targets=None, dirs=None, progress_callback=None, stages=STAGES, force=False, max_parallel=None):
+    """
+    在当前进程中按 DAG 运行各阶段
+
+    上游阶段的产物保存在内存 ctx 中直接交给下游；不在本次计划内的输入从磁盘读取。
+    每个阶段的输出仍会写回磁盘，方便单独运行某一步以及前端读取。
+    输入、参数和代码指纹与上次一致的阶段直接跳过（force=True 时全部重跑），
+    其输出在下游需要时才从磁盘读取。
+    依赖都已完成的阶段立即开始：互不依赖的阶段（训练之后的 evaluate / explain / predict）
+    在线程里并发运行，各自的输出分别捕获（sepsis/console.py），结果按计划顺序返回。
+    max_parallel 为同时运行的阶段数上限（1 即逐个运行），默认不限，由 CPU 预算分核。
+    阶段里的图在后台线程绘制（sepsis/plots.py），返回时可能还没画完；
+    开始运行前先等上一次的图画完，缓存校验才能看到完整的产物。
+    返回 StageResult 列表，有阶段失败时不再启动新的阶段。
+    """
+    dirs = dirs or get_dirs()
+    order = plan(targets, stages)
+    graph = build_graph(stages)
+    planned = {s.name for s in order}
+    deps = {s.name: graph[s.name] & planned for s in order}
+    labels = {s.name: f"[{i}/{len(order)}]" for i, s in enumerate(order, 1)}
+    producers = {name: load_stage(s) for s in stages for name in load_stage(s).OUTPUTS}
+    shared = ({}, {}, threading.Lock())
+    console.install()
+    plots.wait()
+
+    results, running, pending = {}, {}, list(order)
+    with ThreadPoolExecutor(max_workers=max_parallel or max(len(order), 1),
+                            thread_name_prefix='sepsis-stage') as pool:
+        while pending or running:
+            failed = any(not r.ok for r in results.values())
+            ready = [] if failed else [s for s in pending if deps[s.name] <= set(results)]
+            for stage in ready:
+                pending.remove(stage)
+                running[pool.submit(_run_stage, stage, labels[stage.name], dirs, shared, producers,
+                                    force, progress_callback)] = stage
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                r = future.result()
+                results[stage.name] = r
+                if progress_callback:
+                    status = ("成功" if r.ok else "失败") + ("（缓存）" if r.cached else "")
+                    progress_callback(f"{labels[stage.name]} {stage.name} {status} (耗时: {r.elapsed:.2f}秒)")
+    return [results[s.name] for s in order if s.name in results]
+
+
+# =====================================================================
+# 常驻工作进程
+# =====================================================================
+def _worker_loop(root, requests, events):
+    os.chdir(root)
+    # 非交互式绘图后端，工作进程没有显示设备
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    # 预先导入所有阶段，冷启动开销（pandas/sklearn/shap/matplotlib）只付一次
+    for stage in STAGES:
+        load_stage(stage)
+    events.put(('ready', None))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        _, targets, force = request
+        try:
+            results = run_pipeline(targets, get_dirs(root), force=force,
+                                   progress_callback=lambda msg: events.put(('progress', msg)))
+        except Exception:
+            results = [StageResult('pipeline', 'sepsis.pipeline', False, 0.0, traceback.format_exc())]
+        events.put(('done', results))
+
+
+class PipelineWorker:
+    """
+    常驻的管道工作进程
+
+    与应用进程隔离（某一步崩溃或占满内存不会拖垮前端），
+    但在多次运行之间保持存活，各阶段模块只导入一次。
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self._ctx = mp.get_context('spawn')
+        self._process = None
+        self._requests = None
+        self._events = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        self._requests = self._ctx.Queue()
+        self._events = self._ctx.Queue()
+        # 不设为 daemon：daemon 进程不能再创建子进程，特征工程、交叉验证的进程池会退化成串行；
+        # 改为在应用退出时由 atexit 显式停止
+        self._process = self._ctx.Process(target=_worker_loop,
+                                          args=(self.root, self._requests, self._events))
+        self._process.start()
+
+    def run(self, targets=None, progress_callback=None, force=False):
+        """提交一次管道运行并阻塞等待结果；同一时间只处理一个请求"""
+        with self._lock:
+            self.start()
+            self._requests.put(('run', list(targets) if targets else None, force))
+            while True:
+                try:
+                    kind, payload = self._events.get(timeout=1.0)
+                except queue.Empty:
+                    # 工作进程意外退出：下次调用时会重新拉起
+                    if not self._process.is_alive():
+                        self._process = None
+                        return [StageResult('pipeline', 'sepsis.pipeline', False, 0.0,
+                                            "管道工作进程意外退出")]
+                    continue
+                if kind == 'progress' and progress_callback:
+                    progress_callback(payload)
+                elif kind == 'done':
+                    return payload
+
+    def stop(self):
+        if self._process is not None and self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                # 还在运行某个阶段：直接结束，避免应用退出时卡住
+                self._process.terminate()
+                self._process.join()
+        self._process = None
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker(root):
+    """返回进程级单例工作进程"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = PipelineWorker(root)
+            _worker.start()
+            atexit.register(_worker.stop)
+        return _worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在单个进程中运行脓毒症分析管道")
+    parser.add_argument('stages', nargs='*', help="要运行的阶段（默认全部，不含 permutation 等可选阶段），如 train predict")
+    parser.add_argument('--force', action='store_true', help="忽略缓存指纹，全部重新运行")
+    parser.add_argument('--serial', action='store_true', help="逐个运行各阶段（不并发）")
+    args = parser.parse_args()
+    # 阶段可能在线程里绘图：用非交互式后端
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    results = run_pipeline(args.stages or None, force=args.force, max_parallel=1 if args.serial else None,
+                           progress_callback=lambda msg: print(msg, file=sys.__stderr__))
+    for r in results:
+        print(f"$ {r.module}\n{r.output}")
+    if plots.pending():
+        print(f"🖼️ 等待 {len(plots.pending())} 张图绘制完成...", file=sys.__stderr__)
+        plots.wait()
+    sys.exit(0 if all(r.ok for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# 文件：sepsis/plots.py
+# 绘图子系统：阶段只提交“图规格”（图类型 + 数据 + 输出路径），由后台线程用非交互式的 Agg 画布渲染，
+# 阶段不必等图画完就能返回数值结果（日志更早进入总结）。
+#   - 条形图、直方图用面向对象的 Figure API 绘制，每张图自己一个画布，不碰 pyplot 的全局状态；
+#   - 只能走 pyplot 的图（shap 的蜂群图）持有 PLOT_LOCK 串行绘制；
+#   - 环境变量 SEPSIS_PLOT_MODE=inline 时在调用处同步绘制（单独调试某一步时方便看报错）。
+# 下次管道运行开始前、以及命令行进程退出前会等待所有未完成的图（wait()）。
+import atexit
+import contextlib
+import os
+import queue
+import sys
+import threading
+import traceback
+
+import numpy as np
+
+from sepsis import console
+
+# pyplot 全局锁：plt.figure() … plt.close() 必须在同一把锁里完成
+PLOT_LOCK = threading.RLock()
+
+
+@contextlib.contextmanager
+def plotting(quiet=True):
+    """持有 pyplot 锁画图；quiet=True 时丢弃绘图库在当前线程打印的提示"""
+    with PLOT_LOCK:
+        if quiet:
+            with console.silence():
+                yield
+        else:
+            yield
+
+
+# ---------------------------------------------------------------------
+# 各类图的渲染函数：render(path, **spec)
+# ---------------------------------------------------------------------
+
+def _figure(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def render_bar(path, values, labels, title='', xlabel='', ylabel='', yerr=None, rot=90, figsize=(6.4, 4.8)):
+    fig, ax = _figure(figsize)
+    x = np.arange(len(values))
+    ax.bar(x, values, yerr=yerr, width=0.5)
+    ax.set_xticks(x)
+    ax.set_xticklabels([str(l) for l in labels], rotation=rot)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def render_hist(path, values, bins=20, title='', xlabel='', ylabel='', threshold=None, threshold_label='',
+                figsize=(10, 6)):
+    fig, ax = _figure(figsize)
+    ax.hist(values, bins=bins, alpha=0.7, color='skyblue', edgecolor='black')
+    if threshold is not None:
+        ax.axvline(x=threshold, color='r', linestyle='--', label=threshold_label)
+        ax.legend()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True, alpha=0.3)
+    fig.savefig(path)
+
+
+def render_shap_summary(path, shap_values, features, feature_names):
+    import matplotlib.pyplot as plt
+    import shap
+    with plotting():
+        shap.summary_plot(shap_values, features, feature_names=feature_names, show=False)
+        plt.savefig(path, bbox_inches='tight')
+        plt.close()
+
+
+RENDERERS = {
+    'bar':          render_bar,
+    'hist':         render_hist,
+    'shap_summary': render_shap_summary,
+}
+
+
+def get_renderer(kind):
+    if kind not in RENDERERS:
+        raise ValueError(f"未知的图类型: {kind}（可选: {', '.join(RENDERERS)}）")
+    return RENDERERS[kind]
+
+
+# ---------------------------------------------------------------------
+# 后台渲染线程
+# ---------------------------------------------------------------------
+
+class PlotWorker:
+    """单个后台线程按提交顺序渲染；pending 记录还没画完的输出路径"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.pending = set()
+        self.errors = []
+
+    def submit(self, kind, path, **spec):
+        get_renderer(kind)
+        with self._lock:
+            self.pending.add(path)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='sepsis-plots', daemon=True)
+                self._thread.start()
+        self._queue.put((kind, path, spec))
+
+    def _loop(self):
+        while True:
+            kind, path, spec = self._queue.get()
+            try:
+                with console.silence():
+                    get_renderer(kind)(path, **spec)
+            except Exception:
+                self.errors.append((path, traceback.format_exc()))
+                print(f"⚠️ 绘图失败: {path}\n{traceback.format_exc()}", file=sys.__stderr__)
+            finally:
+                with self._lock:
+                    self.pending.discard(path)
+                    self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """等待已提交的图全部画完；返回是否在超时前完成"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self.pending, timeout)
+
+
+_worker = PlotWorker()
+atexit.register(_worker.wait)
+
+
+def submit(kind, path, **spec):
+    """提交一张图；返回输出路径（后台模式下文件稍后才出现）"""
+    if os.environ.get('SEPSIS_PLOT_MODE') == 'inline':
+        get_renderer(kind)(path, **spec)
+    else:
+        _worker.submit(kind, path, **spec)
+    return path
+
+
+def wait(timeout=None):
+    return _worker.wait(timeout)
+
+
+def pending():
+    with _worker._lock:
+        return sorted(_worker.pending)
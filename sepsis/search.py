@@ -0,0 +1,191 @@
+# 文件：sepsis/search.py
+# 超参数搜索引擎：逐级减半（successive halving）+ warm start 逐步加树。
+# 每个候选在每一折上只维护一个模型，从小到大逐级加树（或加迭代）而不是重新训练；
+# 每一级结束后按交叉验证平均分淘汰较差的一半，（候选 × 折）一起排进同一个线程池。
+# 传入 CVStore 时，已有记录的（配置, 折）直接复用，新结果逐条写回（可中断续跑）。
+# 数据按折重排一次放进一整块（FoldBlock），各折的训练 / 验证集都是这块上的视图，
+# 内存不随折数、候选数、级数增长。
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+from sepsis.cvstore import array_fingerprint, estimator_key, folds_fingerprint
+
+# 一次（候选, 折, 树数）评估的结果
+Trial = namedtuple('Trial', ['candidate', 'fold', 'resource', 'score', 'fit_time'])
+
+
+def make_rungs(values, min_resource=None, factor=2):
+    """
+    各级的资源量（树的数量）：从 min_resource 起按 factor 倍增，并包含网格里给出的所有取值
+
+    例如 values=[100, 200], min_resource=25, factor=2 -> [25, 50, 100, 200]
+    """
+    values = sorted(set(values))
+    rungs = set(values)
+    if min_resource and factor > 1:
+        r = min_resource
+        while r < values[-1]:
+            rungs.add(int(r))
+            r *= factor
+    return sorted(rungs)
+
+
+def stratified_folds(y, cv):
+    """与 cross_val_score(cv=整数) 对分类器使用的划分相同（StratifiedKFold，不打乱）"""
+    return list(StratifiedKFold(n_splits=cv).split(np.zeros(len(y)), y))
+
+
+class FoldBlock:
+    """
+    交叉验证用的数据块：按折重排一次，首尾相接存两份
+
+    第 f 折的验证集是第一份里连续的一段；训练集是从这段末尾起、长 n - 验证集大小 的一段
+    （跨到第二份，正好是其余各折），两者都是视图。各折、各候选、各级的训练都读同一块内存，
+    占用约 2 倍数据量，而不是原来每折各切一份训练 / 验证数据的 折数 倍。
+    训练集里的行按折排列（与 X[train_idx] 的行序不同），同一 random_state 下的模型因此
+    与逐折切片时不完全相同；fingerprint 按重排后的数据计算，结果库不会混用两种布局的结果。
+    """
+
+    def __init__(self, X, y, folds):
+        X = np.asarray(X)
+        y = np.asarray(y)
+        order = np.concatenate([np.asarray(te, dtype=np.intp) for _, te in folds])
+        n = len(order)
+        if n != len(X) or not np.array_equal(np.sort(order), np.arange(n)):
+            raise ValueError("各折的验证集必须恰好划分全部样本（KFold / StratifiedKFold 的划分）")
+        self.folds = folds
+        self.bounds = np.cumsum([0] + [len(te) for _, te in folds])
+        self.n = n
+        self.X = np.empty((2 * n,) + X.shape[1:], dtype=X.dtype)
+        np.take(X, order, axis=0, out=self.X[:n])
+        self.X[n:] = self.X[:n]
+        self.y = np.concatenate([y[order], y[order]])
+        # 各折共用，不允许就地修改
+        self.X.flags.writeable = False
+        self.y.flags.writeable = False
+        self.fingerprint = array_fingerprint(self.X[:n], self.y[:n])
+
+    def __len__(self):
+        return len(self.folds)
+
+    def train(self, f):
+        lo = self.bounds[f + 1]
+        hi = lo + self.n - (self.bounds[f + 1] - self.bounds[f])
+        return self.X[lo:hi], self.y[lo:hi]
+
+    def test(self, f):
+        lo, hi = self.bounds[f], self.bounds[f + 1]
+        return self.X[lo:hi], self.y[lo:hi]
+
+
+def _fitted_size(model):
+    """已训练的树数（森林）或迭代数（梯度提升），未训练时为 0"""
+    if hasattr(model, 'estimators_'):
+        return len(model.estimators_)
+    return getattr(model, 'n_iter_', 0)
+
+
+def _grow(model, data, fold, resource, n, scorer):
+    """
+    把 model 的资源参数加到 n（warm start，只训练新增的树 / 迭代）并在 data 的第 fold 折上打分
+
+    上一级的结果取自结果库时，这里的模型可能还是空的或更小，warm start 会从已有的规模补齐，
+    同一 random_state 下得到的模型相同。返回 (分数, 训练耗时, 训练前的规模)
+    """
+    (X_fit, y_fit), (X_eval, y_eval) = data.train(fold), data.test(fold)
+    grown_from = _fitted_size(model)
+    start = time.perf_counter()
+    model.set_params(warm_start=True, **{resource: n})
+    model.fit(X_fit, y_fit)
+    fit_time = time.perf_counter() - start
+    return scorer(y_eval, model.predict(X_eval)), fit_time, grown_from
+
+
+def halving_search(estimator, param_grid, data, resource='n_estimators',
+                   min_resource=None, factor=2, scorer=f1_score, n_jobs=None, store=None, log=print):
+    """
+    estimator:  未训练的模型，需支持 warm_start 和 resource 参数
+                （如 RandomForestClassifier 的 n_estimators、HistGradientBoostingClassifier 的 max_iter）
+    param_grid: 与 ParameterGrid 相同；resource 的取值决定最终可选的树数 / 迭代数
+    data:       FoldBlock（数据和交叉验证的划分）
+    factor:     每一级保留 1/factor 的候选；factor=1 时不淘汰，等价于完整网格搜索（但仍复用树）
+    store:      sepsis.cvstore.CVStore，可选
+
+    返回 (最佳参数, 最佳平均分, [Trial, ...])。
+    最佳参数只在网格给出的资源取值上选，保证结果是原网格里的一个点；
+    同分时取网格顺序靠前的，与原来的手写循环一致。
+    """
+    grid = {k: v for k, v in param_grid.items() if k != resource}
+    if resource not in param_grid:
+        raise ValueError(f"param_grid 中需要包含资源参数 {resource}")
+    candidates = list(ParameterGrid(grid)) if grid else [{}]
+    choices = set(param_grid[resource])
+    rungs = make_rungs(param_grid[resource], min_resource, factor)
+
+    folds = data.folds
+    # 有 n_jobs 参数的模型单线程训练，并行交给外层线程池
+    single = {'n_jobs': 1} if 'n_jobs' in estimator.get_params() else {}
+    models = {(c, f): clone(estimator).set_params(**single, **candidates[c])
+              for c in range(len(candidates)) for f in range(len(folds))}
+    if store is not None:
+        keys = (data.fingerprint, folds_fingerprint(folds), estimator_key(estimator, param_grid))
+
+    alive = list(range(len(candidates)))
+    history, means = [], {}
+    # 树的训练会释放 GIL，用线程池即可并行，而且模型留在原地、下一级直接加树
+    with Parallel(n_jobs=n_jobs, prefer='threads', return_as='generator') as pool:
+        for level, n in enumerate(rungs):
+            tasks = []
+            for c in alive:
+                point = dict(candidates[c], **{resource: n})
+                done = store.get(*keys, point) if store is not None else {}
+                for f in range(len(folds)):
+                    if f in done:
+                        history.append(Trial(c, f, n, *done[f]))
+                    else:
+                        tasks.append((c, f))
+            if len(tasks) < len(alive) * len(folds):
+                log(f"  ♻️ [{resource}={n}] 结果库中已有 {len(alive) * len(folds) - len(tasks)} 个（配置, 折）的结果")
+            results = pool(delayed(_grow)(models[c, f], data, f, resource, n, scorer) for c, f in tasks)
+            for (c, f), (score, fit_time, grown_from) in zip(tasks, results):
+                history.append(Trial(c, f, n, float(score), fit_time))
+                if store is not None:
+                    store.put(*keys, dict(candidates[c], **{resource: n}), f, score, fit_time, grown_from)
+            # 生成器用完要释放，同一个 Parallel 才能提交下一级
+            del results
+            for c in alive:
+                means[c, n] = float(np.mean([t.score for t in history if t.candidate == c and t.resource == n]))
+                log(f"  [{resource}={n}] 参数 {dict(candidates[c], **{resource: n})} 的平均 F1 = {means[c, n]:.4f}")
+
+            if level + 1 < len(rungs) and factor > 1:
+                keep = max(1, math.ceil(len(alive) / factor))
+                # 稳定排序：同分时保留网格顺序靠前的候选
+                ranked = sorted(alive, key=lambda c: -means[c, n])
+                dropped = sorted(ranked[keep:])
+                alive = sorted(ranked[:keep])
+                for c in dropped:
+                    # 淘汰的候选不再需要它的模型
+                    for f in range(len(folds)):
+                        models.pop((c, f), None)
+                if dropped:
+                    log(f"  ✂️ 淘汰 {len(dropped)} 个候选，剩余 {len(alive)} 个")
+
+    # 在网格给出的资源取值上选最佳；按（候选序号, 资源）的网格顺序遍历，严格大于才替换
+    best, best_score = None, -np.inf
+    for (c, n) in sorted(means):
+        if n in choices and means[c, n] > best_score:
+            best, best_score = (c, n), means[c, n]
+    c, n = best
+    return dict(candidates[c], **{resource: n}), best_score, history
+
+
+def search_cost(history):
+    """累计训练耗时（秒，各任务相加，含取自结果库的记录）与评估次数，用于和完整网格搜索对比"""
+    return sum(t.fit_time for t in history), len(history)
@@ -0,0 +1,489 @@
+# 文件：sepsis/serve.py
+# 常驻打分服务：启动时加载一次编译后的模型（内存映射）、填补中位数和特征聚合方式，
+# 之后通过本地 HTTP 接受单个或成批住院的打分请求，不再重跑管道。
+#   - 并发请求先进队列，由一个打分线程凑成微批（最多 max_batch 个住院，或第一条请求到达后等 max_wait_ms）
+#     一次遍历树模型，再把结果拆回各请求；
+#   - 记录请求延迟 / 批大小直方图、吞吐计数，GET /metrics 查看；
+#   - 模型文件被替换（重新训练、增量更新、回滚）后自动换用新模型：模型、中位数、流式状态、漂移统计整体
+#     作为一份快照替换，每个请求都用构造它特征的那一份快照打分；
+#   - 流式接口：逐时记录到达后按住院 O(1) 更新运行中的聚合量（sepsis/stream.py），立即给涉及的住院重新打分，
+#     状态表定期快照到 models/stream_state.npz，重启后接着用；
+#   - 每个微批顺带按训练集的特征草图分箱计数（sepsis/drift.py），GET /drift 随时查看累计的特征漂移。
+# 接口：
+#   GET  /health    模型信息
+#   GET  /metrics   计数器、延迟分位数、直方图
+#   GET  /drift     服务启动（或换模型）以来打分数据相对训练集的 PSI / KS，按 PSI 从高到低
+#   POST /score     {"features": [{"icustayid": 1, "v0_last": ..., ...}, ...]}  已聚合的特征向量
+#                   {"records":  [{"icustayid": 1, "charttime": ..., "v0": ..., ...}, ...]}  原始逐时记录，
+#                   按与管道相同的方式填补、聚合
+#                   返回 {"results": [{"icustayid", "probability", "prediction"}, ...], "latency_ms"}
+#   POST /stream    {"records": [{"icustayid": 1, "charttime": ..., "v0": ..., ...}, ...]}  新到的逐时记录，
+#                   返回涉及住院的最新风险，结果另带 "alert"（概率 ≥ alert_threshold）
+# 用法：python -m sepsis.serve [--host 127.0.0.1] [--port 8765] [--max-batch 256] [--max-wait-ms 2]
+import argparse
+import importlib
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from joblib import parallel_config
+
+from sepsis import budget
+from sepsis.artifacts import artifact_path, get_dirs, load_artifact
+from sepsis.drift import DriftMonitor, Sketch
+from sepsis.engines import engine_for
+from sepsis.imputation import feature_columns, impute_frame, medians_for
+from sepsis.stream import ALERT_THRESHOLD, SNAPSHOT_FILE, StreamFeaturizer
+
+PARAMS = {
+    'host':        '127.0.0.1',
+    'port':        8765,
+    # 一个微批最多的住院数
+    'max_batch':   256,
+    # 队列里第一条请求到达后，最多再等多久凑批（毫秒）；0 表示来多少打多少
+    'max_wait_ms': 2.0,
+    # 最多检查一次模型文件是否被替换的间隔（秒）
+    'reload_every': 1.0,
+    # 流式接口：风险提醒阈值、状态表快照间隔（秒）
+    'alert_threshold': ALERT_THRESHOLD,
+    'snapshot_every':  30.0,
+}
+
+# 延迟直方图的桶上界（毫秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, float('inf'))
+# 请求排队期间模型被替换时，最多按新模型重新构造、提交几次
+MAX_RESUBMIT = 2
+
+
+class Histogram:
+    """固定桶的计数直方图，外加最近若干个样本用于算分位数"""
+
+    def __init__(self, bounds, recent=10_000):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.total = 0.0
+        self.n = 0
+        self.recent = deque(maxlen=recent)
+
+    def observe(self, value):
+        self.counts[next(i for i, b in enumerate(self.bounds) if value <= b)] += 1
+        self.total += value
+        self.n += 1
+        self.recent.append(value)
+
+    def snapshot(self):
+        out = {
+            'count':   self.n,
+            'mean':    self.total / self.n if self.n else None,
+            'buckets': {('+inf' if b == float('inf') else str(b)): c for b, c in zip(self.bounds, self.counts)},
+        }
+        if self.recent:
+            p50, p90, p99 = np.percentile(np.fromiter(self.recent, dtype=np.float64), [50, 90, 99])
+            out.update(p50=p50, p90=p90, p99=p99)
+        return out
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {'requests': 0, 'stays': 0, 'batches': 0, 'errors': 0, 'reloads': 0, 'stale': 0}
+        self.latency_ms = Histogram(LATENCY_BUCKETS)
+        self.batch_size = Histogram(BATCH_BUCKETS)
+        self.score_ms = Histogram(LATENCY_BUCKETS)
+        # 最近 60 秒每个批次的 (时间, 住院数)，算当前吞吐
+        self.window = deque()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def batch(self, n_stays, score_ms):
+        now = time.time()
+        with self.lock:
+            self.counters['batches'] += 1
+            self.counters['stays'] += n_stays
+            self.batch_size.observe(n_stays)
+            self.score_ms.observe(score_ms)
+            self.window.append((now, n_stays))
+            while self.window and self.window[0][0] < now - 60:
+                self.window.popleft()
+
+    def request(self, latency_ms):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.latency_ms.observe(latency_ms)
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            recent = sum(n for _, n in self.window)
+            return {
+                'uptime_s':        round(uptime, 1),
+                'counters':        dict(self.counters),
+                'stays_per_s':     self.counters['stays'] / uptime if uptime else 0.0,
+                'stays_per_s_60s': recent / min(60.0, uptime) if uptime else 0.0,
+                'request_latency_ms': self.latency_ms.snapshot(),
+                'score_ms':        self.score_ms.snapshot(),
+                'batch_size':      self.batch_size.snapshot(),
+            }
+
+
+# 一次加载得到的模型及配套元数据。换模型时整体构建一份新的再一次赋值替换，
+# 请求线程拿到的始终是一份前后一致的组合；每个请求带着构造特征时用的那一份进批处理队列
+ModelSnapshot = namedtuple('ModelSnapshot', ['model', 'medians', 'raw_columns', 'stream', 'drift', 'mtime'])
+
+
+class StaleSnapshot(Exception):
+    """请求的特征按旧模型构造，打分前模型已经换了；请求方按新模型重新构造后再提交"""
+
+
+class Scorer:
+    """当前的模型快照 + 把请求里的特征或原始记录变成模型输入矩阵的方法"""
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.path = artifact_path('model_compiled', dirs)
+        self.feature = importlib.import_module('sepsis.3_feature')
+        self.current = None
+        self.current = self.load()
+
+    def load(self):
+        """加载一份新的快照（不替换 current）"""
+        mtime = os.stat(self.path).st_mtime_ns
+        model = load_artifact('model_compiled', self.dirs)
+        medians = load_artifact('impute_medians', self.dirs)
+        # 特征名是 <原始列>_<聚合方式>，按出现顺序还原原始列
+        raw_columns = list(dict.fromkeys(name.rsplit('_', 1)[0] for name in model.feature_names))
+        # 预热（有 numba 时编译或从磁盘缓存载入内核），第一条请求不必等
+        model.warm()
+        return ModelSnapshot(model, medians, raw_columns, self._load_stream(model, medians),
+                             self._load_drift(model), mtime)
+
+    def _load_drift(self, model):
+        """训练集草图由特征工程步骤生成；没有草图（旧的产物）时不做漂移统计"""
+        if not os.path.exists(artifact_path('feature_sketch', self.dirs)):
+            return None
+        try:
+            sketch = Sketch.from_dict(load_artifact('feature_sketch', self.dirs))
+            return DriftMonitor(sketch, model.feature_names)
+        except ValueError as e:
+            print(f"⚠️ 特征草图与模型不匹配，不做漂移统计: {e}")
+            return None
+
+    def _load_stream(self, model, medians):
+        names = model.feature_names
+        old = self.current.stream if self.current is not None else None
+        if old is not None and old.feature_names == names:
+            # 同样的特征布局：共用运行中的状态表，只换成新的中位数
+            return old.with_medians(medians)
+        snapshot = os.path.join(self.dirs.models, SNAPSHOT_FILE)
+        try:
+            stream = StreamFeaturizer(names, medians, snapshot=snapshot)
+        except ValueError as e:
+            # 模型换了特征布局，旧快照不能再用：从空状态开始，下次快照覆盖它
+            print(f"⚠️ 流式状态快照不可用，从空状态开始: {e}")
+            os.remove(snapshot)
+            stream = StreamFeaturizer(names, medians, snapshot=snapshot)
+        if len(stream.state):
+            print(f"   流式状态已从快照恢复：{len(stream.state)} 个住院，{stream.state.rows_seen} 行")
+        return stream
+
+    def maybe_reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self.current.mtime:
+            return False
+        # 新快照完整构建好之后一次赋值替换
+        self.current = self.load()
+        return True
+
+    def featurize(self, kind, payload, snap, previous=None):
+        """
+        按快照 snap 把请求变成 (住院 id, 特征矩阵)；kind 为 'features' / 'records' / 'stream'
+
+        previous=(旧快照, 住院 id)：流式请求已按旧快照更新过状态，现在按 snap 重新构造。
+        新旧快照共用状态表时只重新取特征，否则把记录补进新的状态表。
+        """
+        if kind == 'features':
+            return self.from_features(payload, snap)
+        if kind == 'records':
+            return self.from_records(payload, snap)
+        if previous is not None and previous[0].stream.state is snap.stream.state:
+            ids = previous[1]
+            return ids, snap.stream.state.matrix(ids, snap.model.feature_names)
+        return self.from_stream(payload, snap)
+
+    def from_features(self, items, snap):
+        # 直接按特征名取值填进数组，单条请求不必构造 DataFrame
+        names = snap.model.feature_names
+        X = np.empty((len(items), len(names)), dtype=np.float32)
+        for i, item in enumerate(items):
+            missing = [c for c in names if c not in item]
+            if missing:
+                raise ValueError(f"缺少模型需要的特征: {missing[:5]}{' …' if len(missing) > 5 else ''}")
+            X[i] = [np.nan if item[c] is None else item[c] for c in names]
+        return [item.get('icustayid') for item in items], X
+
+    def from_records(self, records, snap):
+        """原始逐时记录 -> 与管道相同的填补（已保存的中位数）和按住院聚合"""
+        names = snap.model.feature_names
+        df = pd.DataFrame(records)
+        if 'icustayid' not in df:
+            raise ValueError("原始记录需要 icustayid 列")
+        if 'charttime' in df:
+            # last 按行序取最后一条，先按时间排好
+            df = df.sort_values(['icustayid', 'charttime'], kind='stable')
+        feat = feature_columns(snap.raw_columns)
+        absent = [c for c in snap.raw_columns if c not in df and c not in feat]
+        if absent:
+            raise ValueError(f"原始记录缺少列: {absent}")
+        # 没给的生命体征 / 化验列按缺失处理，由中位数填补
+        df = df.reindex(columns=['icustayid'] + snap.raw_columns).astype({c: np.float32 for c in snap.raw_columns})
+        df = impute_frame(df, feat, medians_for(snap.medians, feat))
+        X = self.feature.extract_agg(df)
+        return X.index.tolist(), X[names].to_numpy(dtype=np.float32)
+
+    def from_stream(self, records, snap):
+        """新到的逐时记录更新流式状态，返回涉及住院的最新特征"""
+        ids, X = snap.stream.update(records)
+        return ids.tolist(), X
+
+
+class MicroBatcher:
+    """
+    请求进队列，单个打分线程凑批：拿到第一条后在 max_wait_ms 内继续收，直到凑满 max_batch 个住院；
+    一次 predict_both 后按各请求的行数拆开，通过 Future 返回
+    """
+
+    def __init__(self, scorer, metrics, max_batch, max_wait_ms, cores=1):
+        self.scorer = scorer
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.cores = cores
+        self.queue = queue.Queue()
+        self.last_check = time.monotonic()
+        self.thread = threading.Thread(target=self._loop, name='sepsis-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, X, snap):
+        """snap 为构造 X 时用的模型快照；打分时模型已换则 Future 抛出 StaleSnapshot"""
+        fut = Future()
+        self.queue.put((X, snap, fut))
+        return fut
+
+    def _collect(self):
+        items = [self.queue.get()]
+        rows = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    def _loop(self):
+        # 打分线程自己的 joblib 配置：编译模型的并行遍历按服务分到的核数开线程
+        with parallel_config(n_jobs=self.cores):
+            while True:
+                items = self._collect()
+                self._reload_if_due()
+                # 整批只用一份快照；按旧快照构造特征的请求退回去重新构造
+                snap = self.scorer.current
+                stale = [item for item in items if item[1] is not snap]
+                if stale:
+                    self.metrics.count('stale', len(stale))
+                    for _, _, fut in stale:
+                        fut.set_exception(StaleSnapshot())
+                    items = [item for item in items if item[1] is snap]
+                    if not items:
+                        continue
+                try:
+                    start = time.perf_counter()
+                    X = np.concatenate([x for x, _, _ in items]) if len(items) > 1 else items[0][0]
+                    preds, proba = snap.model.predict_both(X)
+                    self.metrics.batch(len(X), 1000 * (time.perf_counter() - start))
+                except Exception as e:
+                    self.metrics.count('errors', len(items))
+                    for _, _, fut in items:
+                        fut.set_exception(e)
+                    continue
+                offset = 0
+                for x, _, fut in items:
+                    fut.set_result((preds[offset:offset + len(x)], proba[offset:offset + len(x), 1]))
+                    offset += len(x)
+                # 结果已经返回，再顺带给这一批做漂移计数（一次分箱，相对打分可以忽略）
+                if snap.drift is not None:
+                    try:
+                        snap.drift.update(X)
+                    except Exception as e:
+                        print(f"⚠️ 漂移统计失败: {e}")
+
+    def _reload_if_due(self):
+        now = time.monotonic()
+        if now - self.last_check < PARAMS['reload_every']:
+            return
+        self.last_check = now
+        try:
+            if self.scorer.maybe_reload():
+                self.metrics.count('reloads')
+                model = self.scorer.current.model
+                print(f"🔄 模型文件已更新，重新加载：{engine_for(model).label}，{model.n_trees} 棵树")
+        except Exception as e:
+            # 文件正在被替换等情况：继续用旧模型，下次再试
+            print(f"⚠️ 重新加载模型失败，继续使用旧模型: {e}")
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有 5，床旁看板等并发客户端一多就会被拒绝连接
+    request_queue_size = 128
+
+
+def make_handler(scorer, batcher, metrics):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                model = scorer.current.model
+                self._send(200, {'status': 'ok', 'engine': model.engine, 'n_trees': model.n_trees,
+                                 'n_features': len(model.feature_names)})
+            elif self.path == '/metrics':
+                self._send(200, metrics.snapshot())
+            elif self.path == '/drift':
+                drift = scorer.current.drift
+                if drift is None:
+                    self._send(404, {'error': '没有训练集特征草图，请先运行特征工程步骤（3_feature）'})
+                else:
+                    report = drift.report()
+                    self._send(200, {'n': drift.n, 'status': report['status'].value_counts().to_dict(),
+                                     'features': report.reset_index().to_dict('records')})
+            else:
+                self._send(404, {'error': f'未知路径: {self.path}'})
+
+        def do_POST(self):
+            if self.path not in ('/score', '/stream'):
+                self._send(404, {'error': f'未知路径: {self.path}'})
+                return
+            start = time.perf_counter()
+            snap = scorer.current
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/stream':
+                    if 'records' not in body:
+                        raise ValueError("流式请求需要 records 字段")
+                    kind, payload = 'stream', body['records']
+                elif 'records' in body:
+                    kind, payload = 'records', body['records']
+                elif 'features' in body:
+                    kind, payload = 'features', body['features']
+                else:
+                    raise ValueError("请求需要 features 或 records 字段")
+                ids, X = scorer.featurize(kind, payload, snap)
+            except (ValueError, KeyError, TypeError) as e:
+                metrics.count('errors')
+                self._send(400, {'error': str(e)})
+                return
+            try:
+                # 排队期间模型被替换：按新快照重新构造特征再提交（替换间隔远大于排队时间，重试一两次足够）
+                for attempt in range(MAX_RESUBMIT + 1):
+                    try:
+                        preds, probs = batcher.submit(X, snap).result() if len(X) else ([], [])
+                        break
+                    except StaleSnapshot:
+                        if attempt == MAX_RESUBMIT:
+                            raise
+                        old, snap = snap, scorer.current
+                        ids, X = scorer.featurize(kind, payload, snap, previous=(old, ids))
+            except Exception as e:
+                self._send(500, {'error': str(e) or type(e).__name__})
+                return
+            latency = 1000 * (time.perf_counter() - start)
+            metrics.request(latency)
+            results = [{'icustayid': None if i is None else int(i), 'probability': float(p), 'prediction': int(c)}
+                       for i, p, c in zip(ids, probs, preds)]
+            if self.path == '/stream':
+                for r in results:
+                    r['alert'] = r['probability'] >= PARAMS['alert_threshold']
+            self._send(200, {'results': results, 'latency_ms': round(latency, 3)})
+            if self.path == '/stream':
+                snap.stream.maybe_snapshot(PARAMS['snapshot_every'])
+
+        def log_message(self, format, *args):
+            # 每个请求一行访问日志太吵，延迟和计数看 /metrics
+            pass
+
+    return Handler
+
+
+def score(payload, url=None, timeout=10.0, endpoint='score'):
+    """
+    客户端：向打分服务发一个请求
+
+    endpoint='score' 时 payload 为 {"features": [...]} 或 {"records": [...]}；
+    endpoint='stream' 时为 {"records": [...]}（新到的逐时记录）
+    """
+    url = url or f"http://{PARAMS['host']}:{PARAMS['port']}/{endpoint}"
+    req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def serve(host=None, port=None, max_batch=None, max_wait_ms=None, dirs=None):
+    dirs = dirs or get_dirs()
+    host = host or PARAMS['host']
+    port = PARAMS['port'] if port is None else port
+    with budget.allocate('serve', dirs.root) as cores:
+        scorer = Scorer(dirs)
+        metrics = Metrics()
+        batcher = MicroBatcher(scorer, metrics, max_batch or PARAMS['max_batch'],
+                               PARAMS['max_wait_ms'] if max_wait_ms is None else max_wait_ms, cores)
+        server = ScoringServer((host, port), make_handler(scorer, batcher, metrics))
+        print(f"🚑 打分服务已启动: http://{host}:{server.server_port}  "
+              f"（{engine_for(scorer.current.model).label}，{scorer.current.model.n_trees} 棵树，"
+              f"微批 ≤{batcher.max_batch} / {1000 * batcher.max_wait:g} ms，{cores} 核）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 打分服务已停止")
+        finally:
+            server.server_close()
+            scorer.current.stream.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的脓毒症死亡风险打分服务")
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--max-batch', type=int, default=None, help="一个微批最多的住院数")
+    parser.add_argument('--max-wait-ms', type=float, default=None, help="凑批最多等待的毫秒数")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == '__main__':
+    main()
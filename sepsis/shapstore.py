@@ -0,0 +1,223 @@
+# 文件：sepsis/shapstore.py
+# SHAP 值库：6_explain 算出的整个 SHAP 矩阵按住院编号索引存盘（目录 + .npy，读取时内存映射）。
+#   values.npy  (n, m) float32   每条住院、每个特征的 SHAP 值
+#   data.npy    (n, m) float32   对应的特征值（解释时引用）
+#   ids.npy     (n,)   int64     住院编号（行顺序）
+#   output.npy  (n,)   float32   模型输出 = 基线 + 各特征 SHAP 之和（随机森林为概率，梯度提升为 log-odds）
+#   topk.npy    (n, k) int16     每行 |SHAP| 最大的 k 个特征（按 |SHAP| 降序）
+#   by_risk.npy (n,)   int32     行号按模型输出从高到低排序；rank.npy 为其逆（每行的风险名次）
+#   slots.npy / rows.npy         开放寻址哈希表：住院编号 -> 行号，查询不必先把索引读进内存
+#   stats.npy   (len(STATS), m)  每个特征的列统计（平均 |SHAP| 等），meta.json 里是特征名和基线
+# “住院 X 为什么风险高”“贡献最大的 k 个特征”都是常数时间的查表，不需要重新计算 SHAP。
+# 用法：python -m sepsis.shapstore why <住院编号> [--k 5]   解释一条住院
+#       python -m sepsis.shapstore top [--n 10]              模型输出最高的住院
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+# 每行预先排好的贡献特征数
+TOP_K = 10
+
+# 列统计（stats.npy 的行）
+STATS = ('mean_abs', 'mean', 'std', 'min', 'max', 'pos_frac')
+
+# 哈希表空槽的标记；乘法哈希常数（2^64 / 黄金分割比）
+EMPTY = np.iinfo(np.int64).min
+HASH_MULT = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+def _hash_slots(ids, bits):
+    """住院编号 -> 初始槽位（Fibonacci 哈希，取乘积的高 bits 位）"""
+    with np.errstate(over='ignore'):
+        h = ids.astype(np.uint64) * np.uint64(HASH_MULT)
+    return (h >> np.uint64(64 - bits)).astype(np.int64)
+
+
+def build_index(ids):
+    """线性探测的哈希表，装载率不超过 1/2；返回 (slots, rows)"""
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("住院编号有重复")
+    bits = max(1, int(np.ceil(np.log2(max(2 * len(ids), 2)))))
+    size = 1 << bits
+    slots = np.full(size, EMPTY, dtype=np.int64)
+    rows = np.full(size, -1, dtype=np.int32)
+    pending = np.arange(len(ids))
+    pos = _hash_slots(ids, bits)
+    # 每轮把还没放下的编号同时往后探一格；同一轮抢同一个空槽的只放第一个
+    while len(pending):
+        p = pos[pending]
+        free = slots[p] == EMPTY
+        taken, first = np.unique(p[free], return_index=True)
+        placed = pending[free][first]
+        slots[taken] = ids[placed]
+        rows[taken] = placed
+        pending = np.setdiff1d(pending, placed, assume_unique=True)
+        pos[pending] = (pos[pending] + 1) & (size - 1)
+    return slots, rows
+
+
+class ShapStore:
+    """
+    feature_names:  特征名（列顺序）
+    expected:       基线输出（各特征 SHAP 为 0 时的模型输出）
+    scale:          'probability'（随机森林）或 'log_odds'（梯度提升）
+    """
+
+    ARRAYS = ('values', 'data', 'ids', 'output', 'topk', 'by_risk', 'rank', 'slots', 'rows', 'stats')
+
+    def __init__(self, feature_names, expected, scale, path=None, **arrays):
+        self.feature_names = list(feature_names)
+        self.expected = float(expected)
+        self.scale = scale
+        self.path = path
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._bits = int(len(self.slots)).bit_length() - 1
+
+    @classmethod
+    def build(cls, values, data, ids, feature_names, expected, scale, top_k=TOP_K):
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        output = (expected + values.sum(axis=1, dtype=np.float64)).astype(np.float32)
+        k = min(top_k, values.shape[1])
+        # argpartition 取出前 k 个，再只对这 k 个排序
+        mag = np.abs(values)
+        part = np.argpartition(-mag, k - 1, axis=1)[:, :k] if k else np.empty((len(values), 0), dtype=np.int64)
+        order = np.argsort(-np.take_along_axis(mag, part, axis=1), axis=1, kind='stable')
+        by_risk = np.argsort(-output, kind='stable').astype(np.int32)
+        rank = np.empty_like(by_risk)
+        rank[by_risk] = np.arange(len(by_risk), dtype=np.int32)
+        slots, rows = build_index(ids)
+        v64 = values.astype(np.float64)
+        stats = np.stack([np.abs(v64).mean(axis=0), v64.mean(axis=0), v64.std(axis=0),
+                          v64.min(axis=0), v64.max(axis=0), (v64 > 0).mean(axis=0)])
+        return cls(feature_names, expected, scale,
+                   values=values, data=np.ascontiguousarray(data, dtype=np.float32), ids=ids,
+                   output=output, topk=np.take_along_axis(part, order, axis=1).astype(np.int16),
+                   by_risk=by_risk, rank=rank,
+                   slots=slots, rows=rows, stats=stats)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -----------------------------------------------------------------
+    # 存取
+    # -----------------------------------------------------------------
+
+    def save(self, path):
+        """写成目录（先写临时目录再替换）"""
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp, f'{name}.npy'), getattr(self, name))
+        meta = {'feature_names': self.feature_names, 'expected': self.expected, 'scale': self.scale,
+                'stats': list(STATS), 'top_k': int(self.topk.shape[1])}
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        self.path = path
+        return path
+
+    @classmethod
+    def open(cls, path):
+        """按内存映射打开：只读 meta.json，数组在查询时才按页读入"""
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in cls.ARRAYS}
+        return cls(meta['feature_names'], meta['expected'], meta['scale'], path=path, **arrays)
+
+    # -----------------------------------------------------------------
+    # 查询
+    # -----------------------------------------------------------------
+
+    def row(self, stay_id):
+        """住院编号 -> 行号；不在库里时 KeyError"""
+        mask = len(self.slots) - 1
+        pos = ((int(stay_id) * HASH_MULT) & MASK64) >> (64 - self._bits)
+        while True:
+            key = self.slots[pos]
+            if key == stay_id:
+                return int(self.rows[pos])
+            if key == EMPTY:
+                raise KeyError(stay_id)
+            pos = (pos + 1) & mask
+
+    def __contains__(self, stay_id):
+        try:
+            self.row(stay_id)
+        except KeyError:
+            return False
+        return True
+
+    def probability(self, stay_id):
+        out = float(self.output[self.row(stay_id)])
+        return out if self.scale == 'probability' else float(1.0 / (1.0 + np.exp(-out)))
+
+    def top_features(self, stay_id, k=5):
+        """贡献最大（按 |SHAP|）的 k 个特征：[(特征名, SHAP 值, 特征值), ...]"""
+        i = self.row(stay_id)
+        k = min(k, self.topk.shape[1])
+        return [(self.feature_names[j], float(self.values[i, j]), float(self.data[i, j]))
+                for j in self.topk[i, :k]]
+
+    def column_stats(self, feature):
+        j = self.feature_names.index(feature)
+        return dict(zip(STATS, self.stats[:, j].tolist()))
+
+    def highest(self, n=10):
+        """模型输出最高的 n 条住院：[(住院编号, 模型输出), ...]"""
+        rows = self.by_risk[:n]
+        return list(zip(self.ids[rows].tolist(), self.output[rows].tolist()))
+
+    def why(self, stay_id, k=5):
+        """一条住院的文字解释：模型输出、相对基线的变化、推高 / 拉低风险的主要特征"""
+        unit = '概率' if self.scale == 'probability' else 'log-odds'
+        i = self.row(stay_id)
+        out = float(self.output[i])
+        lines = [f"住院 {stay_id}：预测死亡风险 {self.probability(stay_id):.1%}"
+                 f"（模型输出 {out:.4f} {unit}，基线 {self.expected:.4f}，"
+                 f"风险在库中 {len(self)} 条住院里排第 {int(self.rank[i]) + 1}）"]
+        top = self.top_features(stay_id, k)
+        for sign, title in ((1, '推高风险'), (-1, '降低风险')):
+            items = [(f, v, x) for f, v, x in top if v * sign > 0]
+            if not items:
+                continue
+            lines.append(f"  {title}的主要特征：")
+            for f, v, x in items:
+                typical = self.stats[0, self.feature_names.index(f)]
+                ratio = f"，约为该特征平均 |SHAP| 的 {abs(v) / typical:.1f} 倍" if typical > 0 else ""
+                lines.append(f"    {f} = {x:.4g}：SHAP {v:+.4f}{ratio}")
+        return "\n".join(lines)
+
+
+def main():
+    from sepsis.artifacts import artifact_path, get_dirs
+
+    parser = argparse.ArgumentParser(prog='python -m sepsis.shapstore', description='查询 SHAP 值库')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('why', help='解释一条住院的预测')
+    p.add_argument('stay_id', type=int)
+    p.add_argument('--k', type=int, default=5)
+    p = sub.add_parser('top', help='模型输出最高的住院')
+    p.add_argument('--n', type=int, default=10)
+    p.add_argument('--k', type=int, default=3)
+    args = parser.parse_args()
+
+    store = ShapStore.open(artifact_path('shap_store', get_dirs()))
+    if args.command == 'why':
+        if args.stay_id not in store:
+            raise SystemExit(f"住院 {args.stay_id} 不在 SHAP 值库中（库里有 {len(store)} 条住院）")
+        print(store.why(args.stay_id, args.k))
+    else:
+        for stay_id, _ in store.highest(args.n):
+            print(store.why(stay_id, args.k))
+
+
+if __name__ == '__main__':
+    main()
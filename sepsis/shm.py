@@ -0,0 +1,89 @@
+# 文件：sepsis/shm.py
+# 进程间共享的只读 numpy 数组：主进程把数组拷进一段共享内存一次，
+# 进程池里的工作进程按名字挂载，直接在同一块物理内存上建视图，不再逐任务序列化整表。
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    """
+    一组共享内存数组，用作 with 块：退出时关闭并释放共享内存
+
+    arrays 是主进程里的视图；spec 只包含名字、形状和类型，
+    可以廉价地传给工作进程，由 attach() 还原成数组。
+    """
+
+    def __init__(self, arrays=None):
+        self._blocks = []
+        self.spec = {}
+        self.arrays = {}
+        try:
+            for key, a in (arrays or {}).items():
+                self.add(key, a)
+        except Exception:
+            self.close()
+            raise
+
+    def empty(self, key, shape, dtype, order='C'):
+        """分配一块共享数组并返回可写视图，由调用方直接填充（省掉一次整表拷贝）"""
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._blocks.append(shm)
+        self.spec[key] = (shm.name, shape, dtype.str, order)
+        self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, order=order)
+        return self.arrays[key]
+
+    def add(self, key, a):
+        """把已有数组拷进共享内存"""
+        a = np.asarray(a)
+        order = 'F' if a.ndim > 1 and a.flags.f_contiguous and not a.flags.c_contiguous else 'C'
+        self.empty(key, a.shape, a.dtype, order)[...] = a
+
+    def close(self):
+        self.arrays = {}
+        for shm in self._blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # 调用方还持有视图；unlink 之后内存在视图回收时释放
+                pass
+            shm.unlink()
+        self._blocks = []
+        self.spec = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def attach(spec):
+    """
+    在工作进程中按 spec 挂载共享数组，yield 数组字典
+
+    数组设为只读，避免误改其他进程看到的数据；退出 with 块后映射即关闭，
+    需要带出 with 块的结果必须是拷贝（花式索引、聚合结果本来就是新数组）。
+    """
+    arrays, handles = {}, []
+    try:
+        for key, (name, shape, dtype, order) in spec.items():
+            shm = shared_memory.SharedMemory(name=name)
+            handles.append(shm)
+            a = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, order=order)
+            a.flags.writeable = False
+            arrays[key] = a
+        yield arrays
+    finally:
+        arrays.clear()
+        for shm in handles:
+            try:
+                shm.close()
+            except BufferError:
+                # 仍有视图在外部引用：映射在视图被回收后由 SharedMemory.__del__ 关闭
+                pass
@@ -0,0 +1,201 @@
+# 文件：sepsis/store.py
+# 中间产物存储层：可插拔的列式格式，下游步骤尽量以内存映射方式读取，不再解析 CSV
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+
+try:
+    import pyarrow.feather as feather
+    import pyarrow.parquet  # noqa: F401  (pd.read_parquet / to_parquet 依赖)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+class CsvStore:
+    """原来的 CSV 交接方式，保留用于兼容和人工查看"""
+    ext = '.csv'
+
+    def save(self, df, path):
+        df.to_csv(path)
+
+    def load(self, path):
+        return pd.read_csv(path, index_col=0)
+
+
+class PickleStore:
+    ext = '.pkl'
+
+    def save(self, df, path):
+        df.to_pickle(path)
+
+    def load(self, path):
+        return pd.read_pickle(path)
+
+
+class FeatherStore:
+    """Arrow IPC（不压缩），读取时内存映射"""
+    ext = '.feather'
+
+    def save(self, df, path):
+        feather.write_feather(df, path, compression='uncompressed')
+
+    def load(self, path):
+        table = feather.read_table(path, memory_map=True)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+class ParquetStore:
+    """压缩列式格式，体积最小，适合归档；读取需要解码"""
+    ext = '.parquet'
+
+    def save(self, df, path):
+        df.to_parquet(path)
+
+    def load(self, path):
+        return pd.read_parquet(path, memory_map=True)
+
+
+class NpyStore:
+    """
+    目录 + .npy 文件，只依赖 numpy
+
+    全部列同一类型时存成一个二维矩阵（X_train / X_test），否则每列一个文件；
+    读取时 np.load(mmap_mode='r')，DataFrame 直接建在映射的内存上，不做拷贝。
+    """
+    ext = '.npy.d'
+
+    def save(self, df, path):
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        homogeneous = df.shape[1] > 0 and df.dtypes.nunique() == 1
+        meta = {
+            'columns':    [str(c) for c in df.columns],
+            'index_name': df.index.name,
+            'layout':     'matrix' if homogeneous else 'columns',
+        }
+        np.save(os.path.join(tmp, 'index.npy'), df.index.to_numpy())
+        if homogeneous:
+            np.save(os.path.join(tmp, 'values.npy'), np.ascontiguousarray(df.to_numpy()))
+        else:
+            for i, col in enumerate(df.columns):
+                np.save(os.path.join(tmp, f'col_{i:04d}.npy'), df[col].to_numpy())
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = pd.Index(np.load(os.path.join(path, 'index.npy'), mmap_mode='r'), name=meta['index_name'])
+        if meta['layout'] == 'matrix':
+            values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+            return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+        data = {col: np.load(os.path.join(path, f'col_{i:04d}.npy'), mmap_mode='r')
+                for i, col in enumerate(meta['columns'])}
+        return pd.DataFrame(data, index=index, copy=False)
+
+
+class PartitionedFrame:
+    """
+    按分区存放的大表：目录下 part-00000<ext>, part-00001<ext> …
+
+    流式加载器按块写出分区，下游既可以逐块处理（iter_parts），
+    也可以在内存够用时一次性拼成完整 DataFrame（to_frame）。
+    """
+
+    def __init__(self, path, store=None):
+        self.path = path
+        self.store = store or get_store()
+
+    @property
+    def parts(self):
+        return sorted(os.path.join(self.path, n) for n in os.listdir(self.path)
+                      if n.startswith('part-') and n.endswith(self.store.ext))
+
+    def iter_parts(self):
+        for part in self.parts:
+            yield self.store.load(part)
+
+    def to_frame(self):
+        frames = list(self.iter_parts())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def __len__(self):
+        return len(self.parts)
+
+
+def write_partition(df, folder, i, store=None):
+    store = store or get_store()
+    path = os.path.join(folder, f'part-{i:05d}{store.ext}')
+    store.save(df, path)
+    return path
+
+
+def write_partitions(frames, out_dir, store=None):
+    """把一串 DataFrame 逐个写成分区；先写临时目录，全部成功后再替换，避免留下半截产物"""
+    store = store or get_store()
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, df in enumerate(frames):
+        write_partition(df, tmp_dir, i, store)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return PartitionedFrame(out_dir, store)
+
+
+def _map_part(fn, src, folder, i, store):
+    write_partition(fn(store.load(src)), folder, i, store)
+
+
+def map_partitions(fn, parts, out_dir, n_jobs=1):
+    """
+    对每个分区应用 fn（DataFrame -> DataFrame）并写成同名序号的新分区
+
+    分区多于一个且 n_jobs != 1 时在进程池中并行，每个工作进程自己读写分区文件，
+    主进程不经手数据；fn 需要可以 pickle（模块级函数或 functools.partial）。
+    """
+    store = parts.store
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    srcs = parts.parts
+    n_jobs = min(effective_n_jobs(n_jobs), len(srcs))
+    if n_jobs > 1:
+        Parallel(n_jobs=n_jobs)(delayed(_map_part)(fn, src, tmp_dir, i, store) for i, src in enumerate(srcs))
+    else:
+        for i, src in enumerate(srcs):
+            _map_part(fn, src, tmp_dir, i, store)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return PartitionedFrame(out_dir, store)
+
+
+STORES = {
+    'csv':     CsvStore,
+    'pickle':  PickleStore,
+    'feather': FeatherStore,
+    'parquet': ParquetStore,
+    'npy':     NpyStore,
+}
+
+# 默认格式：有 pyarrow 时用 feather，否则退回 npy；可用环境变量 SEPSIS_STORE_FORMAT 覆盖
+DEFAULT_FORMAT = 'feather' if HAS_PYARROW else 'npy'
+
+
+def get_store(fmt=None):
+    fmt = fmt or os.environ.get('SEPSIS_STORE_FORMAT') or DEFAULT_FORMAT
+    if fmt not in STORES:
+        raise ValueError(f"未知的中间产物格式: {fmt}（可选: {', '.join(STORES)}）")
+    if fmt in ('feather', 'parquet') and not HAS_PYARROW:
+        raise ImportError(f"{fmt} 格式需要安装 pyarrow")
+    return STORES[fmt]()
@@ -0,0 +1,331 @@
+# 文件：sepsis/stream.py
+# 流式特征：新到的逐时记录（charttime 行）按住院增量更新运行中的聚合量，每行 O(1)，
+# 不再对住院的全部历史重新做 last / mean / max / min。
+# 每个（住院, 列）保存：非缺失计数、均值与离差平方和（Chan 合并公式，供 mean / std）、
+# max、min、first / last 的值及其 charttime；乱序到达的行按 charttime 决定是否替换 first / last。
+# 结果与 3_feature 对同一批数据的批量聚合一致（列名同为 <列>_<函数>）。
+# 状态表在内存中，定期整体快照到磁盘（npz，先写临时文件再替换），重启后从快照恢复。
+# 用法：python -m sepsis.stream replay test_data.csv [--batch-rows 1000] [--alert-threshold 0.75]
+#      按 charttime 顺序回放一份 CSV，逐批更新并打分，最后与批量特征对比
+import argparse
+import copy
+import importlib
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from sepsis.groupagg import SUPPORTED_FUNCS
+from sepsis.imputation import feature_columns, impute_frame, medians_for
+
+# 快照文件（在 models 目录下）
+SNAPSHOT_FILE = 'stream_state.npz'
+# 高风险提醒的概率阈值（回放与打分服务的 /stream 接口共用）
+ALERT_THRESHOLD = 0.75
+
+# 状态数组：名字 -> (dtype, 初始值)
+STATE = {
+    'count':      (np.int64,   0),
+    'mean':       (np.float64, 0.0),
+    'm2':         (np.float64, 0.0),
+    'max':        (np.float32, np.nan),
+    'min':        (np.float32, np.nan),
+    'first':      (np.float32, np.nan),
+    'last':       (np.float32, np.nan),
+    'first_time': (np.float64, np.inf),
+    'last_time':  (np.float64, -np.inf),
+}
+
+
+class StreamState:
+    """
+    住院 -> 槽位的状态表；每个状态数组形状为 (槽位容量, 列数)，容量不够时翻倍
+
+    update() 对一批行做一次向量化更新：批内按 (住院, charttime) 排序后所有列一起分段 reduceat，
+    再与已有状态按槽位合并，所以每行的摊还代价是常数，与住院已有多少历史记录无关。
+    """
+
+    def __init__(self, columns, funcs, capacity=1024):
+        unknown = set(funcs) - set(SUPPORTED_FUNCS)
+        if unknown:
+            raise ValueError(f"不支持的聚合函数: {sorted(unknown)}")
+        self.columns = list(columns)
+        self.funcs = tuple(funcs)
+        self.slots = {}
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.arrays = {name: np.full((capacity, len(self.columns)), init, dtype=dtype)
+                       for name, (dtype, init) in STATE.items()}
+        self.rows_seen = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def feature_names(self):
+        return [f'{c}_{f}' for c in self.columns for f in self.funcs]
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        n = len(self.slots)
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:n] = self.ids[:n]
+        self.ids = ids
+        for name, (dtype, init) in STATE.items():
+            a = np.full((capacity, len(self.columns)), init, dtype=dtype)
+            a[:n] = self.arrays[name][:n]
+            self.arrays[name] = a
+
+    def _slots_for(self, stay_ids):
+        """每个住院的槽位，新住院分配新槽位"""
+        uniq, inverse = np.unique(stay_ids, return_inverse=True)
+        new = [int(s) for s in uniq if int(s) not in self.slots]
+        if new:
+            n = len(self.slots)
+            self._grow(n + len(new))
+            for k, s in enumerate(new):
+                self.slots[s] = n + k
+            self.ids[n:n + len(new)] = new
+        return np.array([self.slots[int(s)] for s in uniq], dtype=np.int64)[inverse]
+
+    def update(self, stay_ids, times, values):
+        """
+        stay_ids: (n,) 住院 id；times: (n,) charttime；values: (n, 列数) 已填补的数值，NaN 视为缺失
+        返回本批涉及的住院 id（已排序）
+        """
+        values = np.asarray(values, dtype=np.float32)
+        times = np.asarray(times, dtype=np.float64)
+        with self.lock:
+            slots = self._slots_for(np.asarray(stay_ids))
+            # 批内按 (槽位, charttime) 排序：每段里行号最大的非缺失值就是时间最晚的
+            order = np.lexsort((times, slots))
+            slots, times, values = slots[order], times[order], values[order]
+            starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+            self._merge(slots[starts], starts, times, values)
+            self.rows_seen += len(values)
+            return np.sort(self.ids[slots[starts]])
+
+    def _merge(self, rows, starts, times, values):
+        """本批各段的统计量（所有列一起按段 reduceat）与已有状态合并"""
+        n = len(values)
+        lens = np.diff(np.r_[starts, n])
+        valid = ~np.isnan(values)
+        cb = np.add.reduceat(valid, starts, axis=0, dtype=np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mb = np.add.reduceat(np.where(valid, values, 0), starts, axis=0, dtype=np.float64) / cb
+        dev = np.where(valid, values - np.repeat(np.nan_to_num(mb), lens, axis=0), 0.0)
+        m2b = np.add.reduceat(dev * dev, starts, axis=0, dtype=np.float64)
+        # 每段每列第一个 / 最后一个非缺失值所在的行号，整段缺失时落在段外
+        pos = np.arange(n)[:, None]
+        last_pos = np.maximum.reduceat(np.where(valid, pos, -1), starts, axis=0)
+        first_pos = np.minimum.reduceat(np.where(valid, pos, n), starts, axis=0)
+        cols = np.arange(values.shape[1])
+        has = cb > 0
+        last_pos, first_pos = np.where(has, last_pos, 0), np.where(has, first_pos, 0)
+
+        a = {name: arr[rows] for name, arr in self.arrays.items()}
+        c0 = a['count']
+        c = c0 + cb
+        # Chan 等人的并行合并：均值和离差平方和可以逐批累加，不用保留历史行
+        delta = np.nan_to_num(mb) - a['mean']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(c > 0, cb / c, 0.0)
+        a['mean'] += delta * w
+        a['m2'] += m2b + delta * delta * c0 * w
+        a['count'] = c
+        a['max'] = np.fmax(a['max'], np.fmax.reduceat(values, starts, axis=0))
+        a['min'] = np.fmin(a['min'], np.fmin.reduceat(values, starts, axis=0))
+        # 同一时间的记录以后到的为准（与批量聚合里“行序靠后”一致）；乱序到达的旧记录不替换 last
+        t_last = np.where(has, times[last_pos], -np.inf)
+        later = has & (t_last >= a['last_time'])
+        a['last'] = np.where(later, values[last_pos, cols], a['last'])
+        a['last_time'] = np.where(later, t_last, a['last_time'])
+        t_first = np.where(has, times[first_pos], np.inf)
+        earlier = has & (t_first < a['first_time'])
+        a['first'] = np.where(earlier, values[first_pos, cols], a['first'])
+        a['first_time'] = np.where(earlier, t_first, a['first_time'])
+        for name, arr in a.items():
+            self.arrays[name][rows] = arr
+
+    def matrix(self, stay_ids, names):
+        """这些住院的特征矩阵 (float32)，列按 names 的顺序（如模型的 feature_names）"""
+        with self.lock:
+            rows = np.array([self.slots[int(s)] for s in stay_ids], dtype=np.int64)
+            a = {name: arr[rows] for name, arr in self.arrays.items()}
+        count = a['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            computed = {
+                'count': count,
+                'mean':  np.where(count > 0, a['mean'], np.nan),
+                'std':   np.where(count > 1, np.sqrt(a['m2'] / (count - 1)), np.nan),
+                'max':   a['max'], 'min': a['min'], 'first': a['first'], 'last': a['last'],
+            }
+        index = {c: j for j, c in enumerate(self.columns)}
+        out = np.empty((len(rows), len(names)), dtype=np.float32)
+        for k, name in enumerate(names):
+            col, func = name.rsplit('_', 1)
+            out[:, k] = computed[func][:, index[col]]
+        return out
+
+    def features(self, stay_ids=None):
+        """当前的特征表（行为住院，列为 <列>_<函数>），与 groupagg.agg_frame 的结果相同"""
+        if stay_ids is None:
+            stay_ids = np.sort(self.ids[:len(self.slots)])
+        names = self.feature_names
+        X = self.matrix(stay_ids, names)
+        df = pd.DataFrame(X, columns=names, index=pd.Index(np.asarray(stay_ids), name='icustayid'))
+        counts = [name for name in names if name.endswith('_count')]
+        if counts:
+            df[counts] = df[counts].astype(np.int64)
+        return df
+
+    # -----------------------------------------------------------------
+    # 快照
+    # -----------------------------------------------------------------
+
+    def save(self, path):
+        with self.lock:
+            n = len(self.slots)
+            payload = {name: arr[:n] for name, arr in self.arrays.items()}
+            payload.update(ids=self.ids[:n], columns=np.array(self.columns), funcs=np.array(self.funcs),
+                           rows_seen=np.array(self.rows_seen))
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, **payload)
+            os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path, columns=None, funcs=None):
+        with np.load(path, allow_pickle=False) as z:
+            state = cls(z['columns'].tolist(), tuple(z['funcs'].tolist()), capacity=max(1024, len(z['ids'])))
+            if (columns is not None and state.columns != list(columns)) or (funcs is not None and state.funcs != tuple(funcs)):
+                raise ValueError("快照的列或聚合方式与当前模型不一致")
+            n = len(z['ids'])
+            state.ids[:n] = z['ids']
+            for name in STATE:
+                state.arrays[name][:n] = z[name]
+            state.rows_seen = int(z['rows_seen'])
+        state.slots = {int(s): k for k, s in enumerate(state.ids[:n])}
+        return state
+
+
+class StreamFeaturizer:
+    """原始逐时记录 -> 填补（已保存的中位数）-> 更新状态表 -> 涉及住院的最新特征向量"""
+
+    def __init__(self, feature_names, medians, snapshot=None):
+        # 特征名是 <原始列>_<聚合方式>，按出现顺序还原原始列和聚合方式
+        self.feature_names = list(feature_names)
+        self.raw_columns = list(dict.fromkeys(name.rsplit('_', 1)[0] for name in self.feature_names))
+        funcs = tuple(dict.fromkeys(name.rsplit('_', 1)[1] for name in self.feature_names))
+        self.feat = feature_columns(self.raw_columns)
+        self.feat_idx = [self.raw_columns.index(c) for c in self.feat]
+        self.medians = medians_for(medians, self.feat)
+        self.snapshot = snapshot
+        if snapshot and os.path.exists(snapshot):
+            self.state = StreamState.load(snapshot, self.raw_columns, funcs)
+        else:
+            self.state = StreamState(self.raw_columns, funcs)
+        self.last_saved = time.monotonic()
+
+    def prepare(self, records):
+        """记录表 -> 已填补的 (住院 id, charttime, 数值矩阵)"""
+        df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+        if 'icustayid' not in df or 'charttime' not in df:
+            raise ValueError("流式记录需要 icustayid 和 charttime 列")
+        absent = [c for c in self.raw_columns if c not in df and c not in self.feat]
+        if absent:
+            raise ValueError(f"流式记录缺少列: {absent}")
+        # 没给的生命体征 / 化验列按缺失处理；与管道相同：0 视作缺失，再用保存的中位数填补
+        values = np.full((len(df), len(self.raw_columns)), np.nan, dtype=np.float32)
+        for j, col in enumerate(self.raw_columns):
+            if col in df:
+                values[:, j] = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+        block = values[:, self.feat_idx]
+        block[block == 0] = np.nan
+        values[:, self.feat_idx] = np.where(np.isnan(block), self.medians.astype(np.float32), block)
+        return df['icustayid'].to_numpy(), df['charttime'].to_numpy(), values
+
+    def update(self, records):
+        """更新状态，返回 (涉及的住院 id, 特征矩阵)，列顺序与模型一致"""
+        ids, times, values = self.prepare(records)
+        touched = self.state.update(ids, times, values)
+        return touched, self.state.matrix(touched, self.feature_names)
+
+    def with_medians(self, medians):
+        """换成新的中位数的副本，与原对象共用同一张状态表（特征布局相同的模型替换时用）"""
+        other = copy.copy(self)
+        other.medians = medians_for(medians, self.feat)
+        return other
+
+    def maybe_snapshot(self, every):
+        if self.snapshot and time.monotonic() - self.last_saved >= every:
+            self.save()
+
+    def save(self):
+        if self.snapshot:
+            self.state.save(self.snapshot)
+            self.last_saved = time.monotonic()
+
+
+def replay(csv_path, batch_rows=1000, dirs=None, alert_threshold=ALERT_THRESHOLD):
+    """按 charttime 顺序把 CSV 分批喂给流式特征，并用编译后的模型给每批涉及的住院打分"""
+    from sepsis.artifacts import get_dirs, load_artifact
+
+    dirs = dirs or get_dirs()
+    load = importlib.import_module('sepsis.1_load')
+    feature = importlib.import_module('sepsis.3_feature')
+    model = load_artifact('model_compiled', dirs)
+    medians = load_artifact('impute_medians', dirs)
+    stream = StreamFeaturizer(model.feature_names, medians)
+    model.warm()  # 预热 JIT，不计入耗时
+
+    schema = load.infer_schema(csv_path)
+    df = pd.concat(load.read_chunks(csv_path, schema, 'stream', {'rows': 0}), ignore_index=True)
+    df = df.sort_values('charttime', kind='stable').reset_index(drop=True)
+    print(f"1. 回放 {csv_path}: {len(df)} 行，{df['icustayid'].nunique()} 个住院，每批 {batch_rows} 行")
+
+    alerts = {}
+    start = time.perf_counter()
+    scored = 0
+    for lo in range(0, len(df), batch_rows):
+        touched, X = stream.update(df.iloc[lo:lo + batch_rows])
+        _, proba = model.predict_both(X)
+        scored += len(X)
+        for stay, p in zip(touched, proba[:, 1]):
+            if p >= alert_threshold and stay not in alerts:
+                alerts[stay] = df['charttime'].iloc[min(lo + batch_rows, len(df)) - 1]
+    elapsed = time.perf_counter() - start
+    print(f"2. 流式更新 + 打分: {len(df) / elapsed:,.0f} 行/秒，共 {scored} 次住院打分，"
+          f"{len(alerts)} 个住院触发高风险提醒（概率 ≥ {alert_threshold:g}）")
+
+    # 对照：同样的数据按管道方式整表填补、聚合
+    batch = impute_frame(df, stream.feat, stream.medians)
+    drop = [c for c in ('charttime', 'mortality_90d') if c in batch]
+    expected = feature.extract_agg(batch.drop(columns=drop))[model.feature_names]
+    got = stream.state.features()[model.feature_names]
+    same = got.index.equals(expected.index) and np.allclose(got.to_numpy(), expected.to_numpy(),
+                                                            rtol=1e-5, atol=1e-5, equal_nan=True)
+    print(f"3. 与批量特征一致: {'✓' if same else '✗'}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式特征：按住院增量更新运行中的聚合量")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('replay', help="按 charttime 顺序回放一份 CSV")
+    p.add_argument('csv')
+    p.add_argument('--batch-rows', type=int, default=1000)
+    p.add_argument('--alert-threshold', type=float, default=ALERT_THRESHOLD)
+    args = parser.parse_args()
+    if args.command == 'replay':
+        replay(args.csv, args.batch_rows, alert_threshold=args.alert_threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+# 文件：sepsis/update.py
+# 增量更新：只处理新到的住院记录，在已保存的模型上更新，不重跑全量特征工程和超参数搜索。
+#   trees：    warm start，在新数据上追加若干棵树（随机森林）或若干轮迭代（梯度提升）；
+#   reservoir：用同样的超参数，在“历史蓄水池样本 + 新数据”上重新训练一个模型。
+# 每次更新前把当前模型存为一个版本并记录血缘（父版本、方式、新数据哈希），可以随时回滚。
+# 用法：
+#   python -m sepsis.update new_stays.csv [--mode trees|reservoir]
+#   python -m sepsis.update --history
+#   python -m sepsis.update --rollback 3
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import f1_score, roc_auc_score
+
+from sepsis import cache
+from sepsis.artifacts import artifact_path, get_dirs, load_artifact, save_artifact
+from sepsis.compiled import compile_model
+from sepsis.engines import engine_for
+from sepsis.imputation import feature_columns, impute_frame, medians_for
+
+PARAMS = {
+    'mode':         'trees',
+    # trees 模式每次追加的树数 / 迭代数
+    'add_trees':    50,
+    'add_iters':    50,
+    # 蓄水池容量（行数），首次更新时从 X_train 中均匀抽样初始化
+    'reservoir':    20_000,
+    'random_state': 42,
+}
+
+LINEAGE_FILE = 'lineage.json'
+VERSIONS_DIR = 'versions'
+RESERVOIR_FILE = 'reservoir.npz'
+
+
+def _lineage_path(dirs):
+    return os.path.join(dirs.models, LINEAGE_FILE)
+
+
+def read_lineage(dirs):
+    path = _lineage_path(dirs)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_lineage(dirs, lineage):
+    cache.write_json_atomic(_lineage_path(dirs), lineage)
+
+
+def _snapshot(dirs, lineage, **info):
+    """把当前模型文件复制成新版本并追加血缘记录，返回该记录"""
+    version = len(lineage) + 1
+    folder = os.path.join(dirs.models, VERSIONS_DIR)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'model-v{version:04d}.pkl')
+    shutil.copy2(artifact_path('model', dirs), path)
+    entry = {
+        'version': version,
+        'parent':  lineage[-1]['version'] if lineage else None,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'path':    os.path.relpath(path, dirs.models),
+        'digest':  cache.file_digest(path)['digest'],
+        **info,
+    }
+    lineage.append(entry)
+    _write_lineage(dirs, lineage)
+    return entry
+
+
+def _sync_train_record(dirs):
+    """
+    按当前模型文件重写编译后的模型，并把训练步骤缓存记录里的模型哈希改成当前文件：
+    管道不会因模型被替换而重新全量训练，下游的评估 / 解释 / 预测则因模型内容变化而重跑
+    """
+    save_artifact('model_compiled', compile_model(load_artifact('model', dirs)), dirs)
+    train = importlib.import_module('sepsis.4_train')
+    record = cache.read_record(train, dirs)
+    if record:
+        for name in train.OUTPUTS:
+            record['artifacts'][name] = cache.file_digest(artifact_path(name, dirs))
+        cache.write_json_atomic(cache.record_path(train, dirs), record)
+
+
+def load_new_stays(csv_path, dirs, columns):
+    """新住院记录走与全量管道相同的类型、填补（已保存的中位数）和聚合，返回 (X_new, y_new)"""
+    load = importlib.import_module('sepsis.1_load')
+    feature = importlib.import_module('sepsis.3_feature')
+
+    stats = {'rows': 0}
+    schema = load.infer_schema(csv_path)
+    df = pd.concat(load.read_chunks(csv_path, schema, 'new', stats), ignore_index=True)
+    feat = feature_columns(df.columns)
+    df = impute_frame(df, feat, medians_for(load_artifact('impute_medians', dirs), feat))
+
+    X_new = feature.extract_agg(df.drop(columns=['charttime', 'mortality_90d']))
+    y_new = df.groupby('icustayid')['mortality_90d'].first()
+    missing = [c for c in columns if c not in X_new.columns]
+    if missing:
+        raise ValueError(f"新数据缺少模型需要的特征: {missing[:5]}{' …' if len(missing) > 5 else ''}")
+    return X_new[list(columns)], y_new.loc[X_new.index]
+
+
+def data_digest(X, y):
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(X.to_numpy(np.float32)).tobytes())
+    h.update(np.asarray(y).tobytes())
+    h.update(np.asarray(X.index).tobytes())
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------------------
+# 蓄水池：历史住院的均匀样本（Algorithm R），与模型放在一起
+# ---------------------------------------------------------------------
+
+def load_reservoir(dirs, columns):
+    path = os.path.join(dirs.models, RESERVOIR_FILE)
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=False) as z:
+            return {k: z[k] for k in z.files}
+    # 首次使用：从全量训练特征中抽样
+    X = load_artifact('X_train', dirs)[list(columns)]
+    y = np.asarray(load_artifact('y_train', dirs).loc[X.index])
+    rng = np.random.default_rng(PARAMS['random_state'])
+    take = np.sort(rng.choice(len(X), size=min(PARAMS['reservoir'], len(X)), replace=False))
+    return {
+        'X':    X.to_numpy(np.float32)[take],
+        'y':    y[take],
+        'ids':  np.asarray(X.index)[take],
+        'seen': np.array(len(X)),
+    }
+
+
+def update_reservoir(res, X_new, y_new, seed):
+    """把新行按 Algorithm R 并入蓄水池：第 t 个到达的行以 capacity / t 的概率替换随机一行"""
+    rng = np.random.default_rng(seed)
+    capacity = PARAMS['reservoir']
+    values = X_new.to_numpy(np.float32)
+    labels = np.asarray(y_new)
+    ids = np.asarray(X_new.index)
+    seen = int(res['seen'])
+
+    # 还没装满：直接追加
+    room = max(0, min(capacity - len(res['X']), len(values)))
+    X = np.concatenate([res['X'], values[:room]])
+    y = np.concatenate([res['y'], labels[:room]])
+    kept = np.concatenate([res['ids'], ids[:room]])
+    seen += room
+
+    # 装满之后：一次抽出所有随机位置，再按到达顺序替换（同一位置后到的覆盖先到的）
+    rest = len(values) - room
+    if rest:
+        slots = rng.integers(np.arange(seen + 1, seen + rest + 1))
+        for i in np.flatnonzero(slots < capacity):
+            j = slots[i]
+            X[j], y[j], kept[j] = values[room + i], labels[room + i], ids[room + i]
+        seen += rest
+    return {'X': X, 'y': y, 'ids': kept, 'seen': np.array(seen)}
+
+
+def save_reservoir(dirs, res):
+    path = os.path.join(dirs.models, RESERVOIR_FILE)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **res)
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------
+# 更新 / 回滚
+# ---------------------------------------------------------------------
+
+def grow(model, X_new, y_new):
+    """warm start：在新数据上追加树（随机森林）或迭代（梯度提升），已有部分保持不变"""
+    engine = engine_for(model)
+    if len(np.unique(y_new)) < 2:
+        raise ValueError("新数据只有一个类别，无法追加树；请改用 reservoir 模式")
+    step = PARAMS['add_trees'] if engine.resource == 'n_estimators' else PARAMS['add_iters']
+    size = model.get_params()[engine.resource]
+    model.set_params(warm_start=True, **{engine.resource: size + step})
+    model.fit(X_new, y_new)
+    model.set_params(warm_start=False)
+    return model, f"{engine.resource}: {size} -> {size + step}"
+
+
+def refit(model, res, X_new, y_new):
+    """同样的超参数，在蓄水池样本 + 新数据上重新训练"""
+    X = pd.concat([pd.DataFrame(res['X'], columns=X_new.columns, index=res['ids']), X_new.astype(np.float32)])
+    y = np.concatenate([res['y'], np.asarray(y_new)])
+    fresh = clone(model).set_params(warm_start=False)
+    fresh.fit(X, y)
+    return fresh, f"在 {len(res['X'])} 行蓄水池样本 + {len(X_new)} 个新住院上重新训练"
+
+
+def update(csv_path, mode=None, dirs=None):
+    dirs = dirs or get_dirs()
+    mode = mode or PARAMS['mode']
+    if mode not in ('trees', 'reservoir'):
+        raise ValueError(f"未知的增量更新方式: {mode}")
+
+    lineage = read_lineage(dirs)
+    current = cache.file_digest(artifact_path('model', dirs))['digest']
+    if not lineage or lineage[-1]['digest'] != current:
+        # 第一次增量更新，或之后又跑过全量训练：把当前模型登记为新的基线版本，
+        # 蓄水池也从新的 X_train 重新抽样
+        if lineage:
+            print("   检测到全量重新训练的模型，作为新的基线版本")
+            reservoir = os.path.join(dirs.models, RESERVOIR_FILE)
+            if os.path.exists(reservoir):
+                os.remove(reservoir)
+        _snapshot(dirs, lineage, mode='full', note='全量训练（4_train）')
+
+    model = load_artifact('model', dirs)
+    columns = list(model.feature_names_in_)
+    print(f"1. 读取新住院记录: {csv_path}")
+    X_new, y_new = load_new_stays(csv_path, dirs, columns)
+
+    res = load_reservoir(dirs, columns)
+    known = np.isin(np.asarray(X_new.index), res['ids'])
+    if known.any():
+        # 只能检查蓄水池里的住院，抽样之外的历史住院无法识别
+        print(f"   ⚠️ {int(known.sum())} 个住院已在历史样本中，跳过")
+        X_new, y_new = X_new[~known], y_new[~known]
+    if len(X_new) == 0:
+        print("✅ 没有新的住院记录，模型保持不变")
+        return None
+    print(f"   新住院 {len(X_new)} 个，阳性 {int(np.sum(y_new))} 个")
+
+    # 更新前的模型在新数据上的表现：这批数据尚未参与训练，是真正的样本外评估
+    probs = model.predict_proba(X_new)[:, 1]
+    before = {'f1': float(f1_score(y_new, model.predict(X_new), zero_division=0))}
+    if len(np.unique(y_new)) > 1:
+        before['auc'] = float(roc_auc_score(y_new, probs))
+    print(f"2. 当前模型在新数据上的表现: {before}")
+
+
+    print(f"3. 增量更新（{mode}）...")
+    start = time.perf_counter()
+    if mode == 'trees':
+        model, detail = grow(model, X_new, y_new)
+    else:
+        model, detail = refit(model, res, X_new, y_new)
+    elapsed = time.perf_counter() - start
+    print(f"   {detail}，耗时 {elapsed:.1f} 秒")
+
+    save_artifact('model', model, dirs)
+    _sync_train_record(dirs)
+    save_reservoir(dirs, update_reservoir(res, X_new, y_new, PARAMS['random_state'] + len(lineage)))
+    entry = _snapshot(dirs, lineage, mode=mode, detail=detail, source=os.path.abspath(csv_path),
+                      new_stays=int(len(X_new)), data_digest=data_digest(X_new, y_new),
+                      seconds=round(elapsed, 2), before=before)
+    print(f"✅ 模型已更新为版本 {entry['version']}（父版本 {entry['parent']}），"
+          f"回滚：python -m sepsis.update --rollback {entry['parent']}")
+    return entry
+
+
+def rollback(version, dirs=None):
+    """恢复到某个版本；回滚本身也记一条血缘，可以再滚回来"""
+    dirs = dirs or get_dirs()
+    lineage = read_lineage(dirs)
+    target = next((e for e in lineage if e['version'] == version), None)
+    if target is None:
+        raise ValueError(f"没有版本 {version}（现有: {[e['version'] for e in lineage]}）")
+    path = os.path.join(dirs.models, target['path'])
+    if cache.file_digest(path)['digest'] != target['digest']:
+        raise ValueError(f"版本 {version} 的模型文件已被改动，拒绝回滚")
+    shutil.copy2(path, artifact_path('model', dirs))
+    _sync_train_record(dirs)
+    entry = _snapshot(dirs, lineage, mode='rollback', detail=f'回滚到版本 {version}', restored=version)
+    print(f"✅ 已回滚到版本 {version}（记录为版本 {entry['version']}）")
+    # 注意：蓄水池不随模型回滚，它只是历史数据的样本
+    return entry
+
+
+def print_history(dirs=None):
+    lineage = read_lineage(get_dirs() if dirs is None else dirs)
+    if not lineage:
+        print("（还没有增量更新记录）")
+    for e in lineage:
+        extra = e.get('detail') or e.get('note', '')
+        print(f"v{e['version']:<4} 父 {str(e['parent']):<5} {e['created']}  {e['mode']:<9} {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用新住院记录增量更新模型")
+    parser.add_argument('csv', nargs='?', help="新住院记录（与 training_data.csv 同样的列）")
+    parser.add_argument('--mode', choices=['trees', 'reservoir'], default=None)
+    parser.add_argument('--rollback', type=int, metavar='VERSION', help="回滚到指定版本")
+    parser.add_argument('--history', action='store_true', help="查看版本血缘")
+    args = parser.parse_args()
+
+    if args.history:
+        print_history()
+    elif args.rollback is not None:
+        rollback(args.rollback)
+    elif args.csv:
+        update(args.csv, args.mode)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()